@@ -0,0 +1,157 @@
+"""
+Load test of the integration's polling and push paths against simulated devices (see simulator.py), all on localhost.
+Every virtual device is polled through WibeeeAPI by a shared PollScheduler and pushes to a Nest proxy app, and both
+feed the device's readings into a SensorBatch whose sensors record when their state gets written.
+
+Reports poll throughput and latency, push-to-state latency percentiles (from sending the push to the sensors' states
+being written) and event loop lag.
+
+Usage: PYTHONPATH=custom_components:benchmarks python benchmarks/bench_load.py [--devices 50] [--duration 60] [--push-rate 10] ...
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from simulator import DeviceSimulator, PushDriver, create_devices, add_simulator_arguments, simulator_config, DEFAULT_FIXTURES
+from wibeee.api import WibeeeAPI
+from wibeee.const import NEST_NULL_UPSTREAM, MAX_CONCURRENT_POLLS
+from wibeee.nest import NestProxy, create_nest_app
+from wibeee.readings import ReadingLayout, DeviceReadings
+from wibeee.scheduler import PollScheduler
+from wibeee.sensor import SensorBatch, get_status_elements, get_push_param
+
+
+class StateProbe(object):
+    """Stands in for a WibeeeSensor, counting the state writes that a SensorBatch makes."""
+    __slots__ = ('slot', 'hass', 'writes')
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.hass = True
+        self.writes = 0
+
+    def update_value(self, value: float, now: float) -> bool:
+        return True
+
+    def async_write_ha_state(self) -> None:
+        self.writes += 1
+
+
+def percentiles(samples: list[float], pcts=(50, 95, 99)) -> str:
+    if not samples:
+        return 'no samples'
+
+    ordered = sorted(samples)
+    stats = [f'p{pct}={ordered[min(len(ordered) - 1, len(ordered) * pct // 100)] * 1000:.1f}ms' for pct in pcts]
+    return ', '.join(stats + [f'max={ordered[-1] * 1000:.1f}ms'])
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.05) -> None:
+    """Measures how late the event loop wakes up from a sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+async def main(args: argparse.Namespace) -> None:
+    loop = asyncio.get_running_loop()
+    # PollScheduler and SensorBatch only need these bits of Home Assistant.
+    hass = SimpleNamespace(loop=loop, async_create_task=loop.create_task)
+
+    simulator = DeviceSimulator(create_devices(args.devices, args.fixtures or DEFAULT_FIXTURES), simulator_config(args))
+    await simulator.start()
+
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+    nest_proxy = NestProxy()
+    runner = web.AppRunner(create_nest_app(nest_proxy, session), access_log=None)
+    await runner.setup()
+    proxy_site = web.TCPSite(runner, '127.0.0.1', 0)
+    await proxy_site.start()
+    proxy_url = f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+    scheduler = PollScheduler(hass, args.max_concurrent)
+    poll_latencies: list[float] = []
+    push_latencies: list[float] = []
+    loop_lag: list[float] = []
+    push_sent: dict[str, float] = {}
+    poll_counters = {'ok': 0, 'failed': 0}
+
+    for device in simulator.devices:
+        elements = get_status_elements(device.model)
+        layout = ReadingLayout([e.xml_name for e in elements], [get_push_param(e.phase, e.sensor_type) for e in elements])
+        readings = DeviceReadings(layout)
+        batch = SensorBatch(hass, device.mac, layout.size)
+        for slot in range(layout.size):
+            batch.add_sensor(StateProbe(slot))
+
+        api = WibeeeAPI(session, device.host, timedelta(seconds=args.timeout))
+
+        async def poll(now, api=api, readings=readings, batch=batch):
+            started = time.perf_counter()
+            try:
+                values = await api.async_fetch_values('WIBEEE', readings.layout.poll_vars)
+            except Exception:
+                poll_counters['failed'] += 1
+                return
+
+            poll_latencies.append(time.perf_counter() - started)
+            poll_counters['ok'] += 1
+            batch.update(readings, readings.ingest_poll(values), values)
+
+        def handle_push(data: dict, readings=readings, batch=batch):
+            batch.update(readings, readings.ingest_push(data), data)
+            sent = push_sent.pop(data['mac'], None)
+            if sent is not None:
+                # runs after the batch has written the states, as loop callbacks run in the order they were scheduled.
+                loop.call_soon(lambda: push_latencies.append(time.perf_counter() - sent))
+
+        nest_proxy.register_device(device.mac, handle_push, NEST_NULL_UPSTREAM)
+        scheduler.add(device.mac, poll, timedelta(seconds=args.scan_interval))
+
+    def on_send(mac: str) -> None:
+        push_sent[mac] = time.perf_counter()
+
+    lag_monitor = asyncio.create_task(monitor_loop_lag(loop_lag))
+    driver = PushDriver(session, proxy_url, simulator.devices, args.push_rate, on_send=on_send)
+    started = time.perf_counter()
+    try:
+        if args.push_rate > 0:
+            await driver.run(args.duration)
+        await asyncio.sleep(max(0.0, args.duration - (time.perf_counter() - started)))
+    finally:
+        elapsed = time.perf_counter() - started
+        scheduler.stop()
+        lag_monitor.cancel()
+        await runner.cleanup()
+        await session.close()
+        await simulator.stop()
+
+    print(f'{args.devices} devices for {elapsed:.1f}s, polling every {args.scan_interval}s, {args.push_rate} pushes/s')
+    print(f'Polls:      {poll_counters["ok"] / elapsed:.1f}/s ok, {poll_counters}, scheduler {scheduler.counters}')
+    print(f'Poll time:  {percentiles(poll_latencies)}')
+    print(f'Pushes:     {driver.counters}')
+    print(f'Push→state: {percentiles(push_latencies)}')
+    print(f'Loop lag:   {percentiles(loop_lag)}')
+    print(f'Simulator:  {simulator.counters}')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_simulator_arguments(arg_parser)
+    arg_parser.add_argument('--duration', type=float, default=30, help='seconds to run for')
+    arg_parser.add_argument('--scan-interval', type=float, default=5, help='seconds between polls of each device')
+    arg_parser.add_argument('--timeout', type=float, default=10, help='request timeout in seconds')
+    arg_parser.add_argument('--max-concurrent', type=int, default=MAX_CONCURRENT_POLLS, help='maximum number of polls in flight')
+    arg_parser.add_argument('--push-rate', type=float, default=10, help='pushes per second across all devices')
+    arg_parser.add_argument('--log-level', default='CRITICAL', help='failed requests are logged as errors')
+    parsed_args = arg_parser.parse_args()
+    logging.basicConfig(level=parsed_args.log_level)
+    asyncio.run(main(parsed_args))
@@ -0,0 +1,53 @@
+"""
+Micro-benchmark for the values.xml parser.
+
+Usage: PYTHONPATH=custom_components python benchmarks/bench_parse_values.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+from wibeee.util import parse_flat_xml
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+FIXTURES = [
+    os.path.join(_ROOT_DIR, 'examples', 'wibeee_3phases.xml'),
+    os.path.join(_ROOT_DIR, 'tests', 'test_api_values.xml'),
+]
+
+
+def parse_xmltodict(xml_data: bytes) -> dict:
+    """The previous implementation: build the whole document with xmltodict and flatten it afterwards."""
+    import xmltodict
+    doc = xmltodict.parse(xml_data)
+    root = next(iter(doc.values()))
+    variables = root.get('variable')
+    if variables is None:
+        return dict(root)
+
+    return {var['id']: var['value'] for var in (variables if isinstance(variables, list) else [variables])}
+
+
+def main(iterations: int) -> None:
+    parsers = {'parse_flat_xml': parse_flat_xml}
+    try:
+        import xmltodict  # noqa: F401
+        parsers['xmltodict'] = parse_xmltodict
+    except ImportError:
+        print('xmltodict not installed, only benchmarking parse_flat_xml')
+
+    for fixture in FIXTURES:
+        with open(fixture, 'rb') as f:
+            xml_data = f.read()
+
+        expected = parse_flat_xml(xml_data)
+        print(f'{os.path.relpath(fixture, _ROOT_DIR)}: {len(xml_data)} bytes, {len(expected)} values')
+        for name, parse in parsers.items():
+            assert parse(xml_data) == expected, f'{name} disagrees with parse_flat_xml'
+            total = min(timeit.repeat(lambda: parse(xml_data), number=iterations, repeat=5))
+            print(f'  {name:<16} {total / iterations * 1e6:8.1f} µs/parse')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark for dispatching Nest push data to sensors, comparing a scan of the device's sensor list for the ones
+whose push parameter is in the push (the baseline) with the ways of matching the push against the push key index in
+ReadingLayout: scanning the index, intersecting the key sets, and walking the push (which DeviceReadings.ingest_push
+does). Every sensor is pushed, and every device receives a push with all of its sensors' parameters while the number
+of sensors per device and the number of devices grow.
+
+Usage: PYTHONPATH=custom_components python benchmarks/bench_push_dispatch.py [iterations]
+"""
+import sys
+import timeit
+
+from wibeee.readings import ReadingLayout, DeviceReadings, to_float
+from wibeee.sensor import get_status_elements, get_push_param
+
+
+class FakeSensor(object):
+    __slots__ = ('status_xml_param', 'nest_push_param', 'value')
+
+    def __init__(self, status_xml_param, nest_push_param):
+        self.status_xml_param = status_xml_param
+        self.nest_push_param = nest_push_param
+        self.value = None
+
+    def update_value(self, value):
+        self.value = value
+
+
+def make_device(sensor_count: int):
+    """The sensors of a 3-phase device, padded with pushed sensors of their own up to sensor_count."""
+    sensors = [FakeSensor(e.xml_name, get_push_param(e.phase, e.sensor_type)) for e in get_status_elements()]
+    sensors += [FakeSensor(f'extra{n}', f'x{n}') for n in range(sensor_count - len(sensors))]
+    layout = ReadingLayout([s.status_xml_param for s in sensors], [s.nest_push_param for s in sensors])
+    return sensors, DeviceReadings(layout)
+
+
+def make_push(sensors) -> dict:
+    """A receiverLeap-like push containing every pushed variable plus the usual device info."""
+    push = {'mac': '001122334455', 'ip': '10.10.10.100', 'soft': '4.4.124', 'model': 'WBT', 'time': '1700000000'}
+    push.update({s.nest_push_param: '123.45' for s in sensors if s.nest_push_param})
+    return push
+
+
+def dispatch_scan_sensors(sensors, push: dict) -> None:
+    """The baseline without a push index: scans the device's sensors for the ones whose parameter is in the push."""
+    for sensor in sensors:
+        if sensor.nest_push_param in push:
+            sensor.update_value(to_float(push[sensor.nest_push_param]))
+
+
+def ingest_scan_index(readings: DeviceReadings, push: dict) -> list[int]:
+    """Scans every known push parameter and looks it up in the push."""
+    values, push_mask = readings.values, readings.push_mask
+    updated = []
+    for var, slots in readings.layout.push_index.items():
+        if var in push:
+            value = to_float(push[var])
+            for slot in slots:
+                values[slot] = value
+                push_mask[slot] = 1
+            updated.extend(slots)
+    return updated
+
+
+def ingest_key_intersection(readings: DeviceReadings, push: dict) -> list[int]:
+    """Intersects the push keys with the known push parameters, which allocates a set on every push."""
+    values, push_mask, push_index = readings.values, readings.push_mask, readings.layout.push_index
+    updated = []
+    for var in push_index.keys() & push.keys():
+        slots = push_index[var]
+        value = to_float(push[var])
+        for slot in slots:
+            values[slot] = value
+            push_mask[slot] = 1
+        updated.extend(slots)
+    return updated
+
+
+def ingest_walk_push(readings: DeviceReadings, push: dict) -> list[int]:
+    """DeviceReadings.ingest_push: walks the push and looks each key up in the push index."""
+    return readings.ingest_push(push)
+
+
+def main(iterations: int) -> None:
+    for sensor_count in [48, 192, 768]:
+        for device_count in [1, 10, 100]:
+            devices = {f'{n:012x}': make_device(sensor_count) for n in range(device_count)}
+            pushes = [(mac, make_push(sensors)) for mac, (sensors, _) in devices.items()]
+
+            def run_baseline():
+                for mac, push in pushes:
+                    dispatch_scan_sensors(devices[mac][0], push)
+
+            total = min(timeit.repeat(run_baseline, number=iterations, repeat=3))
+            results = [f'{dispatch_scan_sensors.__name__} {total / iterations / device_count * 1e6:6.2f} µs/push']
+            for ingest in [ingest_scan_index, ingest_key_intersection, ingest_walk_push]:
+                def run():
+                    for mac, push in pushes:
+                        sensors, readings = devices[mac]
+                        values = readings.values
+                        for slot in ingest(readings, push):
+                            sensors[slot].update_value(values[slot])
+
+                total = min(timeit.repeat(run, number=iterations, repeat=3))
+                results.append(f'{ingest.__name__} {total / iterations / device_count * 1e6:6.2f} µs/push')
+
+            print(f'{sensor_count:4d} sensors, {device_count:3d} devices: ' + ', '.join(results))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
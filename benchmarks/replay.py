@@ -0,0 +1,143 @@
+"""
+Replays a traffic capture (see the capture_traffic option and capture.py) through the integration's pipeline on
+localhost: poll responses are parsed and ingested into each device's readings, and push requests are sent to a Nest
+proxy app, which decodes (and repairs) them and dispatches them to the device's readings. All of them end up in a
+SensorBatch whose sensors count the state writes.
+
+Records are replayed at their original pace divided by --speed, or as fast as possible with --speed 0.
+
+Usage: PYTHONPATH=custom_components:benchmarks python benchmarks/replay.py wibeee_capture.jsonl [--speed 10]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qsl
+
+import aiohttp
+from aiohttp import web
+
+from bench_load import StateProbe, percentiles, monitor_loop_lag
+from wibeee.capture import read_capture, CaptureRecord, POLL, PUSH
+from wibeee.const import NEST_NULL_UPSTREAM
+from wibeee.nest import NestProxy, create_nest_app, json_loads, repair_json
+from wibeee.readings import ReadingLayout, DeviceReadings
+from wibeee.sensor import SensorBatch, get_status_elements, get_push_param
+from wibeee.util import parse_flat_xml
+
+
+class ReplayDevice(object):
+    """Readings and a SensorBatch for every sensor that the integration knows about."""
+
+    def __init__(self, hass, name: str):
+        elements = get_status_elements()
+        self.readings = DeviceReadings(ReadingLayout([e.xml_name for e in elements], [get_push_param(e.phase, e.sensor_type) for e in elements]))
+        self.batch = SensorBatch(hass, name, self.readings.layout.size)
+        for slot in range(self.readings.layout.size):
+            self.batch.add_sensor(StateProbe(slot))
+
+
+def push_mac(record: CaptureRecord) -> str:
+    """The MAC address that a captured push request came from."""
+    if record.method == 'GET':
+        return dict(parse_qsl(urlsplit(record.path).query)).get('mac')
+
+    try:
+        return json_loads(record.body).get('mac')
+    except ValueError:
+        return json_loads(repair_json(record.body)).get('mac')
+
+
+async def main(args: argparse.Namespace) -> None:
+    records = list(read_capture(args.capture))
+    if not records:
+        print(f'No records in {args.capture}')
+        return
+
+    loop = asyncio.get_running_loop()
+    hass = SimpleNamespace(loop=loop, async_create_task=loop.create_task)
+    nest_proxy = NestProxy()
+    devices: dict[str, ReplayDevice] = {}
+
+    def get_device(key: str) -> ReplayDevice:
+        device = devices.get(key)
+        if device is None:
+            device = devices[key] = ReplayDevice(hass, key)
+        return device
+
+    for mac in {push_mac(r) for r in records if r.kind == PUSH}:
+        device = get_device(mac)
+
+        def handle_push(data: dict, device=device):
+            device.batch.update(device.readings, device.readings.ingest_push(data), data)
+
+        nest_proxy.register_device(mac, handle_push, NEST_NULL_UPSTREAM)
+
+    session = aiohttp.ClientSession()
+    runner = web.AppRunner(create_nest_app(nest_proxy, session), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    proxy_url = f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+    parse_times: list[float] = []
+    push_times: list[float] = []
+    push_statuses: dict[int, int] = {}
+    loop_lag: list[float] = []
+
+    def replay_poll(record: CaptureRecord) -> None:
+        started = time.perf_counter()
+        values = parse_flat_xml(record.body)
+        parse_times.append(time.perf_counter() - started)
+        device = get_device(record.source)
+        device.batch.update(device.readings, device.readings.ingest_poll(values), values)
+
+    async def replay_push(record: CaptureRecord) -> None:
+        started = time.perf_counter()
+        async with session.request(record.method, f'{proxy_url}{record.path}', data=record.body) as res:
+            await res.read()
+        push_times.append(time.perf_counter() - started)
+        push_statuses[res.status] = push_statuses.get(res.status, 0) + 1
+
+    lag_monitor = asyncio.create_task(monitor_loop_lag(loop_lag))
+    first_time = records[0].time
+    started = time.perf_counter()
+    pushes = set()
+    for record in records:
+        if args.speed > 0:
+            await asyncio.sleep(max(0.0, (record.time - first_time) / args.speed - (time.perf_counter() - started)))
+
+        if record.kind == POLL:
+            replay_poll(record)
+        else:
+            task = asyncio.create_task(replay_push(record))
+            pushes.add(task)
+            task.add_done_callback(pushes.discard)
+            if args.speed == 0:
+                await task
+
+    if pushes:
+        await asyncio.wait(pushes)
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    lag_monitor.cancel()
+    await runner.cleanup()
+    await session.close()
+
+    writes = sum(device.batch.stats['writes'] for device in devices.values())
+    print(f'Replayed {len(records)} records ({records[-1].time - first_time:.1f}s of traffic) in {elapsed:.2f}s for {len(devices)} devices')
+    print(f'Poll parse: {len(parse_times)} responses, {percentiles(parse_times)}')
+    print(f'Push:       {len(push_times)} requests {push_statuses}, {percentiles(push_times)}')
+    print(f'States:     {writes} writes')
+    print(f'Loop lag:   {percentiles(loop_lag)}')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('capture', help='capture file, its previous segment (.1) is replayed first if present')
+    arg_parser.add_argument('--speed', type=float, default=1.0, help='replay speed-up, 0 to replay as fast as possible')
+    arg_parser.add_argument('--log-level', default='CRITICAL')
+    parsed_args = arg_parser.parse_args()
+    logging.basicConfig(level=parsed_args.log_level)
+    asyncio.run(main(parsed_args))
@@ -0,0 +1,291 @@
+"""
+Simulates Wibeee devices on localhost. Every virtual device listens on its own port and serves devices.xml and
+values.xml (including `var=` queries) built from a fixture, with configurable latency, jitter and rates of errors and
+requests that never get an answer. A PushDriver sends the devices' receiver, receiverLeap and receiverJSON pushes to
+a Nest proxy at a configurable rate.
+
+Fixtures are either values.xml documents (e.g. tests/test_api_values.xml) or status.xml documents (e.g. the ones in
+examples/), whose `faseN_*` elements are mapped to the equivalent values.xml variables.
+
+Usage: PYTHONPATH=custom_components python benchmarks/simulator.py [--devices N] [--push-to http://host:8600] ...
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import time
+from typing import NamedTuple, Optional, Callable
+from urllib.parse import unquote_plus
+
+import aiohttp
+from aiohttp import web
+
+from wibeee.sensor import get_status_elements, get_push_param
+from wibeee.util import parse_flat_xml
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+DEFAULT_FIXTURES = [
+    os.path.join(_ROOT_DIR, 'tests', 'test_api_values.xml'),
+    os.path.join(_ROOT_DIR, 'examples', 'wibeee_3phases.xml'),
+    os.path.join(_ROOT_DIR, 'examples', 'mirubee_moti_1.xml'),
+]
+
+PUSH_KINDS = ['receiver', 'receiverLeap', 'receiverJSON']
+
+_STATUS_ELEMENT = re.compile(r'fase([1-4])_(\w+)')
+
+_STATUS_TO_VALUES_VAR = {
+    'vrms': 'vrms',
+    'irms': 'irms',
+    'frecuencia': 'freq',
+    'p_activa': 'pac',
+    'p_aparent': 'pap',
+    'p_reactiva_ind': 'preac',
+    'factor_potencia': 'fpot',
+    'energia_activa': 'eac',
+    'energia_reactiva_ind': 'ereact',
+    'energia_reactiva_cap': 'ereactc',
+}
+"""status.xml element suffix to values.xml variable prefix."""
+
+
+class SimulatorConfig(NamedTuple):
+    latency: float = 0.02
+    "seconds before a device starts answering"
+    jitter: float = 0.02
+    "random extra latency in seconds, up to this much"
+    error_rate: float = 0.0
+    "fraction of requests that are answered with a 500"
+    timeout_rate: float = 0.0
+    "fraction of requests that are not answered for `hang_secs`, so that the client times out"
+    hang_secs: float = 60.0
+
+
+def load_fixture(path: str) -> tuple[str, dict[str, str]]:
+    """Returns the model and the measurement variables of a values.xml or status.xml fixture."""
+    with open(path, 'rb') as f:
+        doc = parse_flat_xml(f.read())
+
+    measurements = {}
+    for name, value in doc.items():
+        match = _STATUS_ELEMENT.fullmatch(name)
+        if match is None:
+            measurements[name] = value
+        elif match.group(2) in _STATUS_TO_VALUES_VAR:
+            phase = 't' if match.group(1) == '4' else match.group(1)
+            measurements[f'{_STATUS_TO_VALUES_VAR[match.group(2)]}{phase}'] = value
+
+    # status.xml fixtures have no model, they come from 3-phase devices.
+    model = measurements.pop('model', None) or 'WBT'
+    for var in ['macAddr', 'ipAddr', 'softVersion', 'securKey', 'ssid']:
+        measurements.pop(var, None)
+
+    return model, measurements
+
+
+class VirtualDevice(object):
+    def __init__(self, n: int, model: str, measurements: dict[str, str]):
+        self.mac = f'0011220{n:05x}'
+        self.model = model
+        self.soft_version = '4.4.124'
+        self.port: Optional[int] = None
+        self._measurements = measurements
+        self._elements = [(e.xml_name, get_push_param(e.phase, e.sensor_type)) for e in get_status_elements(model)]
+
+    @property
+    def host(self) -> str:
+        return f'127.0.0.1:{self.port}'
+
+    def values(self) -> dict[str, str]:
+        """The device's values.xml variables, with measurements that vary a little from one reading to the next."""
+        values = {
+            'model': self.model,
+            'softVersion': self.soft_version,
+            'macAddr': ':'.join(self.mac[i:i + 2] for i in range(0, 12, 2)),
+            'ipAddr': '127.0.0.1',
+            'securKey': 'secret',
+            'ssid': 'simulated',
+        }
+        for var, value in self._measurements.items():
+            try:
+                values[var] = f'{float(value) * random.uniform(0.99, 1.01):.2f}'
+            except (TypeError, ValueError):
+                values[var] = value
+
+        return values
+
+    def push_params(self) -> dict[str, str]:
+        """The parameters of a push, as the device sends them to the Wibeee Cloud."""
+        values = self.values()
+        params = {'mac': self.mac, 'ip': '127.0.0.1', 'soft': self.soft_version, 'model': self.model, 'time': str(int(time.time()))}
+        params.update({push: values[var] for var, push in self._elements if push is not None and var in values})
+        return params
+
+
+def devices_xml() -> bytes:
+    return b'<devices><id>WIBEEE</id></devices>'
+
+
+def values_xml(values: dict[str, str], var_names: Optional[list[str]]) -> bytes:
+    names = values.keys() if var_names is None else [var for var in var_names if var in values]
+    variables = ''.join(f'<variable><id>{var}</id><value>{values[var]}</value></variable>' for var in names)
+    return f'<values>{variables}</values>'.encode()
+
+
+class DeviceSimulator(object):
+    """Serves `devices` on localhost, each one on its own port."""
+
+    def __init__(self, devices: list[VirtualDevice], config: SimulatorConfig = SimulatorConfig()):
+        self.devices = devices
+        self.config = config
+        self.counters = {'requests': 0, 'errors': 0, 'timeouts': 0}
+        self._by_port: dict[int, VirtualDevice] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.add_routes([
+            web.get('/services/user/devices.xml', self._handle_devices),
+            web.get('/services/user/values.xml', self._handle_values),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        for device in self.devices:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            device.port = sock.getsockname()[1]
+            self._by_port[device.port] = device
+            await web.SockSite(self._runner, sock).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle_devices(self, req: web.Request) -> web.StreamResponse:
+        return await self._respond(devices_xml)
+
+    async def _handle_values(self, req: web.Request) -> web.StreamResponse:
+        device = self._by_port[req.transport.get_extra_info('sockname')[1]]
+        # var=WIBEEE.vrms1&WIBEEE.vrms2 is not a regular query string, so it's parsed by hand.
+        query = req.query_string
+        var_names = [unquote_plus(var_id).split('.', 1)[-1] for var_id in query[4:].split('&')] if query.startswith('var=') else None
+        return await self._respond(lambda: values_xml(device.values(), var_names))
+
+    async def _respond(self, body: Callable[[], bytes]) -> web.StreamResponse:
+        config = self.config
+        self.counters['requests'] += 1
+        await asyncio.sleep(config.latency + random.uniform(0, config.jitter))
+
+        roll = random.random()
+        if roll < config.timeout_rate:
+            self.counters['timeouts'] += 1
+            await asyncio.sleep(config.hang_secs)
+        elif roll < config.timeout_rate + config.error_rate:
+            self.counters['errors'] += 1
+            return web.Response(status=500)
+
+        return web.Response(body=body(), content_type='text/xml')
+
+
+class PushDriver(object):
+    """
+    Sends pushes from `devices` to a Nest proxy at `rate` pushes per second in total, going round the devices and
+    cycling through the push kinds. `on_send` is called with the device's MAC address right before each push is sent.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, proxy_url: str, devices: list[VirtualDevice], rate: float,
+                 kinds: list[str] = PUSH_KINDS, on_send: Callable[[str], None] = None):
+        self.session = session
+        self.proxy_url = proxy_url
+        self.devices = devices
+        self.rate = rate
+        self.kinds = kinds
+        self.on_send = on_send
+        self.counters = {'sent': 0, 'accepted': 0, 'failed': 0}
+
+    async def run(self, duration: float) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = set()
+        for n, (device, kind) in enumerate(zip(itertools.cycle(self.devices), itertools.cycle(self.kinds))):
+            due = started + n / self.rate
+            if due - started >= duration:
+                break
+
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            task = asyncio.create_task(self._push(device, kind))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _push(self, device: VirtualDevice, kind: str) -> None:
+        params = device.push_params()
+        self.counters['sent'] += 1
+        if self.on_send is not None:
+            self.on_send(device.mac)
+
+        try:
+            if kind == 'receiverJSON':
+                request = self.session.post(f'{self.proxy_url}/Wibeee/receiverJSON', data=json.dumps(params))
+            else:
+                request = self.session.get(f'{self.proxy_url}/Wibeee/{kind}', params=params)
+
+            async with request as res:
+                await res.read()
+                self.counters['accepted' if res.status < 300 else 'failed'] += 1
+        except aiohttp.ClientError:
+            self.counters['failed'] += 1
+
+
+def create_devices(count: int, fixtures: list[str] = DEFAULT_FIXTURES) -> list[VirtualDevice]:
+    """Creates `count` virtual devices, going round the fixtures."""
+    loaded = [load_fixture(path) for path in fixtures]
+    return [VirtualDevice(n, *loaded[n % len(loaded)]) for n in range(count)]
+
+
+def add_simulator_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--devices', type=int, default=10, help='number of virtual devices')
+    parser.add_argument('--fixture', action='append', dest='fixtures', help='values.xml or status.xml fixture (repeatable)')
+    parser.add_argument('--latency', type=float, default=SimulatorConfig._field_defaults['latency'], help='response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=SimulatorConfig._field_defaults['jitter'], help='random extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction of requests that are never answered')
+
+
+def simulator_config(args: argparse.Namespace) -> SimulatorConfig:
+    return SimulatorConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, timeout_rate=args.timeout_rate)
+
+
+async def main(args: argparse.Namespace) -> None:
+    simulator = DeviceSimulator(create_devices(args.devices, args.fixtures or DEFAULT_FIXTURES), simulator_config(args))
+    await simulator.start()
+    for device in simulator.devices:
+        print(f'{device.model} {device.mac} on http://{device.host}')
+
+    try:
+        if args.push_to:
+            async with aiohttp.ClientSession() as session:
+                driver = PushDriver(session, args.push_to, simulator.devices, args.push_rate)
+                await driver.run(args.duration)
+                print(f'Pushes: {driver.counters}')
+        else:
+            await asyncio.sleep(args.duration)
+    finally:
+        print(f'Requests: {simulator.counters}')
+        await simulator.stop()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_simulator_arguments(arg_parser)
+    arg_parser.add_argument('--push-to', help='URL of a Nest proxy to push to, e.g. http://127.0.0.1:8600')
+    arg_parser.add_argument('--push-rate', type=float, default=1.0, help='pushes per second across all devices')
+    arg_parser.add_argument('--duration', type=float, default=3600, help='seconds to run for')
+    asyncio.run(main(arg_parser.parse_args()))
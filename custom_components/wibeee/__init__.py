@@ -9,7 +9,10 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
 
-from .const import DOMAIN, CONF_NEST_UPSTREAM, NEST_PROXY_DISABLED, NEST_DEFAULT_UPSTREAM
+from .cache import DeviceCache
+from .const import DOMAIN, CONF_NEST_UPSTREAM, NEST_PROXY_DISABLED, NEST_DEFAULT_UPSTREAM, CONF_SITE
+from .external_statistics import get_statistics_store
+from .site import async_remove_site_store
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -57,6 +60,16 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     return dispose_ok and unload_ok
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the cached device info and statistics sums, or the site totals, when a config entry is removed."""
+    if entry.data.get(CONF_SITE):
+        await async_remove_site_store(hass)
+        return
+
+    await DeviceCache(hass, entry.entry_id).async_remove()
+    await get_statistics_store(hass, entry.entry_id).async_remove()
+
+
 async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Update options."""
     await hass.config_entries.async_reload(entry.entry_id)
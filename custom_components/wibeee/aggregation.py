@@ -0,0 +1,96 @@
+import math
+from array import array
+from datetime import timedelta
+from typing import Iterable, Sequence, Optional
+
+from .readings import DeviceReadings, NAN
+
+MEAN = 'mean'
+LAST = 'last'
+ALL_AGGREGATIONS = [MEAN, LAST]
+
+WINDOW_MAX_SAMPLES = 256
+"""Samples kept per sensor in each window, the oldest ones are overwritten if a device pushes faster than that."""
+
+
+class WindowAggregator(object):
+    """
+    Aggregates high-frequency push data over a fixed window so that sensors are written once per window instead of
+    once per push. Every slot of the device's `ReadingLayout` gets a fixed-size ring buffer in one flat array of
+    doubles, and at the end of each window the buffered samples are reduced to their mean (or last value) plus their
+    min and max, using C-level reductions over array slices. Slots in `last_slots` (e.g.: energy counters) always use
+    their last value, as averaging a counter makes no sense.
+    """
+
+    def __init__(self, readings: DeviceReadings, window: timedelta, aggregation: str = MEAN, last_slots: Iterable[int] = (),
+                 max_samples: int = WINDOW_MAX_SAMPLES):
+        size = readings.layout.size
+        self.window = window
+        self.aggregation = aggregation
+        self.capacity = max_samples
+        self.output = DeviceReadings(readings.layout)
+        "aggregated readings, which the sensors are updated from at the end of each window"
+        self.minimum = array('d', [NAN]) * size
+        "min of each slot in the last window"
+        self.maximum = array('d', [NAN]) * size
+        "max of each slot in the last window"
+        self.samples = array('l', [0]) * size
+        "samples of each slot in the last window"
+        self._buffer = array('d', [NAN]) * (size * max_samples)
+        self._count = array('l', [0]) * size
+        self._next = array('l', [0]) * size
+        self._use_last = bytearray(size)
+        for slot in last_slots:
+            self._use_last[slot] = 1
+        self.stats = {'samples': 0, 'overwritten': 0, 'windows': 0}
+
+    def add(self, values: Sequence[float], slots: Iterable[int]) -> None:
+        """Buffers the current value of `slots`, unavailable (NaN) values are skipped."""
+        buffer, count, next_index, capacity = self._buffer, self._count, self._next, self.capacity
+        added = 0
+        for slot in slots:
+            value = values[slot]
+            if value != value:
+                continue
+
+            i = next_index[slot]
+            buffer[slot * capacity + i] = value
+            next_index[slot] = (i + 1) % capacity
+            if count[slot] < capacity:
+                count[slot] += 1
+            else:
+                self.stats['overwritten'] += 1
+            added += 1
+
+        self.stats['samples'] += added
+
+    def reduce(self, source: str = 'Nest push') -> list[int]:
+        """
+        Ends the current window, storing the aggregate of each slot that got samples in `output`, `minimum`, `maximum`
+        and `samples`. Returns the slots that were updated.
+        """
+        buffer, count, next_index, capacity = self._buffer, self._count, self._next, self.capacity
+        use_mean = self.aggregation == MEAN
+        aggregated: dict[int, float] = {}
+        for slot, n in enumerate(count):
+            if n == 0:
+                continue
+
+            start = slot * capacity
+            samples = buffer[start:start + n]
+            last = buffer[start + (next_index[slot] - 1) % capacity]
+            aggregated[slot] = math.fsum(samples) / n if use_mean and not self._use_last[slot] else last
+            self.minimum[slot] = min(samples)
+            self.maximum[slot] = max(samples)
+            self.samples[slot] = n
+            count[slot] = next_index[slot] = 0
+
+        self.stats['windows'] += 1
+        return self.output.ingest_slots(aggregated, f'{source} ({self.aggregation} over {self.window.total_seconds():g}s)')
+
+    def window_attributes(self, slot: int) -> Optional[dict]:
+        """The min, max and number of samples of a slot in the last window, None if it has never had any."""
+        if not self.samples[slot]:
+            return None
+
+        return {'min': self.minimum[slot], 'max': self.maximum[slot], 'samples': self.samples[slot]}
@@ -1,15 +1,17 @@
 import asyncio
 import logging
+import time
 from datetime import timedelta
 from typing import NamedTuple, Optional, Dict
 from urllib.parse import quote_plus
 
 import aiohttp
-import xmltodict
 from homeassistant.components.diagnostics import async_redact_data
 from homeassistant.helpers.typing import StateType
 
-from .util import scrub_values_xml
+from .capture import TrafficCapture, POLL
+from .metrics import DeviceMetrics
+from .util import scrub_values_xml, scrub_values_xml_bytes, FlatXmlParser
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,6 +20,15 @@ StatusResponse = dict[str, StateType]
 _VALUES_SCRUB_KEYS = ['securKey', 'ssid']
 """Values that we'll attempt to scrub from the values.xml response."""
 
+_MAX_VAR_QUERY_LEN = 512
+"""Longest `var=` query that we'll send in a single values.xml request, longer queries are split into chunks."""
+
+_READ_CHUNK_SIZE = 4096
+"""Size of the chunks that are fed to the XML parser while reading a response."""
+
+_MIN_TIMEOUT = timedelta(seconds=1)
+"""Shortest timeout used for requests, however fast the device has been responding."""
+
 
 class DeviceInfo(NamedTuple):
     id: str
@@ -32,38 +43,126 @@ class DeviceInfo(NamedTuple):
     "IP address"
 
 
+class DeviceUnavailableError(Exception):
+    """Raised without contacting the device while its circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a device that keeps failing. After `failure_threshold` consecutive failed requests the
+    breaker opens and requests fail straight away. Once `probe_interval` has passed a single probe request is let
+    through (half-open): if it succeeds the breaker closes again, otherwise it stays open for another interval.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 2, probe_interval: timedelta = timedelta(seconds=60)):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+
+        if self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.probe_interval.total_seconds():
+            self.state = CircuitBreaker.HALF_OPEN
+            return True
+
+        return False
+
+    def record_success(self) -> None:
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """Records a failed request, returns True if this made the breaker open."""
+        self.failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            was_closed = self.state == CircuitBreaker.CLOSED
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+            return was_closed
+
+        return False
+
+
+class LatencyTracker(object):
+    """
+    Keeps an exponentially weighted moving average of response times and their variation (as TCP does for its
+    retransmission timeout) in order to derive a timeout that is tight for healthy devices.
+    """
+
+    def __init__(self, min_timeout: timedelta, max_timeout: timedelta):
+        self.min_timeout = min_timeout.total_seconds()
+        self.max_timeout = max_timeout.total_seconds()
+        self.average: Optional[float] = None
+        self.variation = 0.0
+
+    def record(self, latency: float) -> None:
+        if self.average is None:
+            self.average = latency
+            self.variation = latency / 2
+        else:
+            self.variation = 0.75 * self.variation + 0.25 * abs(self.average - latency)
+            self.average = 0.875 * self.average + 0.125 * latency
+
+    def timeout(self, try_n: int = 0) -> float:
+        """Timeout in seconds for a request, doubling with every retry. The maximum is used until there are samples."""
+        if self.average is None:
+            return self.max_timeout
+
+        return min(max(self.average + 4 * self.variation, self.min_timeout) * pow(2, try_n), self.max_timeout)
+
+
 class WibeeeAPI(object):
     """Gets the latest data from Wibeee device."""
 
-    def __init__(self, session: aiohttp.ClientSession, host: str, timeout: timedelta):
+    def __init__(self, session: aiohttp.ClientSession, host: str, timeout: timedelta, probe_interval: timedelta = timedelta(seconds=60),
+                 raw_log_sampling: int = 1):
         """Initialize the data object."""
         self.session = session
         self.host = host
         self.timeout = timeout
         self.min_wait = timedelta(milliseconds=100)
         self.max_wait = min(timedelta(seconds=5), timeout)
+        self.breaker = CircuitBreaker(probe_interval=probe_interval)
+        self.latency = LatencyTracker(min_timeout=min(_MIN_TIMEOUT, timeout), max_timeout=timeout)
+        self.metrics = DeviceMetrics()
+        self.raw_log_sampling = max(1, raw_log_sampling)
+        "log the raw body of 1 in this many responses when DEBUG is enabled"
+        self._responses = 0
+        self.capture: Optional[TrafficCapture] = None
+        "records the raw responses when set"
         _LOGGER.info("Initializing WibeeeAPI with host: %s, timeout %s, max_wait: %s", host, self.timeout, self.max_wait)
 
     async def async_fetch_values(self, device_id: str, var_names: list[str] = None, retries: int = 0) -> Dict[str, any]:
         """Fetches the values from Wibeee as a dict, optionally retries"""
         if var_names:
             var_ids = [f"{quote_plus(device_id)}.{quote_plus(var)}" for var in var_names]
-            query = f'var={"&".join(var_ids)}'
+            queries = [f'var={"&".join(chunk)}' for chunk in _chunk_var_ids(var_ids, _MAX_VAR_QUERY_LEN)]
         else:
-            query = f'id={quote_plus(device_id)}'
+            queries = [f'id={quote_plus(device_id)}']
 
-        values = await self.async_fetch_url(f'http://{self.host}/services/user/values.xml?{query}', retries, scrub_keys=_VALUES_SCRUB_KEYS)
+        values_vars = {}
+        for query in queries:
+            values = await self.async_fetch_url(f'http://{self.host}/services/user/values.xml?{query}', retries, scrub_keys=_VALUES_SCRUB_KEYS)
 
-        # <values><variable><id>macAddr</id><value>11:11:11:11:11:11</value></variable></values>
-        values_vars = {var['id']: var['value'] for var in values['values']['variable']}
+            # <values><variable><id>macAddr</id><value>11:11:11:11:11:11</value></variable></values>
+            values_vars.update(values)
 
         # attempt to scrub WiFi secrets before they make it into logs, etc.
         return async_redact_data(values_vars, _VALUES_SCRUB_KEYS)
 
-    async def async_fetch_device_info(self, retries: int = 0) -> Optional[DeviceInfo]:
-        # <devices><id>WIBEEE</id></devices>
-        devices = await self.async_fetch_url(f'http://{self.host}/services/user/devices.xml', retries)
-        device_id = devices['devices']['id']
+    async def async_fetch_device_info(self, retries: int = 0, device_id: str = None) -> Optional[DeviceInfo]:
+        """Fetches the device info, skipping the devices.xml request if the device ID is already known."""
+        if device_id is None:
+            # <devices><id>WIBEEE</id></devices>
+            devices = await self.async_fetch_url(f'http://{self.host}/services/user/devices.xml', retries)
+            device_id = devices['id']
 
         var_names = ['macAddr', 'softVersion', 'model', 'ipAddr']
         device_vars = await self.async_fetch_values(device_id, var_names, retries)
@@ -76,38 +175,112 @@ class WibeeeAPI(object):
             device_vars['ipAddr'],
         ) if set(var_names) <= set(device_vars.keys()) else None
 
-    async def async_fetch_url(self, url: str, retries: int = 0, scrub_keys: list[str] = []):
-        async def fetch_with_retries(try_n):
+    async def async_fetch_url(self, url: str, retries: int = 0, scrub_keys: list[str] = []) -> Dict[str, Optional[str]]:
+        """
+        Fetches a Wibeee XML document as a flat dict, optionally retries. Raises the last error if all attempts fail,
+        or DeviceUnavailableError without making a request while the device's circuit breaker is open.
+        """
+        metrics = self.metrics
+        if not self.breaker.allow_request():
+            metrics.counters['rejected'] += 1
+            raise DeviceUnavailableError(f'{self.host} is not responding, waiting to probe it again')
+
+        if self.breaker.state == CircuitBreaker.HALF_OPEN:
+            _LOGGER.debug("Probing %s", self.host)
+            retries = 0
+
+        for try_n in range(retries + 1):
             if try_n > 0:
                 wait = min(pow(2, try_n) * self.min_wait.total_seconds(), self.max_wait.total_seconds())
                 _LOGGER.debug("Waiting %0.3fs to retry %s...", wait, url)
                 await asyncio.sleep(wait)
+                metrics.counters['retries'] += 1
 
+            metrics.counters['requests'] += 1
+            started = time.monotonic()
             try:
-                resp = await self.session.get(url, timeout=self.timeout.total_seconds())
-                if resp.status != 200:
-                    raise aiohttp.ClientResponseError(
-                        resp.request_info,
-                        resp.history,
-                        status=resp.status,
-                        message=resp.reason,
-                        headers=resp.headers,
-                    )
-
-                xml_data = await resp.text()
-                if _LOGGER.isEnabledFor(logging.DEBUG):
-                    _LOGGER.debug("RAW Response from %s: %s)", url, scrub_values_xml(scrub_keys, await resp.read()))
-
-                xml_as_dict = xmltodict.parse(xml_data)
-                return xml_as_dict
+                result = await self._fetch_xml(url, self.latency.timeout(try_n), scrub_keys)
+
+            except asyncio.CancelledError:
+                if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                    # don't leave the breaker half-open forever, it is probed again after another interval.
+                    self.breaker.record_failure()
+                raise
 
             except Exception as exc:
-                if try_n == retries:
-                    retry_info = f' after {try_n} retries' if retries > 0 else ''
-                    _LOGGER.error('Error getting %s%s: %s: %s', url, retry_info, exc.__class__.__name__, exc)
-                    return {}
-                else:
+                metrics.counters['failures'] += 1
+                if try_n < retries:
                     _LOGGER.debug('Error getting %s, will retry. %s: %s', url, exc.__class__.__name__, exc)
-                    return await fetch_with_retries(try_n + 1)
+                    continue
+
+                was_probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+                retry_info = f' after {try_n} retries' if retries > 0 else ''
+                if self.breaker.record_failure():
+                    _LOGGER.warning('Error getting %s%s: %s: %s. Pausing requests to %s, will probe it every %s', url, retry_info,
+                                    exc.__class__.__name__, exc, self.host, self.breaker.probe_interval)
+                elif was_probe:
+                    _LOGGER.debug('Probe of %s failed: %s: %s', self.host, exc.__class__.__name__, exc)
+                else:
+                    _LOGGER.error('Error getting %s%s: %s: %s', url, retry_info, exc.__class__.__name__, exc)
+                raise
+
+            else:
+                latency = time.monotonic() - started
+                self.latency.record(latency)
+                metrics.latency.observe(latency)
+                if self.breaker.state != CircuitBreaker.CLOSED:
+                    _LOGGER.info('%s is responding again', self.host)
+                self.breaker.record_success()
+                return result
+
+    async def _fetch_xml(self, url: str, timeout: float, scrub_keys: list[str]) -> Dict[str, Optional[str]]:
+        async with self.session.get(url, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise aiohttp.ClientResponseError(
+                    resp.request_info,
+                    resp.history,
+                    status=resp.status,
+                    message=resp.reason,
+                    headers=resp.headers,
+                )
+
+            # parse the response as it arrives instead of building up the whole document first.
+            parser = FlatXmlParser()
+            self._responses += 1
+            log_raw = _LOGGER.isEnabledFor(logging.DEBUG) and (self._responses - 1) % self.raw_log_sampling == 0
+            raw_chunks = [] if log_raw or self.capture is not None else None
+            received = 0
+            parse_secs = 0.0
+            async for chunk in resp.content.iter_chunked(_READ_CHUNK_SIZE):
+                received += len(chunk)
+                started = time.perf_counter()
+                parser.feed(chunk)
+                parse_secs += time.perf_counter() - started
+                if raw_chunks is not None:
+                    raw_chunks.append(chunk)
+
+            if log_raw:
+                _LOGGER.debug("RAW Response from %s: %s)", url, scrub_values_xml(scrub_keys, b''.join(raw_chunks)))
+            if self.capture is not None:
+                self.capture.record(POLL, self.host, 'GET', resp.url.path_qs, scrub_values_xml_bytes(scrub_keys, b''.join(raw_chunks)))
+
+            started = time.perf_counter()
+            result = parser.close()
+            self.metrics.parse_time.observe(parse_secs + time.perf_counter() - started)
+            self.metrics.counters['bytes_received'] += received
+            return result
+
+
+def _chunk_var_ids(var_ids: list[str], max_len: int) -> list[list[str]]:
+    """Splits the `var=` ids into chunks whose joined length does not exceed max_len (a single long id is never split)."""
+    chunks: list[list[str]] = []
+    chunk_len = 0
+    for var_id in var_ids:
+        if chunks and chunk_len + 1 + len(var_id) <= max_len:
+            chunks[-1].append(var_id)
+            chunk_len += 1 + len(var_id)
+        else:
+            chunks.append([var_id])
+            chunk_len = len(var_id)
 
-        return await fetch_with_retries(0)
+    return chunks
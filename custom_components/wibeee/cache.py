@@ -0,0 +1,66 @@
+import logging
+import math
+import time
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .api import DeviceInfo
+from .const import DOMAIN
+from .readings import DeviceReadings
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+SAVE_INTERVAL = timedelta(minutes=5)
+"""Readings are written to storage at most this often."""
+
+
+class DeviceCache(object):
+    """
+    Persists a device's DeviceInfo, the variables that back its sensors and their last good values so that the sensors
+    can be created straight away the next time Home Assistant starts, without waiting for the device.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        self._store = Store(hass, STORAGE_VERSION, f'{DOMAIN}.{entry_id}')
+        self._last_save = 0.0
+
+    async def async_load(self) -> Optional[Tuple[DeviceInfo, dict[str, Optional[float]]]]:
+        """Returns the cached device and its last values by variable name, or None if nothing was cached."""
+        try:
+            cached = await self._store.async_load()
+            if cached is None:
+                return None
+
+            return DeviceInfo(**cached['device']), cached['values']
+
+        except Exception:
+            _LOGGER.warning("Ignoring invalid cache in %s", self._store.path, exc_info=True)
+            return None
+
+    async def async_save(self, device: DeviceInfo, readings: DeviceReadings) -> None:
+        """Saves the device and the latest readings of its sensors."""
+        self._last_save = time.monotonic()
+        await self._store.async_save(_cache_data(device, readings))
+
+    @callback
+    def async_schedule_save(self, device: DeviceInfo, readings: DeviceReadings) -> None:
+        """Saves the latest readings in the background, at most once every SAVE_INTERVAL."""
+        if time.monotonic() - self._last_save >= SAVE_INTERVAL.total_seconds():
+            self._last_save = time.monotonic()
+            self._store.async_delay_save(lambda: _cache_data(device, readings))
+
+    async def async_remove(self) -> None:
+        await self._store.async_remove()
+
+
+def _cache_data(device: DeviceInfo, readings: DeviceReadings) -> dict:
+    # NaN is not valid JSON so unavailable values are stored as None.
+    return {
+        'device': device._asdict(),
+        'values': {var: None if math.isnan(value) else value for var, value in zip(readings.layout.poll_vars, readings.values) if var is not None},
+    }
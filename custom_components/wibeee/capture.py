@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import NamedTuple, Optional, Iterator
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.typing import EventType
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_TRAFFIC_CAPTURE = 'traffic_capture'
+"""Key of the TrafficCapture in hass.data[DOMAIN]."""
+
+CAPTURE_FILE = 'wibeee_capture.jsonl'
+"""Name of the capture file in the Home Assistant config directory, the previous segment gets a `.1` suffix."""
+
+CAPTURE_MAX_RECORDS = 10000
+"""Records held in memory until they are written, the oldest ones are dropped if writing falls behind."""
+
+CAPTURE_MAX_BYTES = 10 * 1024 * 1024
+"""Size at which the capture file is rotated, so the capture never takes up more than twice this."""
+
+CAPTURE_FLUSH_INTERVAL = timedelta(seconds=10)
+
+POLL = 'poll'
+PUSH = 'push'
+
+
+class CaptureRecord(NamedTuple):
+    time: float
+    "time.time() when the traffic was seen"
+    kind: str
+    "POLL or PUSH"
+    source: str
+    "device host for polls, remote address for pushes"
+    method: str
+    path: str
+    "path and query string"
+    body: Optional[bytes]
+
+    def to_line(self) -> str:
+        # bodies are stored as latin-1 so that any bytes, including invalid UTF-8, make it through JSON unchanged.
+        body = self.body.decode('latin-1') if self.body is not None else None
+        return json.dumps([round(self.time, 3), self.kind, self.source, self.method, self.path, body], separators=(',', ':')) + '\n'
+
+    @staticmethod
+    def from_line(line: str) -> 'CaptureRecord':
+        t, kind, source, method, path, body = json.loads(line)
+        return CaptureRecord(t, kind, source, method, path, body.encode('latin-1') if body is not None else None)
+
+
+class TrafficCapture(object):
+    """
+    Records raw poll responses and Nest push requests to an append-only file, one compact JSON array per line. Records
+    are kept in a bounded ring buffer and appended to the file in the executor every CAPTURE_FLUSH_INTERVAL. The file
+    is rotated once it reaches `max_bytes`, keeping a single previous segment.
+    """
+
+    def __init__(self, path: str, max_records: int = CAPTURE_MAX_RECORDS, max_bytes: int = CAPTURE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._buffer: deque[CaptureRecord] = deque(maxlen=max_records)
+        self.counters = {'recorded': 0, 'written': 0, 'dropped': 0}
+
+    def record(self, kind: str, source: str, method: str, path: str, body: Optional[bytes]) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.counters['dropped'] += 1
+        self._buffer.append(CaptureRecord(time.time(), kind, source, method, path, body))
+        self.counters['recorded'] += 1
+
+    def take(self) -> list[CaptureRecord]:
+        """Removes and returns the buffered records."""
+        records = list(self._buffer)
+        self._buffer.clear()
+        return records
+
+    def write(self, records: list[CaptureRecord]) -> None:
+        """Appends records to the capture file. Does blocking I/O."""
+        if not records:
+            return
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f'{self.path}.1')
+
+        with open(self.path, 'a', encoding='ascii') as f:
+            f.writelines(record.to_line() for record in records)
+        self.counters['written'] += len(records)
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """Reads the records in a capture file, starting with its previous segment if there is one."""
+    for segment in [f'{path}.1', path]:
+        if os.path.exists(segment):
+            with open(segment, encoding='ascii') as f:
+                for line in f:
+                    yield CaptureRecord.from_line(line)
+
+
+def get_traffic_capture(hass: HomeAssistant) -> TrafficCapture:
+    """Returns the domain-wide TrafficCapture, creating it and starting to write it out on first use."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    capture = domain_data.get(DATA_TRAFFIC_CAPTURE)
+    if capture is None:
+        capture = domain_data[DATA_TRAFFIC_CAPTURE] = TrafficCapture(hass.config.path(CAPTURE_FILE))
+        _LOGGER.warning("Capturing Wibeee traffic to %s", capture.path)
+
+        async def flush(now=None) -> None:
+            try:
+                await hass.async_add_executor_job(capture.write, capture.take())
+            except OSError:
+                _LOGGER.error("Error writing Wibeee traffic capture to %s", capture.path, exc_info=True)
+
+        remove_flush = async_track_time_interval(hass, flush, CAPTURE_FLUSH_INTERVAL)
+
+        @callback
+        def stop_capture(ev: EventType) -> None:
+            remove_flush()
+            hass.async_create_task(flush())
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, stop_capture)
+
+    return capture
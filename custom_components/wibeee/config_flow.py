@@ -2,19 +2,47 @@
 
 import logging
 from datetime import timedelta
-from typing import Any
+from typing import Any, Optional
 
 import voluptuous as vol
 from homeassistant import config_entries, exceptions
-from homeassistant.const import (CONF_HOST, CONF_SCAN_INTERVAL)
+from homeassistant.const import (CONF_HOST, CONF_SCAN_INTERVAL, CONF_DEVICES, CONF_MAC)
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import AbortFlow
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers import discovery_flow
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.device_registry import format_mac
 from homeassistant.helpers.selector import SelectSelectorConfig, SelectSelectorMode, SelectSelector
 
-from .api import WibeeeAPI
-from .const import DOMAIN, DEFAULT_SCAN_INTERVAL, CONF_NEST_UPSTREAM, NEST_ALL_UPSTREAMS, NEST_PROXY_DISABLED
+from .aggregation import ALL_AGGREGATIONS, MEAN
+from .api import WibeeeAPI, DeviceInfo
+from .const import (
+    DOMAIN,
+    DEFAULT_SCAN_INTERVAL,
+    CONF_NEST_UPSTREAM,
+    CONF_NEST_FORWARD_IN_BACKGROUND,
+    CONF_NEST_SECONDARY_UPSTREAMS,
+    CONF_NEST_DISCOVERY_PUSHES,
+    DEFAULT_NEST_DISCOVERY_PUSHES,
+    NEST_ALL_UPSTREAMS,
+    NEST_CLOUD_UPSTREAMS,
+    NEST_PROXY_DISABLED,
+    CONF_PUSH_GRACE_PERIOD,
+    DEFAULT_PUSH_GRACE_PERIOD,
+    CONF_FORCE_UPDATE_INTERVAL,
+    DEFAULT_FORCE_UPDATE_INTERVAL,
+    CONF_PROBE_INTERVAL,
+    DEFAULT_PROBE_INTERVAL,
+    CONF_PUSH_AGGREGATION_WINDOW,
+    CONF_PUSH_AGGREGATION,
+    CONF_IMPORT_STATISTICS,
+    CONF_SITE,
+    CONF_RAW_LOG_SAMPLING,
+    CONF_CAPTURE_TRAFFIC,
+    ALL_DEADBAND_OPTIONS,
+)
+from .discovery import DiscoveredDevice, async_discover_local_devices
 from .util import short_mac
 
 _LOGGER = logging.getLogger(__name__)
@@ -29,19 +57,93 @@ async def validate_input(hass: HomeAssistant, user_input: dict) -> [str, str, di
     except Exception as e:
         raise NoDeviceInfo from e
 
+    return get_entry_info(device, user_input[CONF_HOST])
+
+
+def get_entry_info(device: DeviceInfo, host: str) -> [str, str, dict[str, Any]]:
+    """Returns the title, unique ID and data of the config entry for a device."""
     mac_addr = format_mac(device.macAddr)
     unique_id = mac_addr
     name = f"Wibeee {short_mac(mac_addr)}"
 
-    return name, unique_id, {CONF_HOST: user_input[CONF_HOST], }
+    return name, unique_id, {CONF_HOST: host, }
 
 
 class WibeeeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Wibeee config flow."""
     VERSION = 2
 
+    def __init__(self):
+        self._discovered: dict[str, DiscoveredDevice] = {}
+        self._discovered_entry: Optional[tuple[str, dict[str, Any]]] = None
+
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
+        return self.async_show_menu(step_id="user", menu_options=["discover", "manual", "site"])
+
+    async def async_step_discover(self, user_input=None):
+        """Scan the local networks and let the user pick the devices to add."""
+        if user_input is None:
+            configured = self._async_current_ids()
+            found = await async_discover_local_devices(self.hass, async_get_clientsession(self.hass))
+            self._discovered = {
+                unique_id: discovered for discovered in found
+                if (unique_id := get_entry_info(discovered.device, discovered.host)[1]) not in configured
+            }
+            if not self._discovered:
+                return self.async_abort(reason="no_devices_found")
+
+            devices = {unique_id: f"Wibeee {short_mac(unique_id)} ({d.host})" for unique_id, d in self._discovered.items()}
+            schema = vol.Schema({
+                vol.Required(CONF_DEVICES, default=list(devices)): cv.multi_select(devices),
+            })
+            return self.async_show_form(step_id="discover", data_schema=schema)
+
+        selected = [self._discovered[unique_id] for unique_id in user_input[CONF_DEVICES]]
+        if not selected:
+            return self.async_abort(reason="no_devices_selected")
+
+        # a flow creates a single entry, so the other devices are offered as discovered devices, as the Nest proxy does.
+        for discovered in selected[1:]:
+            discovery_flow.async_create_flow(
+                self.hass, DOMAIN, context={"source": config_entries.SOURCE_INTEGRATION_DISCOVERY},
+                data={CONF_HOST: discovered.host, CONF_MAC: discovered.device.macAddr},
+            )
+
+        title, unique_id, data = get_entry_info(selected[0].device, selected[0].host)
+        await self.async_set_unique_id(unique_id)
+        self._abort_if_unique_id_configured(updates=data)
+        return self.async_create_entry(title=title, data=data)
+
+    async def async_step_integration_discovery(self, discovery_info: dict[str, str]):
+        """Handle a device that the Nest proxy has received pushes from without it having been set up."""
+        host = discovery_info[CONF_HOST]
+        await self.async_set_unique_id(format_mac(discovery_info[CONF_MAC]))
+        self._abort_if_unique_id_configured(updates={CONF_HOST: host})
+
+        try:
+            title, unique_id, data = await validate_input(self.hass, {CONF_HOST: host})
+        except NoDeviceInfo:
+            return self.async_abort(reason="no_device_info")
+
+        await self.async_set_unique_id(unique_id)
+        self._abort_if_unique_id_configured(updates=data)
+
+        self._discovered_entry = (title, data)
+        self.context["title_placeholders"] = {"name": title, "host": host}
+        return await self.async_step_discovery_confirm()
+
+    async def async_step_discovery_confirm(self, user_input=None):
+        """Confirm adding a device found by the Nest proxy."""
+        title, data = self._discovered_entry
+        if user_input is not None:
+            return self.async_create_entry(title=title, data=data)
+
+        self._set_confirm_only()
+        return self.async_show_form(step_id="discovery_confirm", description_placeholders={"name": title, "host": data[CONF_HOST]})
+
+    async def async_step_manual(self, user_input=None):
+        """Add a device by its host name or IP address."""
         errors: dict[str, str] = {}
         if user_input is not None:
             try:
@@ -65,22 +167,34 @@ class WibeeeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         return await self._show_setup_form(conf=user_input, errors=errors)
 
+    async def async_step_site(self, user_input=None):
+        """Add the site meter, which adds up the power and energy of all the devices."""
+        await self.async_set_unique_id(CONF_SITE)
+        self._abort_if_unique_id_configured()
+        return self.async_create_entry(title="Wibeee Site", data={CONF_SITE: True})
+
     async def async_step_import(self, conf: dict):
         """Import a configuration from config.yaml."""
-        return await self.async_step_user(user_input=conf)
+        return await self.async_step_manual(user_input=conf)
 
     async def _show_setup_form(self, conf=None, errors=None):
         """Show the setup form to the user."""
         schema = vol.Schema({
             vol.Required(CONF_HOST, default=conf[CONF_HOST] if conf else None): str,
         })
-        return self.async_show_form(step_id="user", data_schema=schema, errors=errors or {})
+        return self.async_show_form(step_id="manual", data_schema=schema, errors=errors or {})
 
     @staticmethod
     @callback
     def async_get_options_flow(config_entry):
         return WibeeeOptionsFlowHandler(config_entry)
 
+    @classmethod
+    @callback
+    def async_supports_options_flow(cls, config_entry: config_entries.ConfigEntry) -> bool:
+        """The site meter has no options."""
+        return not config_entry.data.get(CONF_SITE)
+
 
 class WibeeeOptionsFlowHandler(config_entries.OptionsFlow):
     """Handle options flow for Wibeee."""
@@ -92,9 +206,14 @@ class WibeeeOptionsFlowHandler(config_entries.OptionsFlow):
 
     async def async_step_init(self, user_input=None):
         """Main options."""
+        errors: dict[str, str] = {}
         if user_input is not None:
-            self.options.update(user_input)
-            return self.async_create_entry(title="", data=self.options)
+            try:
+                user_input[CONF_NEST_SECONDARY_UPSTREAMS] = [validate_upstream(u) for u in user_input.get(CONF_NEST_SECONDARY_UPSTREAMS, [])]
+                self.options.update(user_input)
+                return self.async_create_entry(title="", data=self.options)
+            except vol.Invalid:
+                errors[CONF_NEST_SECONDARY_UPSTREAMS] = "invalid_upstream"
 
         data_schema = vol.Schema({
             vol.Optional(
@@ -104,14 +223,71 @@ class WibeeeOptionsFlowHandler(config_entries.OptionsFlow):
             vol.Required(
                 CONF_NEST_UPSTREAM,
                 default=self.config_entry.options.get(CONF_NEST_UPSTREAM, NEST_PROXY_DISABLED)
-            ): SelectSelector(SelectSelectorConfig(options=NEST_ALL_UPSTREAMS, mode=SelectSelectorMode.DROPDOWN))
+            ): SelectSelector(SelectSelectorConfig(options=NEST_ALL_UPSTREAMS, mode=SelectSelectorMode.DROPDOWN)),
+            vol.Optional(
+                CONF_NEST_FORWARD_IN_BACKGROUND,
+                default=self.config_entry.options.get(CONF_NEST_FORWARD_IN_BACKGROUND, False)
+            ): bool,
+            vol.Optional(
+                CONF_NEST_SECONDARY_UPSTREAMS,
+                default=self.config_entry.options.get(CONF_NEST_SECONDARY_UPSTREAMS, [])
+            ): SelectSelector(SelectSelectorConfig(options=NEST_CLOUD_UPSTREAMS, multiple=True, custom_value=True, mode=SelectSelectorMode.DROPDOWN)),
+            vol.Optional(
+                CONF_NEST_DISCOVERY_PUSHES,
+                default=self.config_entry.options.get(CONF_NEST_DISCOVERY_PUSHES, DEFAULT_NEST_DISCOVERY_PUSHES)
+            ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(
+                CONF_PUSH_GRACE_PERIOD,
+                default=self.config_entry.options.get(CONF_PUSH_GRACE_PERIOD, DEFAULT_PUSH_GRACE_PERIOD.total_seconds())
+            ): int,
+            vol.Optional(
+                CONF_PUSH_AGGREGATION_WINDOW,
+                default=self.config_entry.options.get(CONF_PUSH_AGGREGATION_WINDOW, 0)
+            ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(
+                CONF_PUSH_AGGREGATION,
+                default=self.config_entry.options.get(CONF_PUSH_AGGREGATION, MEAN)
+            ): SelectSelector(SelectSelectorConfig(options=ALL_AGGREGATIONS, translation_key=CONF_PUSH_AGGREGATION)),
+            vol.Optional(
+                CONF_IMPORT_STATISTICS,
+                default=self.config_entry.options.get(CONF_IMPORT_STATISTICS, False)
+            ): bool,
+            vol.Optional(
+                CONF_FORCE_UPDATE_INTERVAL,
+                default=self.config_entry.options.get(CONF_FORCE_UPDATE_INTERVAL, DEFAULT_FORCE_UPDATE_INTERVAL.total_seconds())
+            ): int,
+            vol.Optional(
+                CONF_PROBE_INTERVAL,
+                default=self.config_entry.options.get(CONF_PROBE_INTERVAL, DEFAULT_PROBE_INTERVAL.total_seconds())
+            ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        } | {
+            vol.Optional(conf, default=self.config_entry.options.get(conf, 0)): vol.All(vol.Coerce(float), vol.Range(min=0))
+            for conf in ALL_DEADBAND_OPTIONS
+        } | {
+            vol.Optional(
+                CONF_RAW_LOG_SAMPLING,
+                default=self.config_entry.options.get(CONF_RAW_LOG_SAMPLING, 1)
+            ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(
+                CONF_CAPTURE_TRAFFIC,
+                default=self.config_entry.options.get(CONF_CAPTURE_TRAFFIC, False)
+            ): bool,
         })
 
         return self.async_show_form(
             step_id="init",
-            data_schema=data_schema
+            data_schema=data_schema,
+            errors=errors,
         )
 
 
+def validate_upstream(upstream: str) -> str:
+    """Validates an upstream URL entered by the user, dropping any trailing slash since request paths are appended to it."""
+    url = vol.Url()(upstream.strip())
+    if not url.startswith(('http://', 'https://')):
+        raise vol.Invalid(f'Not an HTTP URL: {upstream}')
+    return url.rstrip('/')
+
+
 class NoDeviceInfo(exceptions.HomeAssistantError):
     """Error to indicate we couldn't get info from Wibeee."""
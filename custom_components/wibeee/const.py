@@ -7,8 +7,54 @@ NEST_DEFAULT_UPSTREAM = 'http://nest-ingest.wibeee.com'
 
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=15)
 DEFAULT_TIMEOUT = timedelta(seconds=10)
+MAX_CONCURRENT_POLLS = 4
+"""Maximum number of devices that are polled at the same time."""
 
 CONF_NEST_UPSTREAM = 'nest_upstream'
+CONF_NEST_FORWARD_IN_BACKGROUND = 'nest_forward_in_background'
+CONF_NEST_SECONDARY_UPSTREAMS = 'nest_secondary_upstreams'
+"""Other servers that push data is also forwarded to in the background, in addition to CONF_NEST_UPSTREAM."""
+
+CONF_NEST_DISCOVERY_PUSHES = 'nest_discovery_pushes'
+DEFAULT_NEST_DISCOVERY_PUSHES = 3
+"""Pushes from a device that hasn't been set up after which the Nest proxy offers to add it, 0 to never do that."""
+
+CONF_SITE = 'site'
+"""Set in the data of the config entry for the site meter, which adds up all the devices."""
+
+CONF_PUSH_GRACE_PERIOD = 'push_grace_period'
+DEFAULT_PUSH_GRACE_PERIOD = timedelta(seconds=60)
+PUSH_KEEPALIVE_INTERVAL = timedelta(minutes=5)
+"""How often to poll variables that are not pushed while push data is being received."""
+
+CONF_PUSH_AGGREGATION_WINDOW = 'push_aggregation_window'
+"""Seconds over which push data is aggregated before it is written to the sensors, 0 to write every push."""
+CONF_PUSH_AGGREGATION = 'push_aggregation'
+"""How pushed values are aggregated over the window, see aggregation.py."""
+
+CONF_IMPORT_STATISTICS = 'import_statistics'
+"""Compute hourly statistics from every reading and import them into the recorder, see external_statistics.py."""
+
+CONF_FORCE_UPDATE_INTERVAL = 'force_update_interval'
+DEFAULT_FORCE_UPDATE_INTERVAL = timedelta(minutes=5)
+
+CONF_PROBE_INTERVAL = 'probe_interval'
+DEFAULT_PROBE_INTERVAL = timedelta(seconds=60)
+"""How often to probe a device that has stopped responding, see api.CircuitBreaker."""
+
+CONF_RAW_LOG_SAMPLING = 'raw_log_sampling'
+"""Log the raw body of 1 in N responses from each device when DEBUG logging is enabled."""
+
+CONF_CAPTURE_TRAFFIC = 'capture_traffic'
+"""Record raw poll responses and push requests for offline profiling, see capture.py."""
+
+CONF_DEADBAND_VOLTAGE = 'deadband_voltage'
+CONF_DEADBAND_CURRENT = 'deadband_current'
+CONF_DEADBAND_FREQUENCY = 'deadband_frequency'
+CONF_DEADBAND_POWER = 'deadband_power'
+CONF_DEADBAND_RELATIVE = 'deadband_relative'
+ALL_DEADBAND_OPTIONS = [CONF_DEADBAND_VOLTAGE, CONF_DEADBAND_CURRENT, CONF_DEADBAND_FREQUENCY, CONF_DEADBAND_POWER, CONF_DEADBAND_RELATIVE]
+"""Deadband options, all of them default to 0 (only skip state writes when the value hasn't changed at all)."""
 
 
 def _format_options(upstreams: dict[str, str]) -> list[SelectOptionDict]:
@@ -17,10 +63,10 @@ def _format_options(upstreams: dict[str, str]) -> list[SelectOptionDict]:
 
 NEST_PROXY_DISABLED: str = 'proxy_disabled'
 NEST_NULL_UPSTREAM: str = 'proxy_null'
+NEST_CLOUD_UPSTREAMS: list[SelectOptionDict] = _format_options({
+    'Wibeee Nest': NEST_DEFAULT_UPSTREAM,
+    'Iberdrola': 'http://datosmonitorconsumo.iberdrola.es:8080',
+    'SolarProfit': 'http://wdata.solarprofit.es:8080',
+})
 NEST_ALL_UPSTREAMS: list[SelectOptionDict] = [SelectOptionDict(label='Disabled (polling only)', value=NEST_PROXY_DISABLED),
-                                              SelectOptionDict(label='Local only (no Cloud)', value=NEST_NULL_UPSTREAM)] + \
-                                             _format_options({
-                                                 'Wibeee Nest': NEST_DEFAULT_UPSTREAM,
-                                                 'Iberdrola': 'http://datosmonitorconsumo.iberdrola.es:8080',
-                                                 'SolarProfit': 'http://wdata.solarprofit.es:8080',
-                                             })
+                                              SelectOptionDict(label='Local only (no Cloud)', value=NEST_NULL_UPSTREAM)] + NEST_CLOUD_UPSTREAMS
@@ -0,0 +1,69 @@
+from array import array
+from typing import NamedTuple, Callable, Sequence, Iterable
+
+from .readings import ReadingLayout, NAN
+
+
+class DerivedMetric(NamedTuple):
+    """A value that is computed from other readings of the same device."""
+    inputs: tuple[str, ...]
+    "`values.xml` variables that the metric is computed from, in the order that `compute` expects them"
+    compute: Callable[[Sequence[float]], float]
+    "computes the metric from its inputs, which are never NaN"
+
+
+def import_power(values: Sequence[float]) -> float:
+    """Power drawn from the grid, from a signed active power."""
+    return max(values[0], 0.0)
+
+
+def export_power(values: Sequence[float]) -> float:
+    """Power fed into the grid, from a signed active power."""
+    return max(-values[0], 0.0)
+
+
+def imbalance(values: Sequence[float]) -> float:
+    """Maximum deviation from the average of the phases, as a percentage of that average (0 when there's nothing to balance)."""
+    average = sum(values) / len(values)
+    return max(abs(v - average) for v in values) / abs(average) * 100 if average else 0.0
+
+
+def share(values: Sequence[float]) -> float:
+    """The first value as a percentage of the second (0 when the second is 0)."""
+    return values[0] / values[1] * 100 if values[1] else 0.0
+
+
+class DerivedEngine(object):
+    """
+    Computes a device's derived metrics from its readings in a single pass per ingest. The input slots of every metric
+    are resolved once, so an ingest only recomputes the metrics whose inputs were among the updated slots, reading
+    them straight from the readings array. A metric with an unavailable input is unavailable (NaN).
+    """
+
+    def __init__(self, layout: ReadingLayout, metrics: Sequence[DerivedMetric]):
+        self.metrics = metrics
+        self.offset = layout.size
+        "SensorBatch slot of the first metric, derived sensors come after the device's own sensors"
+        self.values = array('d', [NAN]) * len(metrics)
+        self._input_slots = [tuple(layout.poll_index[var] for var in m.inputs) for m in metrics]
+        self._dependents: dict[int, list[int]] = {}
+        "slot to the metrics that use it"
+        for i, input_slots in enumerate(self._input_slots):
+            for slot in set(input_slots):
+                self._dependents.setdefault(slot, []).append(i)
+
+    @staticmethod
+    def supported(layout: ReadingLayout, metric: DerivedMetric) -> bool:
+        """Whether the device has every input of a metric."""
+        return all(var in layout.poll_index for var in metric.inputs)
+
+    def update(self, values: Sequence[float], slots: Iterable[int]) -> list[int]:
+        """Recomputes the metrics that depend on `slots`, returning their indexes."""
+        dependents = self._dependents
+        affected = sorted({i for slot in slots for i in dependents.get(slot, ())})
+        out = self.values
+        for i in affected:
+            inputs = [values[slot] for slot in self._input_slots[i]]
+            out[i] = NAN if any(v != v for v in inputs) else self.metrics[i].compute(inputs)
+
+        return affected
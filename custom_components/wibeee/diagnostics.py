@@ -0,0 +1,74 @@
+"""Diagnostics support for Wibeee."""
+import time
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_HOST
+from homeassistant.core import HomeAssistant
+
+from .aggregation import WindowAggregator
+from .api import WibeeeAPI
+from .capture import DATA_TRAFFIC_CAPTURE
+from .const import DOMAIN
+from .nest import DATA_NEST_PROXY, NestProxy
+from .readings import DeviceReadings
+from .scheduler import DATA_POLL_SCHEDULER
+from .sensor import SensorBatch
+from .site import SITE_VARIABLES, get_site_meter
+
+TO_REDACT = {CONF_HOST, 'ipAddr'}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id, {})
+    device = entry_data.get('device')
+    api: WibeeeAPI = entry_data.get('api')
+    readings: DeviceReadings = entry_data.get('readings')
+    batch: SensorBatch = entry_data.get('batch')
+    aggregator: WindowAggregator = entry_data.get('aggregator')
+    scheduler = hass.data.get(DOMAIN, {}).get(DATA_POLL_SCHEDULER)
+    capture = hass.data.get(DOMAIN, {}).get(DATA_TRAFFIC_CAPTURE)
+    nest_proxy = hass.data.get(DATA_NEST_PROXY)
+    site_meter = get_site_meter(hass)
+
+    return {
+        'entry': async_redact_data({'data': dict(entry.data), 'options': dict(entry.options)}, TO_REDACT),
+        'device': async_redact_data(device._asdict(), TO_REDACT) if device is not None else None,
+        'api': {
+            'circuit_breaker': api.breaker.state,
+            'consecutive_failures': api.breaker.failures,
+            'latency_average': api.latency.average,
+            'latency_variation': api.latency.variation,
+            'timeout': api.latency.timeout(),
+            **api.metrics.as_dict(),
+        } if api is not None else None,
+        'readings': {
+            'source': readings.source,
+            'age': time.time() - readings.timestamp if readings.timestamp else None,
+            'sensors': readings.layout.size,
+            'pushed_sensors': sum(readings.push_mask),
+        } if readings is not None else None,
+        'sensor_batch': batch.stats if batch is not None else None,
+        'aggregation': {
+            'window': aggregator.window.total_seconds(),
+            'aggregation': aggregator.aggregation,
+            **aggregator.stats,
+        } if aggregator is not None else None,
+        'poll_scheduler': {
+            'in_flight': scheduler.in_flight,
+            'waiting': scheduler.waiting,
+            'max_concurrent': scheduler.max_concurrent,
+            **scheduler.counters,
+        } if scheduler is not None else None,
+        'nest_proxy': {
+            **nest_proxy.metrics.as_dict(),
+            'forwarders': {upstream: forwarder.counters for upstream, forwarder in nest_proxy.forwarders.items()},
+        } if isinstance(nest_proxy, NestProxy) else None,
+        'traffic_capture': capture.counters if capture is not None else None,
+        'site_meter': {
+            'members': {name: {'stale': m.stale, 'variables': len(m.slots)} for name, m in site_meter.members.items()},
+            'totals': {v.poll_var_prefix: site_meter.value(i) for i, v in enumerate(SITE_VARIABLES)},
+        } if site_meter is not None else None,
+    }
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from ipaddress import IPv4Address, IPv4Network, ip_network
+from typing import NamedTuple, Iterable
+
+import aiohttp
+from homeassistant.components.network import async_get_adapters
+from homeassistant.components.network.models import Adapter
+from homeassistant.core import HomeAssistant
+
+from .api import WibeeeAPI, DeviceInfo
+from .util import parse_flat_xml
+
+_LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_CONCURRENCY = 64
+"""Maximum number of hosts that are probed at the same time."""
+
+DISCOVERY_TIMEOUT = timedelta(seconds=1)
+"""Timeout for each probe. Most addresses don't answer at all, so this is what a scan's duration depends on."""
+
+MAX_SCAN_PREFIX = 24
+"""Networks larger than this are only scanned in the /24 around the adapter's own address."""
+
+
+class DiscoveredDevice(NamedTuple):
+    host: str
+    device: DeviceInfo
+
+
+def get_scan_hosts(adapters: Iterable[Adapter]) -> list[str]:
+    """Returns the addresses to scan in the IPv4 networks of the enabled adapters, excluding their own addresses."""
+    own_addresses = set()
+    networks: dict[IPv4Network, None] = {}
+    for adapter in adapters:
+        if not adapter['enabled']:
+            continue
+
+        for ipv4 in adapter['ipv4']:
+            address = IPv4Address(ipv4['address'])
+            if address.is_loopback or address.is_link_local:
+                continue
+
+            own_addresses.add(address)
+            networks[ip_network(f"{address}/{max(ipv4['network_prefix'], MAX_SCAN_PREFIX)}", strict=False)] = None
+
+    return [str(host) for network in networks for host in network.hosts() if host not in own_addresses]
+
+
+async def async_discover_devices(session: aiohttp.ClientSession, hosts: list[str], concurrency: int = DISCOVERY_CONCURRENCY,
+                                 timeout: timedelta = DISCOVERY_TIMEOUT) -> list[DiscoveredDevice]:
+    """
+    Probes `hosts` for Wibeee devices, at most `concurrency` at a time. Each host only gets a single devices.xml
+    request without retries, and the device info is only fetched from hosts that answer it.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    probe_timeout = aiohttp.ClientTimeout(total=timeout.total_seconds(), connect=timeout.total_seconds() / 2)
+
+    async def probe(host: str) -> list[DiscoveredDevice]:
+        async with semaphore:
+            # most hosts won't answer, so they are probed directly instead of through WibeeeAPI and its error logging.
+            try:
+                async with session.get(f'http://{host}/services/user/devices.xml', timeout=probe_timeout) as resp:
+                    device_id = parse_flat_xml(await resp.read()).get('id') if resp.status == 200 else None
+            except Exception:
+                return []
+
+            if not device_id:
+                return []
+
+            try:
+                device = await WibeeeAPI(session, host, timeout).async_fetch_device_info(retries=2, device_id=device_id)
+            except Exception as e:
+                _LOGGER.debug("Found a device at %s but could not read its info: %s", host, e)
+                return []
+
+            return [DiscoveredDevice(host, device)] if device is not None else []
+
+    started = time.monotonic()
+    found = [d for host_found in await asyncio.gather(*[probe(host) for host in hosts]) for d in host_found]
+    _LOGGER.info("Found %d Wibeee devices in %d hosts in %.1fs", len(found), len(hosts), time.monotonic() - started)
+    return found
+
+
+async def async_discover_local_devices(hass: HomeAssistant, session: aiohttp.ClientSession) -> list[DiscoveredDevice]:
+    """Scans the local networks known to the network integration for Wibeee devices."""
+    return await async_discover_devices(session, get_scan_hosts(await async_get_adapters(hass)))
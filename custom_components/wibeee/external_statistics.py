@@ -0,0 +1,185 @@
+import logging
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional, Iterable, Sequence
+
+from homeassistant.components.sensor import SensorStateClass
+from homeassistant.core import HomeAssistant, callback, CALLBACK_TYPE
+from homeassistant.helpers.event import async_track_utc_time_change
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+from .readings import NAN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+PERIOD_SECS = 3600
+"""Length of each statistics period. The recorder only accepts imported statistics for whole hours."""
+
+
+def get_statistic_id(unique_id: str) -> str:
+    """The external statistic ID for a sensor, e.g.: '_001122334455_vrms_1' becomes 'wibeee:001122334455_vrms_1'."""
+    return f"{DOMAIN}:{unique_id.lstrip('_').lower()}"
+
+
+def get_statistics_store(hass: HomeAssistant, entry_id: str) -> Store:
+    """Holds the running sums of a config entry's energy statistics, which have to carry on across restarts."""
+    return Store(hass, STORAGE_VERSION, f'{DOMAIN}.statistics.{entry_id}')
+
+
+class StatisticSeries(NamedTuple):
+    slot: int
+    "slot in the device readings"
+    metadata: dict
+    "StatisticMetaData to import the series with"
+
+
+class StatisticsCollector(object):
+    """
+    Computes hourly statistics for a device's sensors from every reading as it is ingested, in per-slot accumulators:
+    mean, min and max for measurements, and the last state and running sum for energy counters. A counter that goes
+    down is assumed to have been reset, so its whole new value is added to the sum. When an hour ends its statistics
+    are queued until they are taken for import, and the accumulators start over.
+    """
+
+    def __init__(self, size: int, series: Iterable[StatisticSeries], sums: Optional[dict[str, list[float]]] = None):
+        self.series = list(series)
+        self.period_start: Optional[float] = None
+        "time.time() when the current period started"
+        self._count = array('l', [0]) * size
+        self._total = array('d', [0.0]) * size
+        self._min = array('d', [NAN]) * size
+        self._max = array('d', [NAN]) * size
+        self._last = array('d', [NAN]) * size
+        self._sum = array('d', [0.0]) * size
+        self._state = array('d', [NAN]) * size
+        "last counter value seen, which the next one is compared against"
+        self._has_sum = bytearray(size)
+        self._pending: dict[str, tuple[dict, list[dict]]] = {}
+
+        for s in self.series:
+            if s.metadata['has_sum']:
+                self._has_sum[s.slot] = 1
+                saved_sum, saved_state = (sums or {}).get(s.metadata['statistic_id'], (0.0, None))
+                self._sum[s.slot] = saved_sum
+                self._state[s.slot] = saved_state if saved_state is not None else NAN
+
+    def add(self, values: Sequence[float], slots: Iterable[int], timestamp: float) -> None:
+        """Accumulates the current value of `slots`, unavailable (NaN) values are skipped."""
+        self.roll(timestamp)
+        count, total, minimum, maximum, last = self._count, self._total, self._min, self._max, self._last
+        has_sum, running_sum, state = self._has_sum, self._sum, self._state
+        for slot in slots:
+            value = values[slot]
+            if value != value:
+                continue
+
+            if count[slot] == 0 or value < minimum[slot]:
+                minimum[slot] = value
+            if count[slot] == 0 or value > maximum[slot]:
+                maximum[slot] = value
+            count[slot] += 1
+            total[slot] += value
+            last[slot] = value
+
+            if has_sum[slot]:
+                previous = state[slot]
+                if previous == previous:
+                    running_sum[slot] += value - previous if value >= previous else value
+                state[slot] = value
+
+    def roll(self, timestamp: float) -> None:
+        """Ends the current period if `timestamp` is past it."""
+        period_start = timestamp - timestamp % PERIOD_SECS
+        if self.period_start is None:
+            self.period_start = period_start
+        elif period_start > self.period_start:
+            self._close()
+            self.period_start = period_start
+
+    def take(self) -> list[tuple[dict, list[dict]]]:
+        """Removes and returns the statistics of the periods that have ended, as (metadata, statistics) per series."""
+        pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def sums(self) -> dict[str, list[float]]:
+        """The running sum and last state of each energy series, to be saved and passed in again after a restart."""
+        return {
+            s.metadata['statistic_id']: [self._sum[s.slot], self._state[s.slot] if self._state[s.slot] == self._state[s.slot] else None]
+            for s in self.series if self._has_sum[s.slot]
+        }
+
+    def _close(self) -> None:
+        start = datetime.fromtimestamp(self.period_start, timezone.utc)
+        count = self._count
+        for s in self.series:
+            slot = s.slot
+            n = count[slot]
+            if n == 0:
+                continue
+
+            if self._has_sum[slot]:
+                data = {'start': start, 'state': self._last[slot], 'sum': self._sum[slot]}
+            else:
+                data = {'start': start, 'mean': self._total[slot] / n, 'min': self._min[slot], 'max': self._max[slot]}
+
+            statistic_id = s.metadata['statistic_id']
+            self._pending.setdefault(statistic_id, (s.metadata, []))[1].append(data)
+            count[slot] = 0
+            self._total[slot] = 0.0
+
+
+async def async_setup_statistics(hass: HomeAssistant, entry_id: str, sensors: Iterable) -> tuple[StatisticsCollector, CALLBACK_TYPE]:
+    """
+    Creates a StatisticsCollector for a device's sensors and imports its statistics into the recorder as external
+    statistics shortly after every hour. Returns the collector and a callback that stops importing.
+    """
+    store = get_statistics_store(hass, entry_id)
+    try:
+        sums = (await store.async_load() or {}).get('sums', {})
+    except Exception:
+        _LOGGER.warning("Ignoring invalid statistics in %s", store.path, exc_info=True)
+        sums = {}
+
+    sensors = list(sensors)
+    collector = StatisticsCollector(max([s.slot for s in sensors], default=-1) + 1, [
+        StatisticSeries(s.slot, {
+            'has_mean': s.state_class != SensorStateClass.TOTAL_INCREASING,
+            'has_sum': s.state_class == SensorStateClass.TOTAL_INCREASING,
+            'name': s.name,
+            'source': DOMAIN,
+            'statistic_id': get_statistic_id(s.unique_id),
+            'unit_of_measurement': s.native_unit_of_measurement,
+        }) for s in sensors
+    ], sums)
+
+    def save_sums() -> dict:
+        return {'sums': collector.sums()}
+
+    @callback
+    def import_statistics(now: datetime = None) -> None:
+        collector.roll(time.time())
+        taken = collector.take()
+        if not taken:
+            return
+
+        # the recorder is only loaded when statistics are imported.
+        from homeassistant.components.recorder.statistics import async_add_external_statistics
+
+        for metadata, statistics in taken:
+            async_add_external_statistics(hass, metadata, statistics)
+        store.async_delay_save(save_sums)
+        _LOGGER.debug("Imported statistics for %d sensors", len(taken))
+
+    remove_timer = async_track_utc_time_change(hass, import_statistics, minute=0, second=10)
+
+    @callback
+    def stop_statistics() -> None:
+        remove_timer()
+        # readings up to now are already in the sums, so they are kept even though this hour won't be imported.
+        store.async_delay_save(save_sums)
+
+    return collector, stop_statistics
@@ -0,0 +1,110 @@
+from bisect import bisect_left
+from typing import Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Upper bounds in seconds of the buckets used for request latencies."""
+
+PARSE_TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+"""Upper bounds in seconds of the buckets used for parse times."""
+
+MAX_UNKNOWN_MACS = 20
+"""Number of distinct unknown MAC addresses that the Nest proxy keeps track of."""
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, which only takes a bisect and a few additions per observation so it can
+    stay on in production. The last bucket counts the observations above the highest bound.
+    """
+    __slots__ = ('bounds', 'buckets', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def as_dict(self) -> dict:
+        labels = [f'<={bound:g}' for bound in self.bounds] + [f'>{self.bounds[-1]:g}']
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class DeviceMetrics(object):
+    """Counters and histograms for the requests made to a device and the pushes received from it."""
+
+    def __init__(self):
+        self.counters = {'requests': 0, 'failures': 0, 'retries': 0, 'rejected': 0, 'bytes_received': 0, 'pushes': 0}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        "seconds from sending a request until its response has been parsed"
+        self.parse_time = Histogram(PARSE_TIME_BUCKETS)
+        "seconds spent parsing each response"
+
+    def as_dict(self) -> dict:
+        return {
+            **self.counters,
+            'latency': self.latency.as_dict(),
+            'parse_time': self.parse_time.as_dict(),
+        }
+
+
+class UpstreamMetrics(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statuses: dict[str, int] = {}
+        "responses by HTTP status, plus 'error' for requests that got no response"
+
+    def as_dict(self) -> dict:
+        return {'latency': self.latency.as_dict(), 'statuses': self.statuses}
+
+
+class ProxyMetrics(object):
+    """Counters and histograms for the Nest proxy: pushes received by route, unknown devices and forwarding."""
+
+    def __init__(self):
+        self.pushes: dict[str, int] = {}
+        "pushes received by route"
+        self.unknown_pushes = 0
+        self.unknown_macs: dict[str, int] = {}
+        "pushes received from the first MAX_UNKNOWN_MACS unknown MAC addresses"
+        self.upstreams: dict[str, UpstreamMetrics] = {}
+
+    def record_push(self, route: str, mac_addr: Optional[str], known: bool) -> None:
+        self.pushes[route] = self.pushes.get(route, 0) + 1
+        if not known:
+            self.unknown_pushes += 1
+            if mac_addr in self.unknown_macs or len(self.unknown_macs) < MAX_UNKNOWN_MACS:
+                self.unknown_macs[mac_addr] = self.unknown_macs.get(mac_addr, 0) + 1
+
+    def record_forward(self, upstream: str, status: Optional[int], latency: float) -> None:
+        metrics = self.upstreams.get(upstream)
+        if metrics is None:
+            metrics = self.upstreams[upstream] = UpstreamMetrics()
+
+        key = 'error' if status is None else str(status)
+        metrics.statuses[key] = metrics.statuses.get(key, 0) + 1
+        metrics.latency.observe(latency)
+
+    def as_dict(self) -> dict:
+        return {
+            'pushes': self.pushes,
+            'unknown_pushes': self.unknown_pushes,
+            'unknown_macs': self.unknown_macs,
+            'upstreams': {upstream: metrics.as_dict() for upstream, metrics in self.upstreams.items()},
+        }
@@ -1,21 +1,34 @@
-import json
+import asyncio
 import logging
-from typing import Callable, Dict, Tuple, NamedTuple, Awaitable, Optional
-from urllib.parse import parse_qsl
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Tuple, NamedTuple, Awaitable, Optional, Iterable
+from urllib.parse import parse_qsl, unquote_plus
 
 from homeassistant.components.network import async_get_source_ip
 from homeassistant.components.network.const import PUBLIC_TARGET_IP
+from homeassistant.config_entries import SOURCE_INTEGRATION_DISCOVERY
+from homeassistant.const import CONF_HOST, CONF_MAC
 from homeassistant.core import callback
-from homeassistant.helpers import singleton
+from homeassistant.helpers import singleton, discovery_flow
 from homeassistant.helpers.typing import EventType
 
-from .const import NEST_NULL_UPSTREAM
+from .capture import TrafficCapture, PUSH
+from .const import DOMAIN, NEST_NULL_UPSTREAM, DEFAULT_NEST_DISCOVERY_PUSHES
+from .metrics import ProxyMetrics
 
 LOGGER = logging.getLogger(__name__)
 
+try:
+    # use the faster orjson when it's available, as it is in Home Assistant.
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 import aiohttp
 from aiohttp import web
 from aiohttp.web_routedef import _HandlerType
+from multidict import CIMultiDictProxy
 
 from homeassistant.core import HomeAssistant
 from homeassistant.const import EVENT_HOMEASSISTANT_STOP
@@ -25,17 +38,196 @@ class DeviceConfig(NamedTuple):
     handle_push_data: Callable[[Dict], None]
     """Callback that will receive push data."""
     upstream: str
-    """The upstream server to forward data to"""
+    """The primary upstream server to forward data to, whose response is sent back to the device"""
+    forward_in_background: bool = False
+    """Whether to answer the device straight away and forward to the upstream in the background"""
+    secondary_upstreams: tuple[str, ...] = ()
+    """Other upstream servers that data is always forwarded to in the background, their responses are ignored"""
+    discovery_pushes: int = DEFAULT_NEST_DISCOVERY_PUSHES
+    """The device's entry setting for NestProxy.discovery_pushes"""
 
 
-class NestProxy(object):
-    _listeners: Dict[str, DeviceConfig] = {}
+DATA_NEST_PROXY = 'wibeee_nest_proxy'
+"""Key of the NestProxy in hass.data."""
+
+UPSTREAM_CONNECTION_LIMIT = 4
+"""Maximum number of concurrent connections to each upstream."""
+
+UPSTREAM_KEEPALIVE_TIMEOUT = 15
+"""Seconds to keep idle upstream connections open for reuse."""
+
+UPSTREAM_DNS_CACHE_TTL = 300
+"""Seconds to cache upstream DNS lookups for."""
+
+FORWARD_TIMEOUT = timedelta(seconds=10)
+"""Timeout for each request forwarded in the background, so that a hung upstream only holds up its own queue."""
+
+
+class UpstreamResponse(NamedTuple):
+    status: int
+    headers: CIMultiDictProxy
+    body: bytes
+
+
+async def request_upstream(session: aiohttp.ClientSession, method: str, url: str, body: Optional[bytes],
+                           timeout: Optional[aiohttp.ClientTimeout] = None) -> UpstreamResponse:
+    """
+    Sends a request upstream using a pooled keep-alive connection. Upstreams close idle connections on their own
+    schedule, so a request that fails because the connection was closed (ServerDisconnectedError) or reset
+    (ClientOSError) is retried once on a fresh connection. Failing to connect at all is not retried.
+    """
+    try:
+        async with session.request(method, url, data=body, timeout=timeout) as res:
+            return UpstreamResponse(res.status, res.headers, await res.read())
+    except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError) as e:
+        if isinstance(e, aiohttp.ClientConnectorError):
+            raise
+        LOGGER.debug('Upstream closed the connection during %s %s, retrying: %r', method, url, e)
+        async with session.request(method, url, data=body, timeout=timeout) as res:
+            return UpstreamResponse(res.status, res.headers, await res.read())
+
+
+class ForwardRequest(NamedTuple):
+    method: str
+    path_qs: str
+    body: Optional[bytes]
+
+
+class UpstreamForwarder(object):
+    """
+    Forwards push requests to an upstream in the background using a bounded queue and a pool of workers, so that the
+    devices get an immediate response regardless of how the upstream is doing. When the queue is full the oldest
+    request is dropped, and requests that fail are retried with exponential backoff.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, upstream: str, max_queued: int = 100, workers: int = 2, retries: int = 3,
+                 min_wait: timedelta = timedelta(seconds=1), max_wait: timedelta = timedelta(seconds=30),
+                 timeout: timedelta = FORWARD_TIMEOUT, metrics: ProxyMetrics = None):
+        self.session = session
+        self.upstream = upstream
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout.total_seconds())
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self.counters = {'queued': 0, 'forwarded': 0, 'retried': 0, 'failed': 0, 'dropped': 0, 'errors': 0}
+        self._queue: asyncio.Queue[ForwardRequest] = asyncio.Queue(maxsize=max_queued)
+        self._workers = [asyncio.create_task(self._work(), name=f'wibeee_nest_forward_{n}') for n in range(workers)]
+
+    def enqueue(self, request: ForwardRequest) -> None:
+        if self._queue.full():
+            dropped = self._queue.get_nowait()
+            self._queue.task_done()
+            self.counters['dropped'] += 1
+            LOGGER.warning('Forwarding queue for %s is full, dropping %s %s', self.upstream, dropped.method, dropped.path_qs)
+
+        self._queue.put_nowait(request)
+        self.counters['queued'] += 1
+
+    async def join(self) -> None:
+        """Waits until every queued request has been forwarded or given up on."""
+        await self._queue.join()
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+
+    async def _work(self) -> None:
+        while True:
+            request = await self._queue.get()
+            try:
+                await self._forward(request)
+            except Exception:
+                # a bug forwarding one request must not take the worker down with it.
+                self.counters['errors'] += 1
+                LOGGER.exception('Unexpected error forwarding %s %s to %s', request.method, request.path_qs, self.upstream)
+            finally:
+                self._queue.task_done()
+
+    async def _forward(self, request: ForwardRequest) -> None:
+        url = f'{self.upstream}{request.path_qs}'
+        for try_n in range(self.retries + 1):
+            if try_n > 0:
+                wait = min(pow(2, try_n - 1) * self.min_wait.total_seconds(), self.max_wait.total_seconds())
+                self.counters['retried'] += 1
+                await asyncio.sleep(wait)
+
+            started = time.monotonic()
+            try:
+                res = await request_upstream(self.session, request.method, url, request.body, self.timeout)
+                self._record(res.status, started)
+                if res.status < 500:
+                    if res.status < 200 or res.status > 299:
+                        LOGGER.warning('%s returned %d for forwarded request: %s', self.upstream, res.status, res.body)
+                    self.counters['forwarded'] += 1
+                    return
+
+                LOGGER.debug('%s returned %d for %s %s (try %d)', self.upstream, res.status, request.method, url, try_n + 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._record(None, started)
+                LOGGER.debug('HTTP error during %s %s (try %d): %r', request.method, url, try_n + 1, e)
+
+        self.counters['failed'] += 1
+        LOGGER.error('Giving up forwarding %s %s after %d retries', request.method, url, self.retries)
+
+    def _record(self, status: Optional[int], started: float) -> None:
+        if self.metrics is not None:
+            self.metrics.record_forward(self.upstream, status, time.monotonic() - started)
+
+
+UNKNOWN_DEVICE_LOG_INTERVAL = timedelta(minutes=10)
+"""Pushes from an unknown device are logged at most this often."""
+
+MAX_UNKNOWN_DEVICES = 256
+"""Unknown devices that are remembered, the oldest one is forgotten to make room for a new one."""
+
 
-    def register_device(self, mac_address: str, push_data_listener: Callable[[Dict], None], upstream: str):
+class UnknownDevice(object):
+    __slots__ = ('pushes', 'logged_at', 'discovery_started')
+
+    def __init__(self):
+        self.pushes = 0
+        self.logged_at: Optional[float] = None
+        self.discovery_started = False
+
+
+class NestProxy(object):
+    on_unknown_device: Optional[Callable[[str, str], None]] = None
+    """Called with the MAC address and IP address of an unknown device that keeps pushing data"""
+
+    def __init__(self):
+        self._listeners: Dict[str, DeviceConfig] = {}
+        self._unknown: Dict[str, UnknownDevice] = {}
+        """Negative cache of the devices that push data without having been set up"""
+        self.metrics = ProxyMetrics()
+        self.forwarders: Dict[str, UpstreamForwarder] = {}
+        """Background forwarders by upstream, created on demand"""
+        self.capture: Optional[TrafficCapture] = None
+        """Records the push requests when set"""
+        self._capture_users = 0
+
+    def add_capture(self, capture: TrafficCapture) -> Callable[[], None]:
+        """Records the push requests in `capture` until every entry that added it has called the returned callback."""
+        self.capture = capture
+        self._capture_users += 1
+
+        def remove_capture() -> None:
+            self._capture_users -= 1
+            if self._capture_users == 0:
+                self.capture = None
+
+        return remove_capture
+
+    def register_device(self, mac_address: str, push_data_listener: Callable[[Dict], None], upstream: str, forward_in_background: bool = False,
+                        secondary_upstreams: Iterable[str] = (), discovery_pushes: int = DEFAULT_NEST_DISCOVERY_PUSHES):
         self._listeners[mac_address] = DeviceConfig(
             handle_push_data=push_data_listener,
-            upstream=upstream
+            upstream=upstream,
+            forward_in_background=forward_in_background,
+            secondary_upstreams=tuple(u for u in dict.fromkeys(secondary_upstreams) if u not in (upstream, NEST_NULL_UPSTREAM)),
+            discovery_pushes=discovery_pushes,
         )
+        self._unknown.pop(mac_address, None)
 
     def unregister_device(self, mac_address: str):
         self._listeners.pop(mac_address)
@@ -43,120 +235,258 @@ class NestProxy(object):
     def get_device_info(self, mac_addr: str) -> DeviceConfig:
         return self._listeners.get(mac_addr, None)
 
-
-@singleton.singleton("wibeee_nest_proxy")
+    @property
+    def discovery_pushes(self) -> int:
+        """
+        Pushes from an unknown device after which on_unknown_device is called, 0 to never call it. The proxy is shared so
+        this is the smallest setting of the registered devices' entries, which means that disabling it in one disables it.
+        """
+        return min((d.discovery_pushes for d in self._listeners.values()), default=DEFAULT_NEST_DISCOVERY_PUSHES)
+
+    def get_forwarder(self, session: aiohttp.ClientSession, upstream: str) -> UpstreamForwarder:
+        """Returns the background forwarder for an upstream, which is shared by all the devices that forward to it."""
+        forwarder = self.forwarders.get(upstream)
+        if forwarder is None:
+            forwarder = self.forwarders[upstream] = UpstreamForwarder(session, upstream, metrics=self.metrics)
+        return forwarder
+
+    def handle_unknown_push(self, mac_addr: Optional[str], remote: Optional[str]) -> None:
+        """Counts a push from a device that hasn't been set up, logging it only now and then."""
+        unknown = self._unknown.get(mac_addr)
+        if unknown is None:
+            if len(self._unknown) >= MAX_UNKNOWN_DEVICES:
+                del self._unknown[next(iter(self._unknown))]
+            unknown = self._unknown[mac_addr] = UnknownDevice()
+
+        unknown.pushes += 1
+        now = time.monotonic()
+        if unknown.logged_at is None or now - unknown.logged_at >= UNKNOWN_DEVICE_LOG_INTERVAL.total_seconds():
+            unknown.logged_at = now
+            LOGGER.debug("Ignoring push data from unknown device %s at %s (%d pushes so far)", mac_addr, remote, unknown.pushes)
+
+        if (mac_addr and remote and not unknown.discovery_started and self.on_unknown_device is not None
+                and 0 < self.discovery_pushes <= unknown.pushes):
+            unknown.discovery_started = True
+            self.on_unknown_device(mac_addr, remote)
+
+
+@singleton.singleton(DATA_NEST_PROXY)
 async def get_nest_proxy(
         hass: HomeAssistant,
         local_port=8600,
 ) -> NestProxy:
     nest_proxy = NestProxy()
 
-    # disable persistent HTTP connections as the Wibeee Cloud will otherwise
-    # time out our connections, causing a ServerDisconnectedError below.
-    connector = aiohttp.TCPConnector(force_close=True)
+    # keep connections to the upstreams open for reuse. the Wibeee Cloud times out idle connections, which
+    # request_upstream deals with by retrying on a new connection when it gets a ServerDisconnectedError.
+    connector = aiohttp.TCPConnector(
+        limit_per_host=UPSTREAM_CONNECTION_LIMIT,
+        keepalive_timeout=UPSTREAM_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=UPSTREAM_DNS_CACHE_TTL,
+    )
     session = aiohttp.ClientSession(connector=connector)
 
     @callback
     def close_session(ev: EventType) -> None:
+        for forwarder in nest_proxy.forwarders.values():
+            forwarder.close()
         session.detach()
         connector.close()
 
     hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, close_session)
 
-    def nest_forward(decode_data: Callable[[web.Request], Awaitable[Tuple[str, Dict]]]) -> _HandlerType:
+    @callback
+    def discover_device(mac_addr: str, host: str) -> None:
+        LOGGER.info("Unknown Wibeee %s is pushing data from %s, starting discovery", mac_addr, host)
+        discovery_flow.async_create_flow(hass, DOMAIN, context={'source': SOURCE_INTEGRATION_DISCOVERY}, data={CONF_HOST: host, CONF_MAC: mac_addr})
+
+    nest_proxy.on_unknown_device = discover_device
+    app = create_nest_app(nest_proxy, session)
+
+    # don't listen on public IP
+    local_ip = await async_get_source_ip(hass, target_ip=PUBLIC_TARGET_IP)
+
+    # access log only if DEBUG level is enabled
+    access_log = logging.getLogger(f'{__name__}.access')
+    access_log.setLevel(access_log.getEffectiveLevel() + 10)
+
+    server = hass.loop.create_task(web._run_app(app, host=local_ip, port=local_port, access_log=access_log))
+    LOGGER.info('Wibeee Nest proxy listening on http://%s:%d', local_ip, local_port)
+
+    @callback
+    def shutdown_proxy(ev: EventType) -> None:
+        LOGGER.info('Wibeee Nest proxy shutting down')
+        server.cancel()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shutdown_proxy)
+    return nest_proxy
+
+
+def create_nest_app(nest_proxy: NestProxy, session: aiohttp.ClientSession) -> web.Application:
+    """Creates the web app that receives the devices' push requests and forwards them upstream using `session`."""
+
+    def reject_unknown(req: web.Request, mac_addr: Optional[str]) -> web.StreamResponse:
+        nest_proxy.metrics.record_push(req.path, mac_addr, False)
+        nest_proxy.handle_unknown_push(mac_addr, req.remote)
+        return web.Response(status=404)  # Not Found
+
+    def nest_forward(decode_data: Callable[[web.Request], Awaitable[Tuple[str, Dict]]],
+                     peek_mac: Optional[Callable[[web.Request], Optional[str]]] = None) -> _HandlerType:
         async def handler(req: web.Request) -> web.StreamResponse:
+            if nest_proxy.capture is not None:
+                nest_proxy.capture.record(PUSH, req.remote, req.method, req.path_qs, await req.read() if req.can_read_body else None)
+
+            # turn away unknown devices before decoding their data when the MAC address can be had cheaply.
+            if peek_mac is not None:
+                mac_addr = peek_mac(req)
+                if nest_proxy.get_device_info(mac_addr) is None:
+                    return reject_unknown(req, mac_addr)
+
             mac_addr, push_data, forward_body = await decode_data(req)
             device_info = nest_proxy.get_device_info(mac_addr)
-
             if device_info is None:
-                LOGGER.debug("Ignoring unexpected push data from %s received as %s %s: %s", mac_addr, req.method, req.path, push_data)
-                return web.Response(status=404)  # Not Found
+                return reject_unknown(req, mac_addr)
+
+            nest_proxy.metrics.record_push(req.path, mac_addr, True)
 
             LOGGER.debug("Updating sensors using push data from %s received as %s %s: %s", mac_addr, req.method, req.path, push_data)
             device_info.handle_push_data(push_data)
 
+            # secondary upstreams are only ever queued, so that they never hold up the device no matter how many there are.
+            for secondary in device_info.secondary_upstreams:
+                nest_proxy.get_forwarder(session, secondary).enqueue(ForwardRequest(req.method, req.path_qs, forward_body))
+
             if device_info.upstream == NEST_NULL_UPSTREAM:
                 # don't send to any upstream.
                 LOGGER.debug("Accepted local-only push data from %s in %s %s: %s", mac_addr, req.method, req.path, push_data)
                 return web.Response(status=202)  # Accepted
 
+            if device_info.forward_in_background:
+                LOGGER.debug("Queueing push data from %s for forwarding to %s: %s", mac_addr, device_info.upstream, push_data)
+                nest_proxy.get_forwarder(session, device_info.upstream).enqueue(ForwardRequest(req.method, req.path_qs, forward_body))
+                return web.Response(status=202)  # Accepted
+
             url = f'{device_info.upstream}{req.path_qs}'
+            started = time.monotonic()
             try:
                 LOGGER.debug("Forwarding push data from %s using %s %s: %s", mac_addr, req.method, url, push_data)
-                res = await session.request(req.method, url, data=forward_body)
-                res_body = await res.read()
+                res = await request_upstream(session, req.method, url, forward_body)
+                nest_proxy.metrics.record_forward(device_info.upstream, res.status, time.monotonic() - started)
                 if res.status < 200 or res.status > 299:
-                    LOGGER.warning('Wibeee Cloud returned %d for forwarded request: %s', res.status, res_body)
+                    LOGGER.warning('Wibeee Cloud returned %d for forwarded request: %s', res.status, res.body)
 
-                return web.Response(status=res.status, headers=res.headers, body=res_body)
+                return web.Response(status=res.status, headers=res.headers, body=res.body)
 
             except aiohttp.ClientError as e:
+                nest_proxy.metrics.record_forward(device_info.upstream, None, time.monotonic() - started)
                 LOGGER.error('Wibeee Cloud HTTP error during %d %s', req.method, req.path, exc_info=e)
                 return web.Response(status=500)  # Server Error
 
         return handler
 
-    app = aiohttp.web.Application()
+    app = web.Application()
     app.add_routes([
-        web.get('/Wibeee/receiver', nest_forward(extract_query_params)),
-        web.get('/Wibeee/receiverAvg', nest_forward(extract_query_params)),
-        web.get('/Wibeee/receiverLeap', nest_forward(extract_query_params)),
+        web.get('/Wibeee/receiver', nest_forward(extract_query_params, peek_query_mac)),
+        web.get('/Wibeee/receiverAvg', nest_forward(extract_query_params, peek_query_mac)),
+        web.get('/Wibeee/receiverLeap', nest_forward(extract_query_params, peek_query_mac)),
         web.post('/Wibeee/receiverAvgPost', nest_forward(extract_json_body)),
         web.post('/Wibeee/receiverJSON', nest_forward(extract_json_body)),
         web.route('*', '/{anypath:.*}', unknown_path_handler),
     ])
+    return app
 
-    # don't listen on public IP
-    local_ip = await async_get_source_ip(hass, target_ip=PUBLIC_TARGET_IP)
-
-    # access log only if DEBUG level is enabled
-    access_log = logging.getLogger(f'{__name__}.access')
-    access_log.setLevel(access_log.getEffectiveLevel() + 10)
 
-    server = hass.loop.create_task(web._run_app(app, host=local_ip, port=local_port, access_log=access_log))
-    LOGGER.info('Wibeee Nest proxy listening on http://%s:%d', local_ip, local_port)
+def peek_query_mac(req: web.Request) -> Optional[str]:
+    """The `mac` query param, found without parsing the rest of the query string. Devices send it first."""
+    query_string = req.query_string
+    if query_string.startswith('mac='):
+        start = 4
+    else:
+        start = query_string.find('&mac=')
+        if start < 0:
+            return None
+        start += 5
 
-    @callback
-    def shutdown_proxy(ev: EventType) -> None:
-        LOGGER.info('Wibeee Nest proxy shutting down')
-        server.cancel()
-
-    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shutdown_proxy)
-    return nest_proxy
+    end = query_string.find('&', start)
+    return unquote_plus(query_string[start:end if end >= 0 else len(query_string)])
 
 
-async def extract_query_params(req: web.Request) -> Tuple[str, Dict, Optional[str]]:
+async def extract_query_params(req: web.Request) -> Tuple[str, Dict, Optional[bytes]]:
     """Extracts Wibeee data from query params."""
     query = {k: v for k, v in parse_qsl(req.query_string)}
-    return query['mac'], query, await req.text() if req.can_read_body else None
+    return query['mac'], query, await req.read() if req.can_read_body else None
 
 
-async def extract_json_body(req: web.Request) -> Tuple[Optional[str], Dict, str]:
-    """Extracts Wibeee data from JSON request body."""
-    body = await req.text() if req.can_read_body else None
-    LOGGER.debug("Parsing JSON in %s %s", req.method, req.path, body)
-    parsed_body = None
-    parse_error = None
+async def extract_json_body(req: web.Request) -> Tuple[Optional[str], Dict, Optional[bytes]]:
+    """Extracts Wibeee data from JSON request body. The body is forwarded as received unless it had to be repaired."""
+    body = await req.read() if req.can_read_body else None
+    LOGGER.debug("Parsing JSON in %s %s: %s", req.method, req.path, body)
+    if body is None:
+        return None, {}, body
+
     try:
-        parsed_body = {} if body is None else json.loads(body)
+        parsed_body = json_loads(body)
 
-    except json.decoder.JSONDecodeError as e:
+    except ValueError as e:
         # Wibeee will send invalid JSON at times. make a desperate attempt to fix the JSON and try again. (╯°□°）╯︵ ┻━┻
-        fixed_body = body.replace(',,', ',').replace('""', '","')
-        if fixed_body != body:
-            try:
-                parsed_body = json.loads(fixed_body)
-                LOGGER.debug("Fixed invalid JSON in %s %s [%s]: %s", req.method, req.path, e, body)
-            except json.decoder.JSONDecodeError:
-                parse_error = e
+        fixed_body = repair_json(body)
+        try:
+            parsed_body = json_loads(fixed_body)
+            LOGGER.debug("Fixed invalid JSON in %s %s [%s]: %s", req.method, req.path, e, body)
+            body = fixed_body
+        except ValueError:
+            LOGGER.debug("Error parsing JSON in %s %s: %s", req.method, req.path, body, exc_info=e)
+            return None, {}, body
+
+    return parsed_body.get('mac', None), parsed_body, body
+
+
+_WHITESPACE = frozenset(b' \t\r\n')
+_QUOTE, _BACKSLASH, _COMMA, _COLON = b'"\\,:'
+_OPEN, _CLOSE = frozenset(b'{['), frozenset(b'}]')
+
+
+def repair_json(body: bytes) -> bytes:
+    """
+    Repairs the broken JSON that Wibeee devices send at times in a single pass: commas that are missing between values
+    (e.g.: `"a":"1""b":"2"`) are added, and repeated, leading or trailing commas (e.g.: `"a":"1",,"b":"2"`) are dropped.
+    Strings are copied verbatim so empty strings and escaped quotes are left alone.
+    """
+    out = bytearray()
+    in_string = escaped = after_value = pending_comma = False
+    for c in body:
+        if in_string:
+            out.append(c)
+            if escaped:
+                escaped = False
+            elif c == _BACKSLASH:
+                escaped = True
+            elif c == _QUOTE:
+                in_string = False
+                after_value = True
+        elif c in _WHITESPACE:
+            out.append(c)
+        elif c == _COMMA:
+            # only keep a comma that follows a value, and hold on to it until we know that another value follows.
+            pending_comma = pending_comma or after_value
+            after_value = False
+        elif c in _CLOSE:
+            pending_comma = False
+            out.append(c)
+            after_value = True
+        elif c == _COLON:
+            pending_comma = after_value = False
+            out.append(c)
         else:
-            parse_error = e
-
-    if parse_error:
-        LOGGER.debug("Error parsing JSON in %s %s: %s", req.method, req.path, body, exc_info=parse_error)
-        return None, {}, body
-
-    return parsed_body.get('mac', None), parsed_body, json.dumps(parsed_body)
+            # start of a string, object, array or literal
+            if pending_comma or (after_value and (c == _QUOTE or c in _OPEN)):
+                out.append(_COMMA)
+            pending_comma = False
+            out.append(c)
+            in_string = c == _QUOTE
+            after_value = not in_string and c not in _OPEN
+
+    return bytes(out)
 
 
 async def unknown_path_handler(req: web.Request) -> web.StreamResponse:
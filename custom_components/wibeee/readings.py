@@ -0,0 +1,109 @@
+import math
+import time
+from array import array
+from typing import Optional, Mapping, Sequence
+
+NAN = math.nan
+
+
+class ReadingLayout(object):
+    """
+    Assigns each sensor of a device a fixed slot in that device's `DeviceReadings`, and knows which slot each
+    `values.xml` variable and Nest push parameter belongs to. Built once at setup time.
+    """
+    __slots__ = ('size', 'poll_vars', 'poll_index', 'push_index')
+
+    def __init__(self, poll_vars: list[Optional[str]], push_vars: list[Optional[str]]):
+        self.size = len(poll_vars)
+        self.poll_vars = poll_vars
+        self.poll_index: dict[str, int] = {var: slot for slot, var in enumerate(poll_vars) if var is not None}
+        self.push_index: dict[str, list[int]] = {}
+        "push parameter to slots, a parameter may back more than one sensor (e.g.: 'r1' for both reactive power types)"
+        for slot, var in enumerate(push_vars):
+            if var is not None:
+                self.push_index.setdefault(var, []).append(slot)
+
+
+class DeviceReadings(object):
+    """
+    Latest readings of a device as floats, one slot per sensor as assigned by the `ReadingLayout`. Values are parsed
+    once when they are ingested and unavailable values are stored as NaN.
+    """
+    __slots__ = ('layout', 'values', 'timestamp', 'source', 'pushed_at', 'push_mask')
+
+    def __init__(self, layout: ReadingLayout):
+        self.layout = layout
+        self.values = array('d', [NAN]) * layout.size
+        self.timestamp: float = 0.0
+        "time.time() of the last ingest"
+        self.source: str = ''
+        "where the last ingest came from"
+        self.pushed_at: Optional[float] = None
+        "time.monotonic() of the last push ingest"
+        self.push_mask = bytearray(layout.size)
+        "1 for the slots that have been updated by push data"
+
+    def ingest_poll(self, data: Mapping[str, any], source: str = 'values.xml', slots: Sequence[int] = None) -> Sequence[int]:
+        """Ingests polled values for `slots` (default all). Polls are complete so any slot missing from data becomes unavailable."""
+        values = self.values
+        poll_vars = self.layout.poll_vars
+        slots = range(self.layout.size) if slots is None else slots
+        for slot in slots:
+            var = poll_vars[slot]
+            values[slot] = to_float(data.get(var)) if var is not None else NAN
+
+        self._stamp(source)
+        return slots
+
+    def ingest_push(self, data: Mapping[str, any], source: str = 'Nest push') -> list[int]:
+        """Ingests pushed values, returning the slots that were updated. Slots missing from data are left as they were."""
+        values = self.values
+        push_mask = self.push_mask
+        push_index = self.layout.push_index
+        updated = []
+        # pushes carry few keys beyond the ones we know, so walking the push is cheaper than building a key set.
+        for var, raw in data.items():
+            slots = push_index.get(var)
+            if slots is None:
+                continue
+            try:
+                value = float(raw)
+            except (TypeError, ValueError):
+                value = NAN
+            for slot in slots:
+                values[slot] = value
+                push_mask[slot] = 1
+            updated.extend(slots)
+
+        self._stamp(source)
+        self.pushed_at = time.monotonic()
+        return updated
+
+    def ingest_slots(self, slot_values: Mapping[int, float], source: str) -> list[int]:
+        """Ingests values that have already been parsed and assigned to slots, returning the slots that were updated."""
+        values = self.values
+        for slot, value in slot_values.items():
+            values[slot] = value
+
+        self._stamp(source)
+        return list(slot_values)
+
+    def is_push_fresh(self, grace_period_secs: float) -> bool:
+        """Whether push data has been received within the grace period."""
+        return self.pushed_at is not None and time.monotonic() - self.pushed_at < grace_period_secs
+
+    def non_pushed_slots(self) -> list[int]:
+        """Slots that have never been updated by push data, which can only be refreshed by polling."""
+        return [slot for slot, pushed in enumerate(self.push_mask) if not pushed]
+
+    def _stamp(self, source: str) -> None:
+        self.timestamp = time.time()
+        self.source = source
+
+
+def to_float(value: any) -> float:
+    """Converts a raw Wibeee value to float, NaN if it is missing or not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
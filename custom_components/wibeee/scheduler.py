@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import random
+from datetime import timedelta, datetime
+from typing import Callable, Awaitable, Optional
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant, callback, CALLBACK_TYPE
+from homeassistant.helpers.typing import EventType
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, MAX_CONCURRENT_POLLS
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_POLL_SCHEDULER = 'poll_scheduler'
+"""Key of the PollScheduler in hass.data[DOMAIN]."""
+
+_JITTER = 0.25
+"""Random delay added to each poll, as a fraction of the time between two devices' polls."""
+
+PollCallback = Callable[[datetime], Awaitable[None]]
+
+
+class _PollJob(object):
+    __slots__ = ('key', 'poll', 'interval', 'phase', 'spread', 'handle', 'task')
+
+    def __init__(self, key: str, poll: PollCallback, interval: float):
+        self.key = key
+        self.poll = poll
+        self.interval = interval
+        self.phase = 0.0
+        self.spread = interval
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class PollScheduler(object):
+    """
+    Polls every Wibeee device in Home Assistant. Devices that share a polling interval are spread evenly across that
+    interval (plus some jitter) instead of all firing in the same tick, and at most `max_concurrent` polls are in
+    flight at any time. A device whose previous poll is still running when it is due again skips that poll.
+
+    Polls are timed with `hass.loop`'s time() and call_at(), and the jitter is drawn from `jitter` (random.uniform by
+    default), so that tests can drive the schedule deterministically.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_concurrent: int = MAX_CONCURRENT_POLLS,
+                 jitter: Callable[[float, float], float] = random.uniform):
+        self._hass = hass
+        self._loop = hass.loop
+        self._jitter = jitter
+        self._epoch = hass.loop.time()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._jobs: dict[str, _PollJob] = {}
+        self.max_concurrent = max_concurrent
+        self.waiting = 0
+        "polls that are waiting for a free slot"
+        self.in_flight = 0
+        "polls that are running"
+        self.counters = {'polls': 0, 'skipped': 0, 'failed': 0}
+
+    def add(self, key: str, poll: PollCallback, interval: timedelta) -> CALLBACK_TYPE:
+        """Starts polling using `poll`, returns a callback that stops it."""
+        self.remove(key)
+        job = self._jobs[key] = _PollJob(key, poll, interval.total_seconds())
+        self._rebalance(job.interval)
+
+        @callback
+        def remove_job() -> None:
+            self.remove(key)
+
+        return remove_job
+
+    def remove(self, key: str) -> None:
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            _cancel(job)
+            self._rebalance(job.interval)
+
+    def stop(self) -> None:
+        for job in self._jobs.values():
+            _cancel(job)
+        self._jobs.clear()
+
+    def _rebalance(self, interval: float) -> None:
+        """Spreads the jobs with this interval evenly across it."""
+        jobs = sorted((j for j in self._jobs.values() if j.interval == interval), key=lambda j: j.key)
+        for n, job in enumerate(jobs):
+            job.phase = interval * n / len(jobs)
+            job.spread = interval / len(jobs)
+            self._schedule(job)
+
+    def _schedule(self, job: _PollJob) -> None:
+        if job.handle is not None:
+            job.handle.cancel()
+
+        now = self._loop.time()
+        until_next = job.interval - (now - self._epoch - job.phase) % job.interval
+        job.handle = self._loop.call_at(now + until_next + self._jitter(0, _JITTER * job.spread), self._fire, job)
+
+    @callback
+    def _fire(self, job: _PollJob) -> None:
+        job.handle = None
+        self._schedule(job)
+
+        if job.task is not None and not job.task.done():
+            self.counters['skipped'] += 1
+            _LOGGER.warning("Skipping poll of %s, previous poll still running (%d polls in flight, %d waiting, max %d)",
+                            job.key, self.in_flight, self.waiting, self.max_concurrent)
+            return
+
+        if self.waiting > 0:
+            _LOGGER.debug("Poll backlog: %d polls waiting, %d in flight", self.waiting, self.in_flight)
+
+        job.task = self._hass.async_create_task(self._run(job))
+
+    async def _run(self, job: _PollJob) -> None:
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            self.counters['polls'] += 1
+            await job.poll(dt_util.utcnow())
+        except Exception:
+            self.counters['failed'] += 1
+            _LOGGER.exception("Error polling %s", job.key)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+def _cancel(job: _PollJob) -> None:
+    if job.handle is not None:
+        job.handle.cancel()
+        job.handle = None
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+
+
+def get_poll_scheduler(hass: HomeAssistant) -> PollScheduler:
+    """Returns the domain-wide PollScheduler, creating it on first use."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    scheduler = domain_data.get(DATA_POLL_SCHEDULER)
+    if scheduler is None:
+        scheduler = domain_data[DATA_POLL_SCHEDULER] = PollScheduler(hass)
+
+        @callback
+        def stop_scheduler(ev: EventType) -> None:
+            scheduler.stop()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, stop_scheduler)
+
+    return scheduler
@@ -6,12 +6,13 @@ Documentation: https://github.com/luuuis/hass_wibeee/
 
 """
 
-REQUIREMENTS = ["xmltodict"]
-
 import logging
+import math
+import time
 from datetime import timedelta
-from typing import NamedTuple, Optional
+from typing import NamedTuple, Optional, Iterable, Callable
 
+import aiohttp
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.components.sensor import (
@@ -33,9 +34,12 @@ from homeassistant.const import (
     CONF_SCAN_INTERVAL,
     CONF_TIMEOUT,
     CONF_UNIQUE_ID,
-    STATE_UNAVAILABLE,
+    EntityCategory,
+    PERCENTAGE,
+    UnitOfInformation,
+    UnitOfTime,
 )
-from homeassistant.core import HomeAssistant, callback
+from homeassistant.core import HomeAssistant, callback, CALLBACK_TYPE
 from homeassistant.exceptions import PlatformNotReady
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.entity import DeviceInfo as HassDeviceInfo
@@ -44,15 +48,46 @@ from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.typing import StateType
 from homeassistant.util import slugify
 
+from .aggregation import WindowAggregator, MEAN
 from .api import WibeeeAPI, DeviceInfo
+from .cache import DeviceCache
+from .capture import TrafficCapture, get_traffic_capture
+from .derived import DerivedMetric, DerivedEngine, import_power, export_power, imbalance, share
+from .external_statistics import StatisticsCollector, async_setup_statistics
 from .const import (
     DOMAIN,
     DEFAULT_SCAN_INTERVAL,
     DEFAULT_TIMEOUT,
     CONF_NEST_UPSTREAM,
+    CONF_NEST_FORWARD_IN_BACKGROUND,
+    CONF_NEST_SECONDARY_UPSTREAMS,
+    CONF_NEST_DISCOVERY_PUSHES,
+    DEFAULT_NEST_DISCOVERY_PUSHES,
     NEST_PROXY_DISABLED,
+    CONF_PUSH_GRACE_PERIOD,
+    DEFAULT_PUSH_GRACE_PERIOD,
+    PUSH_KEEPALIVE_INTERVAL,
+    CONF_FORCE_UPDATE_INTERVAL,
+    DEFAULT_FORCE_UPDATE_INTERVAL,
+    CONF_PROBE_INTERVAL,
+    DEFAULT_PROBE_INTERVAL,
+    CONF_PUSH_AGGREGATION_WINDOW,
+    CONF_PUSH_AGGREGATION,
+    CONF_IMPORT_STATISTICS,
+    CONF_SITE,
+    CONF_DEADBAND_VOLTAGE,
+    CONF_DEADBAND_CURRENT,
+    CONF_DEADBAND_FREQUENCY,
+    CONF_DEADBAND_POWER,
+    CONF_DEADBAND_RELATIVE,
+    CONF_RAW_LOG_SAMPLING,
+    CONF_CAPTURE_TRAFFIC,
 )
+from .metrics import DeviceMetrics
 from .nest import get_nest_proxy
+from .readings import ReadingLayout, DeviceReadings, NAN
+from .scheduler import get_poll_scheduler
+from .site import SiteMeter, SiteMember, SITE_VARIABLES, get_site_meter, async_setup_site_meter
 from .util import short_mac
 
 _LOGGER = logging.getLogger(__name__)
@@ -123,6 +158,31 @@ KNOWN_MODELS = {
     'WBP': 'Wibeee PLUG',
 }
 
+ALL_PHASES = ('1', '2', '3', '4')
+"""Phases as used in sensor names, '4' holds the totals across all phases."""
+
+
+class ModelCapabilities(NamedTuple):
+    """What a Wibeee model is able to measure."""
+    phases: tuple[str, ...] = ALL_PHASES
+    "phases (or clamps) of the device"
+
+
+MODEL_CAPABILITIES = {
+    'WBM': ModelCapabilities(phases=('1', '4')),
+    'WBP': ModelCapabilities(phases=('1', '4')),
+    'WBT': ModelCapabilities(phases=ALL_PHASES),
+    'WTD': ModelCapabilities(phases=ALL_PHASES),
+    'W3P': ModelCapabilities(phases=ALL_PHASES),
+    'WB3': ModelCapabilities(phases=ALL_PHASES),
+}
+"""Capabilities of the models whose topology is known. Single-phase models report zeroes for phases 2 and 3."""
+
+
+def get_model_capabilities(model: Optional[str]) -> ModelCapabilities:
+    """Returns the capabilities of a model, unknown models are assumed to be able to measure everything."""
+    return MODEL_CAPABILITIES.get((model or '').strip(), ModelCapabilities())
+
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Import existing configuration from YAML."""
@@ -136,17 +196,52 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     ))
 
 
+class Deadband(NamedTuple):
+    """Changes that are not bigger than both thresholds are not written to the state machine."""
+    absolute: float = 0.0
+    "absolute change in the sensor's unit (e.g.: 0.5 V)"
+    relative: float = 0.0
+    "change relative to the last written value (e.g.: 0.01 for 1%)"
+
+    def exceeded_by(self, old_value: float, new_value: float) -> bool:
+        delta = abs(new_value - old_value)
+        return delta > self.absolute and delta > self.relative * abs(old_value)
+
+
+_DEADBAND_OPTIONS_BY_UNIT = {
+    ELECTRIC_POTENTIAL_VOLT: CONF_DEADBAND_VOLTAGE,
+    ELECTRIC_CURRENT_AMPERE: CONF_DEADBAND_CURRENT,
+    FREQUENCY_HERTZ: CONF_DEADBAND_FREQUENCY,
+    POWER_WATT: CONF_DEADBAND_POWER,
+    POWER_VOLT_AMPERE: CONF_DEADBAND_POWER,
+    POWER_VOLT_AMPERE_REACTIVE: CONF_DEADBAND_POWER,
+}
+
+
+def get_deadband(sensor_type: SensorType, options: dict) -> Deadband:
+    """Returns the configured deadband for a sensor type. Energy sensors are always updated when they change."""
+    if sensor_type.device_class in ENERGY_CLASSES:
+        return Deadband()
+
+    absolute_option = _DEADBAND_OPTIONS_BY_UNIT.get(sensor_type.unit)
+    return Deadband(
+        absolute=float(options.get(absolute_option, 0)) if absolute_option else 0.0,
+        relative=float(options.get(CONF_DEADBAND_RELATIVE, 0)) / 100,
+    )
+
+
 class StatusElement(NamedTuple):
     phase: str
     xml_name: str
     sensor_type: SensorType
 
 
-def get_status_elements() -> list[StatusElement]:
-    """Returns the expected elements in the status XML response for this device."""
+def get_status_elements(model: Optional[str] = None) -> list[StatusElement]:
+    """Returns the expected elements in the status XML response for this device model."""
+    phases = get_model_capabilities(model).phases
 
     def get_xml_names(s: SensorType) -> list[(str, str)]:
-        return [('4' if ph == 't' else ph, f"{s.poll_var_prefix}{ph}") for ph in ['1', '2', '3', 't']]
+        return [(ph, f"{s.poll_var_prefix}{'t' if ph == '4' else ph}") for ph in phases]
 
     return [
         StatusElement(phase, xml_name, sensor_type)
@@ -155,57 +250,309 @@ def get_status_elements() -> list[StatusElement]:
     ]
 
 
-def update_sensors(sensors, update_source, lookup_key, data):
-    if _LOGGER.isEnabledFor(logging.DEBUG):
-        sensors_with_updates = [s for s in sensors if lookup_key(s) in data]
-        _LOGGER.debug('Received %d sensor values from %s: %s', len(sensors_with_updates), update_source, data)
+def get_push_param(sensor_phase: str, sensor_type: SensorType) -> Optional[str]:
+    """Returns the name of the parameter that holds this sensor's value in Nest push requests, if any."""
+    if sensor_type.push_var_prefix is None:
+        return None
+
+    return f"{sensor_type.push_var_prefix}{'t' if sensor_phase == '4' else sensor_phase}"
+
+
+class DerivedElement(NamedTuple):
+    phase: str
+    sensor_type: SensorType
+    metric: DerivedMetric
+
+
+def get_derived_elements(model: Optional[str] = None) -> list[DerivedElement]:
+    """Returns the derived metrics for this device model, which only need the values of the model's own sensors."""
+    phases = [ph for ph in get_model_capabilities(model).phases if ph != '4']
+    elements = [
+        DerivedElement('4', SensorType(None, None, 'Active_Power_Import', 'Active Power Import', POWER_WATT, SensorDeviceClass.POWER),
+                       DerivedMetric(('pact',), import_power)),
+        DerivedElement('4', SensorType(None, None, 'Active_Power_Export', 'Active Power Export', POWER_WATT, SensorDeviceClass.POWER),
+                       DerivedMetric(('pact',), export_power)),
+    ]
+    if len(phases) < 2:
+        return elements
+
+    currents = tuple(f'irms{ph}' for ph in phases)
+    return elements + [
+        DerivedElement('4', SensorType(None, None, 'Total_Current', 'Total Current', ELECTRIC_CURRENT_AMPERE, SensorDeviceClass.CURRENT),
+                       DerivedMetric(currents, sum)),
+        DerivedElement('4', SensorType(None, None, 'Max_Current', 'Max Phase Current', ELECTRIC_CURRENT_AMPERE, SensorDeviceClass.CURRENT),
+                       DerivedMetric(currents, max)),
+        DerivedElement('4', SensorType(None, None, 'Current_Imbalance', 'Current Imbalance', PERCENTAGE, device_class=None),
+                       DerivedMetric(currents, imbalance)),
+        DerivedElement('4', SensorType(None, None, 'Voltage_Imbalance', 'Voltage Imbalance', PERCENTAGE, device_class=None),
+                       DerivedMetric(tuple(f'vrms{ph}' for ph in phases), imbalance)),
+    ] + [
+        DerivedElement(ph, SensorType(None, None, 'Active_Power_Share', 'Active Power Share', PERCENTAGE, device_class=None),
+                       DerivedMetric((f'pac{ph}', 'pact'), share))
+        for ph in phases
+    ]
+
+
+class SensorBatch(object):
+    """
+    Applies the updates for all of a device's sensors and writes the states of those that changed in a single event
+    loop callback, instead of scheduling one state write per sensor. Only sensors that have been added to Home
+    Assistant are known to the batch, so disabled sensors are skipped without looking them up. Derived sensors are
+    updated in the same pass from the `derived` engine, their slots come after the device's own sensors.
+    """
+
+    def __init__(self, hass: HomeAssistant, name: str, size: int, derived: Optional[DerivedEngine] = None):
+        self._hass = hass
+        self.name = name
+        self.derived = derived
+        self.site: Optional[SiteMember] = None
+        "reports the device's values to the site meter while the site config entry is loaded"
+        self.sensors: list[Optional['WibeeeSensor']] = [None] * (size + (len(derived.values) if derived is not None else 0))
+        "sensors that are in Home Assistant by slot"
+        self._pending: dict[int, 'WibeeeSensor'] = {}
+        self.stats = {'ingests': 0, 'writes': 0, 'ingest_secs': 0.0, 'write_secs': 0.0}
+
+    @callback
+    def add_sensor(self, sensor: 'WibeeeSensor') -> None:
+        self.sensors[sensor.slot] = sensor
 
-    for s in sensors:
-        value = data.get(lookup_key(s), STATE_UNAVAILABLE)
-        s.update_value(value, update_source)
+    @callback
+    def remove_sensor(self, sensor: 'WibeeeSensor') -> None:
+        self.sensors[sensor.slot] = None
 
+    @callback
+    def join_site(self, site_meter: SiteMeter, readings: DeviceReadings) -> None:
+        """Starts reporting to the site meter, beginning with the current readings."""
+        self.site = site_meter.add_member(self.name, readings.layout)
+        self.site.update(readings.values, range(readings.layout.size))
 
-def setup_local_polling(hass: HomeAssistant, api: WibeeeAPI, device: DeviceInfo, sensors: list['WibeeeSensor'], scan_interval: timedelta):
-    def poll_xml_param(sensor: WibeeeSensor) -> str:
-        return sensor.status_xml_param
+    @callback
+    def leave_site(self) -> None:
+        if self.site is not None:
+            self.site.meter.remove_member(self.name)
+            self.site = None
+
+    @callback
+    def update(self, readings: DeviceReadings, slots: Iterable[int], data: dict) -> None:
+        """Updates the sensors in `slots` from the device readings."""
+        started = time.perf_counter()
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug('Received %d sensor values from %s: %s', len(slots), readings.source, data)
+
+        sensors = self.sensors
+        values = readings.values
+        now = time.monotonic()
+        schedule_flush = not self._pending
+        for slot in slots:
+            sensor = sensors[slot]
+            if sensor is not None and sensor.update_value(values[slot], now):
+                self._pending[slot] = sensor
+
+        if self.site is not None:
+            self.site.update(values, slots)
+
+        derived = self.derived
+        if derived is not None:
+            offset = derived.offset
+            for i in derived.update(values, slots):
+                sensor = sensors[offset + i]
+                if sensor is not None and sensor.update_value(derived.values[i], now):
+                    self._pending[offset + i] = sensor
+
+        if schedule_flush and self._pending:
+            self._hass.loop.call_soon(self._flush)
+
+        self.stats['ingests'] += 1
+        self.stats['ingest_secs'] += time.perf_counter() - started
+
+    @callback
+    def _flush(self) -> None:
+        started = time.perf_counter()
+        pending, self._pending = self._pending, {}
+        for sensor in pending.values():
+            if sensor.hass is not None:
+                sensor.async_write_ha_state()
+
+        elapsed = time.perf_counter() - started
+        self.stats['writes'] += len(pending)
+        self.stats['write_secs'] += elapsed
+        _LOGGER.debug("Wrote %d states for %s in %.2fms", len(pending), self.name, elapsed * 1000)
+
+
+def setup_local_polling(hass: HomeAssistant, api: WibeeeAPI, device: DeviceInfo, batch: SensorBatch, readings: DeviceReadings,
+                        scan_interval: timedelta, push_grace_period: timedelta = DEFAULT_PUSH_GRACE_PERIOD, cache: DeviceCache = None,
+                        collector: StatisticsCollector = None):
+    # only poll for the variables that back our sensors, falling back to the full values.xml dump if the device rejects it.
+    # a var query that fails for other reasons (e.g.: a timeout) fails the poll, as a second request would only add load.
+    use_var_query = True
+
+    # while push data keeps arriving only the variables that are not pushed get polled, and at a slower rate.
+    push_grace_secs = push_grace_period.total_seconds()
+    keepalive_secs = max(PUSH_KEEPALIVE_INTERVAL, scan_interval).total_seconds()
+    last_poll = 0.0
+
+    async def fetch_poll_vars(poll_vars: list[str]) -> dict:
+        nonlocal use_var_query
+        if use_var_query:
+            # the device answered but doesn't support var queries if it returns none of the variables or a 4xx.
+            try:
+                fetched = await api.async_fetch_values(device.id, poll_vars, retries=3)
+                if not fetched.keys().isdisjoint(poll_vars):
+                    return fetched
+            except aiohttp.ClientResponseError as err:
+                if not 400 <= err.status < 500:
+                    raise
+                _LOGGER.debug("Device %s rejected values.xml?var=..., trying full values.xml", device.macAddr, exc_info=err)
+
+            fetched = await api.async_fetch_values(device.id, retries=3)
+            if not fetched.keys().isdisjoint(poll_vars):
+                _LOGGER.warning("Device %s did not answer values.xml?var=..., polling full values.xml from now on", device.macAddr)
+                use_var_query = False
+
+            return fetched
+
+        return await api.async_fetch_values(device.id, retries=3)
 
     async def fetching_data(now=None):
+        nonlocal last_poll
+        poll_slots = None
+        if now is not None and readings.is_push_fresh(push_grace_secs):
+            poll_slots = readings.non_pushed_slots()
+            if not poll_slots or time.monotonic() - last_poll < keepalive_secs:
+                _LOGGER.debug("Skipping poll of %s, push data is fresh and %d variables are not pushed", device.macAddr, len(poll_slots))
+                return
+
+        last_poll = time.monotonic()
+        poll_vars = [readings.layout.poll_vars[slot] for slot in (poll_slots if poll_slots is not None else range(readings.layout.size))]
         fetched = {}
         try:
-            fetched = await api.async_fetch_values(device.id, retries=3)
+            fetched = await fetch_poll_vars(poll_vars)
         except Exception as err:
             if now is None:
                 raise PlatformNotReady from err
 
-        update_sensors(sensors, 'values.xml', poll_xml_param, fetched)
+        updated_slots = readings.ingest_poll(fetched, 'values.xml', poll_slots)
+        if collector is not None:
+            collector.add(readings.values, updated_slots, readings.timestamp)
+        batch.update(readings, updated_slots, fetched)
+        if fetched and cache is not None:
+            cache.async_schedule_save(device, readings)
 
-    return async_track_time_interval(hass, fetching_data, scan_interval)
+    return get_poll_scheduler(hass).add(device.macAddr, fetching_data, scan_interval)
 
 
-async def async_setup_local_push(hass: HomeAssistant, entry: ConfigEntry, device: DeviceInfo, sensors: list['WibeeeSensor']):
+async def async_setup_local_push(hass: HomeAssistant, entry: ConfigEntry, device: DeviceInfo, batch: SensorBatch,
+                                 readings: DeviceReadings, cache: DeviceCache = None, metrics: DeviceMetrics = None,
+                                 capture: TrafficCapture = None, aggregator: WindowAggregator = None, collector: StatisticsCollector = None):
     mac_address = device.macAddr
     nest_proxy = await get_nest_proxy(hass)
+    # the proxy captures every push while any entry has capture enabled.
+    remove_capture = nest_proxy.add_capture(capture) if capture is not None else None
+
+    remove_aggregation = None
+    if aggregator is not None:
+        # pushes only fill the aggregator's buffers, the sensors are updated once per window.
+        @callback
+        def end_window(now=None) -> None:
+            slots = aggregator.reduce()
+            if slots:
+                batch.update(aggregator.output, slots, {})
+
+        remove_aggregation = async_track_time_interval(hass, end_window, aggregator.window)
 
     def on_pushed_data(pushed_data: dict) -> None:
-        pushed_sensors = [s for s in sensors if s.nest_push_param in pushed_data]
-        update_sensors(pushed_sensors, 'Nest push', lambda s: s.nest_push_param, pushed_data)
+        if metrics is not None:
+            metrics.counters['pushes'] += 1
+        updated_slots = readings.ingest_push(pushed_data, 'Nest push')
+        if collector is not None:
+            collector.add(readings.values, updated_slots, readings.timestamp)
+        if aggregator is not None:
+            aggregator.add(readings.values, updated_slots)
+        else:
+            batch.update(readings, updated_slots, pushed_data)
+        if updated_slots and cache is not None:
+            cache.async_schedule_save(device, readings)
 
     def unregister_listener():
         nest_proxy.unregister_device(mac_address)
+        if remove_capture is not None:
+            remove_capture()
+        if remove_aggregation is not None:
+            remove_aggregation()
 
     upstream = entry.options.get(CONF_NEST_UPSTREAM)
-    nest_proxy.register_device(mac_address, on_pushed_data, upstream)
+    forward_in_background = entry.options.get(CONF_NEST_FORWARD_IN_BACKGROUND, False)
+    secondary_upstreams = entry.options.get(CONF_NEST_SECONDARY_UPSTREAMS, [])
+    discovery_pushes = entry.options.get(CONF_NEST_DISCOVERY_PUSHES, DEFAULT_NEST_DISCOVERY_PUSHES)
+    nest_proxy.register_device(mac_address, on_pushed_data, upstream, forward_in_background, secondary_upstreams, discovery_pushes)
     return unregister_listener
 
 
+async def async_reconcile_cache(hass: HomeAssistant, entry: ConfigEntry, api: WibeeeAPI, cache: DeviceCache, cached_device: DeviceInfo,
+                                layout: ReadingLayout) -> None:
+    """Checks the cached device info and sensors against the device, reloading the entry if they have changed."""
+    try:
+        device = await api.async_fetch_device_info(retries=5)
+        status = await api.async_fetch_values(device.id, retries=5)
+    except Exception as err:
+        _LOGGER.info("Unable to check cached device info for '%s', will check again on next start-up: %s", entry.unique_id, err)
+        return
+
+    sensor_vars = {e.xml_name for e in get_status_elements(device.model) if e.xml_name in status}
+    if device != cached_device or sensor_vars != set(layout.poll_vars):
+        _LOGGER.info("Device '%s' has changed since it was cached, reloading", entry.unique_id)
+        readings = DeviceReadings(ReadingLayout(sorted(sensor_vars), []))
+        readings.ingest_poll(status)
+        await cache.async_save(device, readings)
+        hass.async_create_task(hass.config_entries.async_reload(entry.entry_id))
+
+
+@callback
+def async_join_site_meter(hass: HomeAssistant, batch: SensorBatch, readings: DeviceReadings) -> None:
+    """Reports a device's readings to the site meter if the site config entry is loaded, otherwise the site joins it later."""
+    site_meter = get_site_meter(hass)
+    if site_meter is not None and batch.site is None:
+        batch.join_site(site_meter, readings)
+
+
+async def async_start_site_meter(hass: HomeAssistant) -> tuple[SiteMeter, CALLBACK_TYPE]:
+    """Sets up the site meter with the devices that are already loaded, returning it and a callback that stops it."""
+    site_meter, stop_site_meter = await async_setup_site_meter(hass)
+
+    def loaded_batches() -> list[tuple[SensorBatch, DeviceReadings]]:
+        # hass.data[DOMAIN] also holds shared objects such as the PollScheduler, the device entries' data are dicts.
+        return [(data['batch'], data['readings']) for data in hass.data.get(DOMAIN, {}).values() if isinstance(data, dict) and 'batch' in data]
+
+    for batch, readings in loaded_batches():
+        if batch.site is None:
+            batch.join_site(site_meter, readings)
+
+    @callback
+    def stop_site() -> None:
+        for batch, _ in loaded_batches():
+            batch.leave_site()
+        stop_site_meter()
+
+    return site_meter, stop_site
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback) -> bool:
     """Set up a Wibeee from a config entry."""
+    if entry.data.get(CONF_SITE):
+        site_meter, stop_site = await async_start_site_meter(hass)
+        hass.data[DOMAIN][entry.entry_id]['disposers'].update(site_meter=stop_site)
+        async_add_entities([WibeeeSiteSensor(site_meter, i) for i in range(len(SITE_VARIABLES))])
+        return True
+
     _LOGGER.debug(f"Setting up Wibeee Sensors for '{entry.unique_id}'...")
 
     session = async_get_clientsession(hass)
     host = entry.data[CONF_HOST]
     scan_interval = timedelta(seconds=entry.options.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL.total_seconds()))
     timeout = timedelta(seconds=entry.options.get(CONF_TIMEOUT, DEFAULT_TIMEOUT.total_seconds()))
+    push_grace_period = timedelta(seconds=entry.options.get(CONF_PUSH_GRACE_PERIOD, DEFAULT_PUSH_GRACE_PERIOD.total_seconds()))
+    force_update_interval = timedelta(seconds=entry.options.get(CONF_FORCE_UPDATE_INTERVAL, DEFAULT_FORCE_UPDATE_INTERVAL.total_seconds()))
+    probe_interval = timedelta(seconds=entry.options.get(CONF_PROBE_INTERVAL, DEFAULT_PROBE_INTERVAL.total_seconds()))
     use_nest_proxy = entry.options.get(CONF_NEST_UPSTREAM, NEST_PROXY_DISABLED) != NEST_PROXY_DISABLED
 
     if use_nest_proxy:
@@ -213,29 +560,81 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_e
         # calls if it is unable to push data up to Wibeee Nest, causing this integration to fail at start-up.
         await get_nest_proxy(hass)
 
-    api = WibeeeAPI(session, host, min(timeout, scan_interval))
-    device = await api.async_fetch_device_info(retries=5)
-    status_elements = get_status_elements()
+    api = WibeeeAPI(session, host, min(timeout, scan_interval), probe_interval=probe_interval,
+                    raw_log_sampling=entry.options.get(CONF_RAW_LOG_SAMPLING, 1))
+    capture = get_traffic_capture(hass) if entry.options.get(CONF_CAPTURE_TRAFFIC, False) else None
+    api.capture = capture
+
+    # create the sensors from the cache if we have one so that start-up doesn't depend on the device responding.
+    cache = DeviceCache(hass, entry.entry_id)
+    cached = await cache.async_load()
+    if cached is not None:
+        device, initial_status = cached
+        _LOGGER.debug("Using cached device info and %d values for '%s'", len(initial_status), entry.unique_id)
+    else:
+        device = await api.async_fetch_device_info(retries=5)
+        initial_status = await api.async_fetch_values(device.id, retries=10)
+
+    status_elements = get_status_elements(device.model)
+    sensor_elements = [e for e in status_elements if e.xml_name in initial_status]
+
+    # each sensor gets a slot in the device readings, which are shared by the polling and push paths.
+    layout = ReadingLayout([e.xml_name for e in sensor_elements], [get_push_param(e.phase, e.sensor_type) for e in sensor_elements])
+    readings = DeviceReadings(layout)
+    readings.ingest_poll(initial_status)
+
+    derived_elements = [e for e in get_derived_elements(device.model) if DerivedEngine.supported(layout, e.metric)]
+    derived = DerivedEngine(layout, [e.metric for e in derived_elements])
+    derived.update(readings.values, range(layout.size))
+
+    batch = SensorBatch(hass, device.macAddr, layout.size, derived)
+    aggregation_window = timedelta(seconds=entry.options.get(CONF_PUSH_AGGREGATION_WINDOW, 0))
+    aggregator = WindowAggregator(
+        readings, aggregation_window, entry.options.get(CONF_PUSH_AGGREGATION, MEAN),
+        last_slots=[slot for slot, e in enumerate(sensor_elements) if e.sensor_type.device_class in ENERGY_CLASSES],
+    ) if use_nest_proxy and aggregation_window else None
 
-    initial_status = await api.async_fetch_values(device.id, retries=10)
     sensors = [
-        WibeeeSensor(device, e.phase, e.sensor_type, e.xml_name, initial_status.get(e.xml_name))
-        for e in status_elements if e.xml_name in initial_status
+        WibeeeSensor(device, e.phase, e.sensor_type, e.xml_name, slot, readings.values[slot],
+                     get_deadband(e.sensor_type, entry.options), force_update_interval, batch, aggregator)
+        for slot, e in enumerate(sensor_elements)
+    ] + [
+        WibeeeSensor(device, e.phase, e.sensor_type, None, derived.offset + i, derived.values[i],
+                     get_deadband(e.sensor_type, entry.options), force_update_interval, batch)
+        for i, e in enumerate(derived_elements)
     ]
 
     for sensor in sensors:
         _LOGGER.debug("Adding '%s' (unique_id=%s)", sensor, sensor.unique_id)
-    async_add_entities(sensors, True)
+    diagnostic_sensors = [WibeeeDiagnosticSensor(device, api, d) for d in DIAGNOSTIC_SENSORS]
+    async_add_entities(sensors + diagnostic_sensors, True)
+
+    # keep hold of the runtime state for diagnostics.
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    entry_data.update(device=device, api=api, readings=readings, batch=batch, aggregator=aggregator)
+    disposers = entry_data['disposers']
 
-    disposers = hass.data[DOMAIN][entry.entry_id]['disposers']
+    collector = None
+    if entry.options.get(CONF_IMPORT_STATISTICS, False):
+        collector, remove_statistics = await async_setup_statistics(hass, entry.entry_id, sensors[:layout.size])
+        disposers.update(import_statistics=remove_statistics)
 
-    remove_fetch_listener = setup_local_polling(hass, api, device, sensors, scan_interval)
+    async_join_site_meter(hass, batch, readings)
+    disposers.update(site_member=batch.leave_site)
+
+    remove_fetch_listener = setup_local_polling(hass, api, device, batch, readings, scan_interval, push_grace_period, cache, collector)
     disposers.update(fetch_status=remove_fetch_listener)
 
     if use_nest_proxy:
-        remove_push_listener = await async_setup_local_push(hass, entry, device, sensors)
+        remove_push_listener = await async_setup_local_push(hass, entry, device, batch, readings, cache, api.metrics, capture, aggregator, collector)
         disposers.update(push_listener=remove_push_listener)
 
+    if cached is not None:
+        reconcile = hass.async_create_task(async_reconcile_cache(hass, entry, api, cache, device, layout))
+        disposers.update(reconcile_cache=reconcile.cancel)
+    else:
+        await cache.async_save(device, readings)
+
     _LOGGER.info(f"Setup completed for '{entry.unique_id}' (host={host}, scan_interval={scan_interval}, timeout={timeout})")
     return True
 
@@ -243,13 +642,15 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_e
 class WibeeeSensor(SensorEntity):
     """Implementation of Wibeee sensor."""
 
-    def __init__(self, device: DeviceInfo, sensor_phase: str, sensor_type: SensorType, status_xml_param: str, initial_value: StateType):
+    def __init__(self, device: DeviceInfo, sensor_phase: str, sensor_type: SensorType, status_xml_param: Optional[str], slot: int, initial_value: float,
+                 deadband: Deadband = Deadband(), force_update_interval: timedelta = DEFAULT_FORCE_UPDATE_INTERVAL,
+                 batch: Optional[SensorBatch] = None, aggregator: Optional[WindowAggregator] = None):
         """Initialize the sensor."""
         [device_name, mac_addr] = [device.id, device.macAddr]
         entity_id = slugify(f"{DOMAIN} {mac_addr} {sensor_type.friendly_name} L{sensor_phase}")
         self._attr_native_unit_of_measurement = sensor_type.unit
-        self._attr_native_value = initial_value
-        self._attr_available = True
+        self._attr_available = not math.isnan(initial_value)
+        self._attr_native_value = initial_value if self._attr_available else None
         self._attr_state_class = SensorStateClass.TOTAL_INCREASING if sensor_type.device_class in ENERGY_CLASSES else SensorStateClass.MEASUREMENT
         self._attr_device_class = sensor_type.device_class
         self._attr_unique_id = f"_{mac_addr}_{sensor_type.unique_name.lower()}_{sensor_phase}"
@@ -258,16 +659,135 @@ class WibeeeSensor(SensorEntity):
         self._attr_device_info = _make_device_info(device, sensor_phase)
         self.entity_id = f"sensor.{entity_id}"  # we don't want this derived from the name
         self.status_xml_param = status_xml_param
-        self.nest_push_param = f"{sensor_type.push_var_prefix}{'t' if sensor_phase == '4' else sensor_phase}"
+        self.nest_push_param = get_push_param(sensor_phase, sensor_type)
+        self.slot = slot
+        self._deadband = deadband
+        self._force_update_secs = force_update_interval.total_seconds()
+        self._last_write = time.monotonic()
+        self._batch = batch
+        self._aggregator = aggregator
+        self._written_window = (NAN, NAN)
+        "window min and max in the last state written"
+
+    async def async_added_to_hass(self) -> None:
+        if self._batch is not None:
+            self._batch.add_sensor(self)
+
+    async def async_will_remove_from_hass(self) -> None:
+        if self._batch is not None:
+            self._batch.remove_sensor(self)
+
+    @property
+    def extra_state_attributes(self) -> Optional[dict]:
+        """The min and max over the last aggregation window, so that peaks aren't lost when push data is aggregated."""
+        return self._aggregator.window_attributes(self.slot) if self._aggregator is not None else None
 
     @callback
-    def update_value(self, value: StateType, update_source: str = '') -> None:
-        """Updates this sensor from the fetched status value."""
-        if self.enabled:
-            self._attr_native_value = value
-            self._attr_available = value is not STATE_UNAVAILABLE
-            self.async_schedule_update_ha_state()
-            _LOGGER.debug("Updating from %s: %s", update_source, self)
+    def update_value(self, value: float, now: float) -> bool:
+        """
+        Updates this sensor from the device readings, NaN means the value is unavailable. Returns whether the state
+        needs to be written, which is up to the caller.
+        """
+        available = not math.isnan(value)
+        window = (self._aggregator.minimum[self.slot], self._aggregator.maximum[self.slot]) if self._aggregator is not None else self._written_window
+        forced = now - self._last_write >= self._force_update_secs
+        if available == self._attr_available and not forced:
+            if not available or not (self._deadband.exceeded_by(self._attr_native_value, value) or self._window_moved(window)):
+                return False
+
+        # HA drops writes that don't change the state unless they are forced, which the periodic write has to be.
+        self._attr_force_update = forced
+        self._attr_native_value = value if available else None
+        self._attr_available = available
+        self._last_write = now
+        self._written_window = window
+        return True
+
+    def _window_moved(self, window: tuple[float, float]) -> bool:
+        """Whether the window min or max has moved past the deadband, so that peaks get written even if the mean doesn't move."""
+        return any(new == new and (old != old or self._deadband.exceeded_by(old, new)) for old, new in zip(self._written_window, window))
+
+
+class DiagnosticType(NamedTuple):
+    """Diagnostic sensor that reports on the integration's connection to a device."""
+    key: str
+    friendly_name: str
+    unit: Optional[str]
+    state_class: Optional[SensorStateClass]
+    value: Callable[[WibeeeAPI], StateType]
+
+
+DIAGNOSTIC_SENSORS = [
+    DiagnosticType('request_latency', 'Request Latency', UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT,
+                   lambda api: round(api.latency.average * 1000, 1) if api.latency.average is not None else None),
+    DiagnosticType('failed_requests', 'Failed Requests', None, SensorStateClass.TOTAL_INCREASING, lambda api: api.metrics.counters['failures']),
+    DiagnosticType('retried_requests', 'Retried Requests', None, SensorStateClass.TOTAL_INCREASING, lambda api: api.metrics.counters['retries']),
+    DiagnosticType('bytes_received', 'Bytes Received', UnitOfInformation.BYTES, SensorStateClass.TOTAL_INCREASING,
+                   lambda api: api.metrics.counters['bytes_received']),
+    DiagnosticType('pushes_received', 'Pushes Received', None, SensorStateClass.TOTAL_INCREASING, lambda api: api.metrics.counters['pushes']),
+    DiagnosticType('circuit_breaker', 'Circuit Breaker', None, None, lambda api: api.breaker.state),
+]
+
+
+class WibeeeDiagnosticSensor(SensorEntity):
+    """Reports a metric of the connection to a device. These are disabled by default and refreshed by HA's polling."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, device: DeviceInfo, api: WibeeeAPI, diagnostic_type: DiagnosticType):
+        entity_id = slugify(f"{DOMAIN} {device.macAddr} {diagnostic_type.friendly_name}")
+        self._attr_native_unit_of_measurement = diagnostic_type.unit
+        self._attr_state_class = diagnostic_type.state_class
+        self._attr_unique_id = f"_{device.macAddr}_{diagnostic_type.key}"
+        self._attr_name = f"{device.id} {diagnostic_type.friendly_name}"
+        self._attr_device_info = _make_device_info(device, '4')
+        self.entity_id = f"sensor.{entity_id}"
+        self._api = api
+        self._value = diagnostic_type.value
+
+    async def async_update(self) -> None:
+        self._attr_native_value = self._value(self._api)
+
+
+class WibeeeSiteSensor(SensorEntity):
+    """Site total of one of the SITE_VARIABLES across all Wibeee devices, as kept by the SiteMeter."""
+
+    _attr_should_poll = False
+
+    def __init__(self, site_meter: SiteMeter, index: int):
+        variable = SITE_VARIABLES[index]
+        sensor_type = next(s for s in KNOWN_SENSORS if s.poll_var_prefix == variable.poll_var_prefix)
+        self._attr_native_unit_of_measurement = sensor_type.unit
+        self._attr_device_class = sensor_type.device_class
+        self._attr_state_class = SensorStateClass.TOTAL_INCREASING if variable.counter else SensorStateClass.MEASUREMENT
+        self._attr_unique_id = f"_site_{sensor_type.unique_name.lower()}"
+        self._attr_name = f"Wibeee Site {sensor_type.friendly_name}"
+        self._attr_device_info = HassDeviceInfo(identifiers={(DOMAIN, 'site')}, name='Wibeee Site', model='Virtual Meter', manufacturer='Smilics')
+        self.entity_id = f"sensor.{slugify(f'{DOMAIN} site {sensor_type.friendly_name}')}"
+        self._site_meter = site_meter
+        self._index = index
+        self._counter = variable.counter
+        self._update_from_meter()
+
+    async def async_added_to_hass(self) -> None:
+        @callback
+        def site_updated() -> None:
+            if self._update_from_meter():
+                self.async_write_ha_state()
+
+        self.async_on_remove(self._site_meter.async_add_listener(site_updated))
+
+    def _update_from_meter(self) -> bool:
+        """Updates this sensor from the site meter, returning whether anything changed."""
+        value = self._site_meter.value(self._index)
+        attributes = {'members': len(self._site_meter.members)} if self._counter else {
+            'members': len(self._site_meter.members), 'reporting': self._site_meter.reporting[self._index]}
+        changed = value != self._attr_native_value or attributes != getattr(self, '_attr_extra_state_attributes', None)
+        self._attr_native_value = value
+        self._attr_available = value is not None
+        self._attr_extra_state_attributes = attributes
+        return changed
 
 
 def _make_device_info(device: DeviceInfo, sensor_phase) -> HassDeviceInfo:
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import math
+import time
+from array import array
+from datetime import timedelta
+from typing import NamedTuple, Callable, Iterable, Sequence, Optional
+
+from homeassistant.core import HomeAssistant, callback, CALLBACK_TYPE
+from homeassistant.helpers import singleton
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+from .readings import ReadingLayout, NAN
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_SITE_METER = 'wibeee_site_meter'
+"""Key of the SiteMeter in hass.data, only there while the site config entry is loaded."""
+
+DATA_SITE_STORE = 'wibeee_site_store'
+
+STORAGE_VERSION = 1
+
+SITE_STALE_AFTER = timedelta(minutes=5)
+"""Members that haven't reported for this long stop counting towards the site's power."""
+
+SITE_CHECK_INTERVAL = timedelta(minutes=1)
+"""How often to look for stale members."""
+
+SITE_SAVE_DELAY = 60
+"""Seconds to wait before saving the energy totals after they change."""
+
+
+class SiteVariable(NamedTuple):
+    poll_var_prefix: str
+    "prefix of the variable in `values.xml`, the site adds up each device's total (e.g.: 'pac' for 'pact')"
+    counter: bool
+    "whether this is a TOTAL_INCREASING energy counter"
+
+
+SITE_VARIABLES = [
+    SiteVariable('pac', counter=False),
+    SiteVariable('eac', counter=True),
+    SiteVariable('eaccons', counter=True),
+    SiteVariable('eacprod', counter=True),
+]
+
+
+class SiteMember(object):
+    """A device's contribution to the SiteMeter: its last value of each site variable that it has."""
+    __slots__ = ('meter', 'name', 'slots', 'values', 'updated_at', 'stale')
+
+    def __init__(self, meter: 'SiteMeter', name: str, layout: ReadingLayout, baselines: Optional[Sequence[float]] = None):
+        self.meter = meter
+        self.name = name
+        self.slots: dict[int, int] = {
+            layout.poll_index[f'{v.poll_var_prefix}t']: i for i, v in enumerate(SITE_VARIABLES) if f'{v.poll_var_prefix}t' in layout.poll_index
+        }
+        "device readings slot to site variable"
+        self.values = array('d', baselines if baselines is not None else [NAN] * len(SITE_VARIABLES))
+        "current power and last counter values, NaN if unavailable or unknown"
+        self.updated_at = time.monotonic()
+        self.stale = False
+
+    def update(self, values: Sequence[float], slots: Iterable[int]) -> None:
+        """Passes the values of the device's updated slots that are site variables on to the meter."""
+        member_slots = self.slots
+        changes = [(member_slots[slot], values[slot]) for slot in slots if slot in member_slots]
+        if changes:
+            self.meter.apply(self, changes)
+
+
+class SiteMeter(object):
+    """
+    Keeps running totals of the site variables across all Wibeee devices, updated incrementally from each device's
+    change instead of adding every device up again. Power is the sum of the members that are currently reporting:
+    unavailable and stale members stop counting until they report again. Energy only ever grows by each member's
+    increase, so members that are unavailable or removed don't take anything away from it, and a member's counter
+    going down is taken as a reset whose whole new value is added. Energy totals and each member's last counter values
+    are saved so that they carry on across restarts, including what the devices counted while Home Assistant was down.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, store: Optional[Store] = None, saved: Optional[dict] = None):
+        self._loop = loop
+        self._store = store
+        size = len(SITE_VARIABLES)
+        saved = saved or {}
+        self.members: dict[str, SiteMember] = {}
+        self.totals = array('d', [0.0]) * size
+        self.reporting = [0] * size
+        "members whose power counts towards the total"
+        self.known = bytearray(size)
+        "1 for the counters that have a value"
+        self._baselines: dict[str, list[float]] = {name: [NAN if v is None else v for v in values] for name, values in saved.get('baselines', {}).items()}
+        "last counter values of every device seen, including removed ones"
+        self._listeners: list[Callable[[], None]] = []
+        self._notify_scheduled = False
+
+        for i, v in enumerate(SITE_VARIABLES):
+            total = saved.get('totals', {}).get(v.poll_var_prefix)
+            if v.counter and total is not None:
+                self.totals[i] = total
+                self.known[i] = 1
+
+    def add_member(self, name: str, layout: ReadingLayout) -> SiteMember:
+        self.remove_member(name)
+        baselines = self._baselines.get(name)
+        gauges_cleared = [NAN if not v.counter else b for v, b in zip(SITE_VARIABLES, baselines)] if baselines else None
+        member = self.members[name] = SiteMember(self, name, layout, gauges_cleared)
+        return member
+
+    def remove_member(self, name: str) -> None:
+        member = self.members.pop(name, None)
+        if member is not None:
+            self._clear_power(member)
+            self._notify()
+
+    @callback
+    def apply(self, member: SiteMember, changes: list[tuple[int, float]]) -> None:
+        """Applies the changes to a member's site variables (index, new value) to the totals."""
+        member.updated_at = time.monotonic()
+        member.stale = False
+        totals, old_values = self.totals, member.values
+        counters_changed = False
+        for i, value in changes:
+            old = old_values[i]
+            if SITE_VARIABLES[i].counter:
+                if value != value:
+                    continue  # keep the last value, the increase is counted when the member is back.
+                if old == old:
+                    totals[i] += value - old if value >= old else value
+                old_values[i] = value
+                self.known[i] = 1
+                counters_changed = True
+            else:
+                if old == old:
+                    totals[i] -= old
+                    self.reporting[i] -= 1
+                if value == value:
+                    totals[i] += value
+                    self.reporting[i] += 1
+                old_values[i] = value
+
+        if counters_changed:
+            self._baselines[member.name] = list(old_values)
+            if self._store is not None:
+                self._store.async_delay_save(self._data, SITE_SAVE_DELAY)
+        self._notify()
+
+    @callback
+    def check_stale(self, now=None) -> None:
+        """Stops counting the power of members that haven't reported in a while, and recomputes the power totals exactly."""
+        stale_before = time.monotonic() - SITE_STALE_AFTER.total_seconds()
+        for member in self.members.values():
+            if not member.stale and member.updated_at < stale_before:
+                _LOGGER.debug("Site member %s hasn't reported since %.0fs ago", member.name, time.monotonic() - member.updated_at)
+                member.stale = True
+                self._clear_power(member)
+
+        # the running sums pick up rounding errors over time.
+        for i, v in enumerate(SITE_VARIABLES):
+            if not v.counter:
+                member_values = [m.values[i] for m in self.members.values() if m.values[i] == m.values[i]]
+                self.totals[i] = math.fsum(member_values)
+                self.reporting[i] = len(member_values)
+        self._notify()
+
+    def value(self, i: int) -> Optional[float]:
+        """The site total of a variable, None if no member has reported it."""
+        available = self.known[i] if SITE_VARIABLES[i].counter else self.reporting[i]
+        return self.totals[i] if available else None
+
+    @callback
+    def async_add_listener(self, listener: Callable[[], None]) -> CALLBACK_TYPE:
+        """Calls `listener` after the totals change, at most once per event loop iteration."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def _clear_power(self, member: SiteMember) -> None:
+        for i, v in enumerate(SITE_VARIABLES):
+            old = member.values[i]
+            if not v.counter and old == old:
+                self.totals[i] -= old
+                self.reporting[i] -= 1
+                member.values[i] = NAN
+
+    def _notify(self) -> None:
+        if self._listeners and not self._notify_scheduled:
+            self._notify_scheduled = True
+            self._loop.call_soon(self._call_listeners)
+
+    def _call_listeners(self) -> None:
+        self._notify_scheduled = False
+        for listener in list(self._listeners):
+            listener()
+
+    def _data(self) -> dict:
+        return {
+            'totals': {v.poll_var_prefix: self.totals[i] for i, v in enumerate(SITE_VARIABLES) if v.counter and self.known[i]},
+            'baselines': {name: [None if b != b else b for b in baselines] for name, baselines in self._baselines.items()},
+        }
+
+
+@singleton.singleton(DATA_SITE_STORE)
+def get_site_store(hass: HomeAssistant) -> Store:
+    """
+    Holds the site's energy totals and each device's last counter values. There is a single instance so that removing
+    the store also cancels a save that the SiteMeter has scheduled.
+    """
+    return Store(hass, STORAGE_VERSION, f'{DOMAIN}.site')
+
+
+async def async_remove_site_store(hass: HomeAssistant) -> None:
+    """Removes the saved totals, so that the site starts from zero if it is added again."""
+    await get_site_store(hass).async_remove()
+    # the removed store still holds the data it was going to save, which it would load again.
+    hass.data.pop(DATA_SITE_STORE, None)
+
+
+def get_site_meter(hass: HomeAssistant) -> Optional[SiteMeter]:
+    """Returns the SiteMeter that the Wibeee devices report to, None unless the site config entry is loaded."""
+    return hass.data.get(DATA_SITE_METER)
+
+
+async def async_setup_site_meter(hass: HomeAssistant) -> tuple[SiteMeter, CALLBACK_TYPE]:
+    """
+    Creates the SiteMeter with its saved totals for the site config entry, returning it and a callback that stops it.
+    Devices only report to the meter while it is set up, so nothing is saved for installations without a site entry.
+    """
+    store = get_site_store(hass)
+    try:
+        saved = await store.async_load()
+    except Exception:
+        _LOGGER.warning("Ignoring invalid site totals in %s", store.path, exc_info=True)
+        saved = None
+
+    meter = hass.data[DATA_SITE_METER] = SiteMeter(hass.loop, store, saved)
+    remove_check = async_track_time_interval(hass, meter.check_stale, SITE_CHECK_INTERVAL)
+
+    @callback
+    def stop_site_meter() -> None:
+        remove_check()
+        hass.data.pop(DATA_SITE_METER, None)
+
+    return meter, stop_site_meter
@@ -1,6 +1,7 @@
-from io import BytesIO
-
-from lxml import etree
+import re
+from functools import lru_cache
+from typing import Optional
+from xml.parsers import expat
 
 
 def short_mac(mac_addr):
@@ -8,14 +9,79 @@ def short_mac(mac_addr):
     return mac_addr.replace(':', '')[-6:].upper()
 
 
-def scrub_values_xml(keys: list[str], xml_text: bytes) -> str:
-    """Scrubs sensitive data from the values.xml response."""
-    tree = etree.parse(BytesIO(xml_text))
+def scrub_values_xml(keys: list[str], xml_data: bytes) -> str:
+    """
+    Scrubs sensitive data from the values.xml response in a single pass over the raw bytes, without parsing it again.
+    """
+    return scrub_values_xml_bytes(keys, xml_data).decode(errors='replace')
+
 
+def scrub_values_xml_bytes(keys: list[str], xml_data: bytes) -> bytes:
+    """Like scrub_values_xml, but returns the scrubbed document as bytes."""
     # <values><variable><id>ssid</id><value>MY_SSID</value></variable></values>
-    for key in keys:
-        values = tree.xpath(f"/values/variable[id/text()='{key}']/value")
-        for v in values:
-            v.text = '**REDACTED**'
+    return _scrub_pattern(tuple(keys)).sub(rb'\1**REDACTED**\2', xml_data)
+
+
+@lru_cache(maxsize=8)
+def _scrub_pattern(keys: tuple[str, ...]) -> re.Pattern:
+    names = b'|'.join(re.escape(key.encode()) for key in keys)
+    return re.compile(rb'(<id>\s*(?:' + names + rb')\s*</id>\s*<value>)[^<]*(</value>)')
+
+
+class FlatXmlParser(object):
+    """
+    Incremental parser that turns the flat XML documents returned by Wibeee into a `{name: value}` dict in a single
+    pass. Understands `values.xml` (<values><variable><id>vrms1</id><value>235.06</value></variable></values>) as
+    well as documents where the values are direct children of the root, such as `devices.xml` (<devices><id>WIBEEE</id>
+    </devices>) and `status.xml` (<response><fase1_vrms>240.71</fase1_vrms></response>).
+    """
+
+    def __init__(self):
+        self.values: dict[str, Optional[str]] = {}
+        self._depth = 0
+        self._text: list[str] = []
+        self._var_id: Optional[str] = None
+        self._var_value: Optional[str] = None
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text.append
+
+    def feed(self, data: bytes) -> None:
+        """Parses the next chunk of the document."""
+        self._parser.Parse(data, False)
+
+    def close(self) -> dict[str, Optional[str]]:
+        """Finishes parsing and returns the values found in the document."""
+        self._parser.Parse(b'', True)
+        return self.values
+
+    def _start(self, name: str, attrs) -> None:
+        self._depth += 1
+        self._text.clear()
+
+    def _end(self, name: str) -> None:
+        depth = self._depth
+        self._depth = depth - 1
+        if depth == 2:
+            if name == 'variable':
+                if self._var_id is not None:
+                    self.values[self._var_id] = self._var_value
+                self._var_id = self._var_value = None
+            else:
+                self.values[name] = ''.join(self._text).strip() or None
+        elif depth == 3:
+            if name == 'id':
+                self._var_id = ''.join(self._text).strip()
+            elif name == 'value':
+                self._var_value = ''.join(self._text).strip() or None
+
+        self._text.clear()
+
 
-    return etree.tostring(tree)
+def parse_flat_xml(xml_data: bytes) -> dict[str, Optional[str]]:
+    """Parses a complete Wibeee XML document, see `FlatXmlParser`."""
+    parser = FlatXmlParser()
+    parser.feed(xml_data)
+    return parser.close()
@@ -0,0 +1,48 @@
+import math
+from datetime import timedelta
+
+from wibeee.aggregation import WindowAggregator, LAST
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+LAYOUT = ReadingLayout(['vrms1', 'pac1', 'eac1'], ['v1', 'a1', 'e1'])
+
+
+def make_aggregator(**kwargs) -> tuple[DeviceReadings, WindowAggregator]:
+    readings = DeviceReadings(LAYOUT)
+    return readings, WindowAggregator(readings, timedelta(seconds=10), last_slots=[2], **kwargs)
+
+
+def push(readings: DeviceReadings, aggregator: WindowAggregator, data: dict) -> None:
+    aggregator.add(readings.values, readings.ingest_push(data))
+
+
+def test_reduce_keeps_mean_min_max_and_last_for_counters():
+    readings, aggregator = make_aggregator()
+    for v, a, e in [('230', '100', '1000'), ('232', '2500', '1001'), ('-', '400', '1002')]:
+        push(readings, aggregator, {'v1': v, 'a1': a, 'e1': e})
+
+    assert sorted(aggregator.reduce()) == [0, 1, 2]
+    assert list(aggregator.output.values) == [231.0, 1000.0, 1002.0]
+    assert aggregator.window_attributes(1) == {'min': 100.0, 'max': 2500.0, 'samples': 3}
+    assert aggregator.window_attributes(0)['samples'] == 2
+    assert aggregator.output.source == 'Nest push (mean over 10s)'
+
+    push(readings, aggregator, {'a1': '50'})
+    assert aggregator.reduce() == [1]
+    assert aggregator.output.values[1] == 50.0
+    assert aggregator.output.values[0] == 231.0
+    assert aggregator.reduce() == []
+    assert aggregator.stats == {'samples': 9, 'overwritten': 0, 'windows': 3}
+
+
+def test_ring_buffer_keeps_latest_samples():
+    readings, aggregator = make_aggregator(aggregation=LAST, max_samples=4)
+    for n in range(6):
+        push(readings, aggregator, {'a1': str(n)})
+
+    assert aggregator.reduce() == [1]
+    assert aggregator.output.values[1] == 5.0
+    assert aggregator.window_attributes(1) == {'min': 2.0, 'max': 5.0, 'samples': 4}
+    assert aggregator.stats['overwritten'] == 2
+    assert math.isnan(aggregator.output.values[0])
+    assert aggregator.window_attributes(0) is None
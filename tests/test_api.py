@@ -1,9 +1,14 @@
+import asyncio
 import logging
 import os
 from datetime import timedelta
+from xml.parsers.expat import ExpatError
+from unittest.mock import patch
 
 import aiohttp
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from aioresponses import aioresponses
 
 from wibeee import api
@@ -72,3 +77,149 @@ async def test_fetch_values(caplog):
             for k, v in secrets.items():
                 assert k in caplog.text
                 assert v not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_raw_responses_are_sampled(caplog):
+    caplog.set_level(logging.DEBUG)
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get("http://1.2.3.4/services/user/values.xml?id=WIBEEE", status=200, body=read_file('test_api_values.xml'), repeat=True)
+
+            wibeee = api.WibeeeAPI(session, '1.2.3.4', timeout=TIMEOUT, raw_log_sampling=2)
+            for _ in range(3):
+                await wibeee.async_fetch_values("WIBEEE")
+
+            assert caplog.text.count('RAW Response') == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_values_in_chunks():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get(
+                "http://1.2.3.4/services/user/values.xml?var=X.vrms1&X.vrms2",
+                status=200,
+                body='<values><variable><id>vrms1</id><value>230.1</value></variable><variable><id>vrms2</id><value>230.2</value></variable></values>',
+            )
+            m.get(
+                "http://1.2.3.4/services/user/values.xml?var=X.vrms3",
+                status=200,
+                body='<values><variable><id>vrms3</id><value>230.3</value></variable></values>',
+            )
+
+            wibeee = api.WibeeeAPI(session, '1.2.3.4', timeout=TIMEOUT)
+            with patch.object(api, '_MAX_VAR_QUERY_LEN', len('X.vrms1&X.vrms2')):
+                values = await wibeee.async_fetch_values('X', ['vrms1', 'vrms2', 'vrms3'])
+
+            assert values == {'vrms1': '230.1', 'vrms2': '230.2', 'vrms3': '230.3'}
+            assert wibeee.metrics.counters['requests'] == 2
+            assert wibeee.metrics.latency.count == wibeee.metrics.parse_time.count == 2
+            assert wibeee.metrics.counters['bytes_received'] > 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_values_single_variable():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get(
+                "http://1.2.3.4/services/user/values.xml?var=X.model",
+                status=200,
+                body='<values><variable><id>model</id><value>WBM</value></variable></values>',
+            )
+
+            wibeee = api.WibeeeAPI(session, '1.2.3.4', timeout=TIMEOUT)
+            values = await wibeee.async_fetch_values('X', ['model'])
+
+            assert values == {'model': 'WBM'}
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_stops_requests_to_unresponsive_device():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            url = "http://1.2.3.4/services/user/values.xml?id=X"
+            m.get(url, status=500, repeat=True)
+
+            wibeee = api.WibeeeAPI(session, '1.2.3.4', timeout=TIMEOUT, probe_interval=timedelta(0))
+            wibeee.min_wait = timedelta(0)
+            for _ in range(wibeee.breaker.failure_threshold):
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await wibeee.async_fetch_values('X', retries=1)
+
+            assert wibeee.breaker.state == api.CircuitBreaker.OPEN
+            requests_made = len(next(iter(m.requests.values())))
+            assert requests_made == 2 * wibeee.breaker.failure_threshold
+
+            # half-open: a single probe without retries, which fails and opens the breaker again
+            with pytest.raises(aiohttp.ClientResponseError):
+                await wibeee.async_fetch_values('X', retries=1)
+            assert len(next(iter(m.requests.values()))) == requests_made + 1
+            assert wibeee.breaker.state == api.CircuitBreaker.OPEN
+
+            wibeee.breaker.probe_interval = timedelta(hours=1)
+            with pytest.raises(api.DeviceUnavailableError):
+                await wibeee.async_fetch_values('X', retries=1)
+            assert len(next(iter(m.requests.values()))) == requests_made + 1
+            assert wibeee.metrics.counters['rejected'] == 1
+            assert wibeee.metrics.counters['failures'] == requests_made + 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_opens_breaker_again():
+    wibeee = api.WibeeeAPI(None, '1.2.3.4', timeout=TIMEOUT, probe_interval=timedelta(0))
+    wibeee.breaker.state = api.CircuitBreaker.OPEN
+
+    async def hang(*args):
+        await asyncio.Event().wait()
+
+    with patch.object(wibeee, '_fetch_xml', hang):
+        probe = asyncio.create_task(wibeee.async_fetch_values('X'))
+        await asyncio.sleep(0)
+        assert wibeee.breaker.state == api.CircuitBreaker.HALF_OPEN
+
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    # otherwise it would stay half-open and reject every request from then on.
+    assert wibeee.breaker.state == api.CircuitBreaker.OPEN
+    assert wibeee.breaker.allow_request()
+
+
+@pytest.mark.asyncio
+async def test_failed_responses_release_their_connection():
+    async def error(req: web.Request) -> web.Response:
+        return web.Response(status=500, body=b' ' * 1_000_000)
+
+    async def broken_xml(req: web.Request) -> web.Response:
+        return web.Response(body=b'<values><variable><id>vrms1</id><value>230</broken>' + b' ' * 1_000_000)
+
+    app = web.Application()
+    app.add_routes([web.get('/services/user/values.xml', error), web.get('/services/user/devices.xml', broken_xml)])
+    async with TestServer(app) as server:
+        # neither body is read to the end, so only releasing the response gives the connection back.
+        async with aiohttp.ClientSession() as session:
+            wibeee = api.WibeeeAPI(session, f'{server.host}:{server.port}', timeout=timedelta(seconds=2))
+            wibeee.breaker.failure_threshold = 10
+            for fetch in [wibeee.async_fetch_values('X'), wibeee.async_fetch_device_info()]:
+                try:
+                    await fetch
+                    pytest.fail('fetch should have failed')
+                except (aiohttp.ClientResponseError, ExpatError):
+                    # checked while the error is still around, as it is when the caller logs it.
+                    assert not session.connector._acquired
+
+
+def test_latency_tracker_timeout():
+    tracker = api.LatencyTracker(min_timeout=timedelta(seconds=1), max_timeout=timedelta(seconds=10))
+    assert tracker.timeout() == 10
+
+    for _ in range(20):
+        tracker.record(0.2)
+    assert tracker.timeout() == 1
+    assert tracker.timeout(try_n=2) == 4
+
+    for _ in range(20):
+        tracker.record(4)
+    assert 4 < tracker.timeout() <= 10
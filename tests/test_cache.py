@@ -0,0 +1,119 @@
+import asyncio
+import math
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+
+import pytest
+import pytest_asyncio
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from wibeee import sensor
+from wibeee.api import DeviceInfo
+from wibeee.cache import DeviceCache, STORAGE_VERSION
+from wibeee.const import DOMAIN
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+DEVICE_INFO = DeviceInfo(id='X', macAddr='111111111111', softVersion='4.4.124', model='WB3', ipAddr='10.10.10.100')
+LAYOUT = ReadingLayout(['vrms1', 'irms1'], [None, None])
+
+
+@pytest_asyncio.fixture
+async def hass(tmp_path):
+    hass = HomeAssistant()
+    hass.config.config_dir = str(tmp_path)
+    yield hass
+    await hass.async_stop(force=True)
+
+
+class FakeAPI(object):
+    """Answers as a device whose info and values.xml are given."""
+
+    def __init__(self, device: DeviceInfo, values: dict):
+        self.device = device
+        self.values = values
+
+    async def async_fetch_device_info(self, retries=0, device_id=None):
+        return self.device
+
+    async def async_fetch_values(self, device_id, var_names=None, retries=0):
+        return self.values
+
+
+async def save_cached(hass, values: dict) -> DeviceCache:
+    readings = DeviceReadings(LAYOUT)
+    readings.ingest_poll(values)
+    cache = DeviceCache(hass, 'entry')
+    await cache.async_save(DEVICE_INFO, readings)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_round_trip_stores_unavailable_values_as_none(hass):
+    await save_cached(hass, {'vrms1': '230.5'})
+
+    device, values = await DeviceCache(hass, 'entry').async_load()
+    assert device == DEVICE_INFO
+    assert values == {'vrms1': 230.5, 'irms1': None}
+
+    # and they are unavailable again once ingested.
+    readings = DeviceReadings(LAYOUT)
+    readings.ingest_poll(values)
+    assert readings.values[0] == 230.5
+    assert math.isnan(readings.values[1])
+
+
+@pytest.mark.asyncio
+async def test_ignores_stale_or_corrupt_cache(hass):
+    assert await DeviceCache(hass, 'entry').async_load() is None
+
+    # written by a newer version, which this one can't migrate.
+    await Store(hass, STORAGE_VERSION + 1, f'{DOMAIN}.entry').async_save({'device': DEVICE_INFO._asdict(), 'values': {}})
+    assert await DeviceCache(hass, 'entry').async_load() is None
+
+    await Store(hass, STORAGE_VERSION, f'{DOMAIN}.entry').async_save({'device': {'id': 'X'}})
+    assert await DeviceCache(hass, 'entry').async_load() is None
+
+
+@pytest.mark.asyncio
+async def test_cached_values_are_overwritten_by_first_live_read(hass):
+    cache = await save_cached(hass, {'vrms1': '230', 'irms1': '1.5'})
+    device, values = await cache.async_load()
+    readings = DeviceReadings(LAYOUT)
+    readings.ingest_poll(values)
+    assert list(readings.values) == [230.0, 1.5]
+
+    # the device hasn't changed so the cache is left as it is and the entry isn't reloaded.
+    hass.config_entries = SimpleNamespace(async_reload=AsyncMock())
+    live = FakeAPI(DEVICE_INFO, {'vrms1': '231', 'irms1': '2'})
+    entry = SimpleNamespace(entry_id='entry', unique_id='_111111111111')
+    with patch.object(cache, 'async_save') as save:
+        await sensor.async_reconcile_cache(hass, entry, live, cache, device, LAYOUT)
+    save.assert_not_called()
+    hass.config_entries.async_reload.assert_not_called()
+
+    batch = sensor.SensorBatch(SimpleNamespace(loop=asyncio.get_running_loop()), 'X', LAYOUT.size)
+    scheduler = SimpleNamespace(add=lambda key, poll, interval: poll)
+    with patch.object(sensor, 'get_poll_scheduler', return_value=scheduler):
+        poll = sensor.setup_local_polling(hass, live, device, batch, readings, timedelta(seconds=15))
+    await poll(time.time())
+    assert list(readings.values) == [231.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_recaches_and_reloads_changed_device(hass):
+    cache = await save_cached(hass, {'vrms1': '230', 'irms1': '1.5'})
+    device, values = await cache.async_load()
+
+    hass.config_entries = SimpleNamespace(async_reload=AsyncMock())
+    upgraded = DEVICE_INFO._replace(softVersion='4.4.171')
+    entry = SimpleNamespace(entry_id='entry', unique_id='_111111111111')
+    await sensor.async_reconcile_cache(hass, entry, FakeAPI(upgraded, {'vrms1': '231', 'irms1': '2', 'pac1': '100'}), cache, device, LAYOUT)
+    await hass.async_block_till_done()
+
+    hass.config_entries.async_reload.assert_called_once_with('entry')
+    device, values = await DeviceCache(hass, 'entry').async_load()
+    assert device == upgraded
+    assert values == {'irms1': 2.0, 'pac1': 100.0, 'vrms1': 231.0}
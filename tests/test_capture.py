@@ -0,0 +1,51 @@
+import os
+from datetime import timedelta
+
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+
+from wibeee.api import WibeeeAPI
+from wibeee.capture import TrafficCapture, CaptureRecord, read_capture, POLL, PUSH
+
+
+def test_capture_round_trips_raw_bytes(tmp_path):
+    capture = TrafficCapture(str(tmp_path / 'capture.jsonl'))
+    broken_json = b'{"mac":"001122334455""v1":"\xe9"}'
+    capture.record(PUSH, '10.0.0.2', 'POST', '/Wibeee/receiverJSON', broken_json)
+    capture.record(PUSH, '10.0.0.2', 'GET', '/Wibeee/receiver?mac=001122334455', None)
+    capture.write(capture.take())
+
+    records = list(read_capture(capture.path))
+    assert [(r.method, r.body) for r in records] == [('POST', broken_json), ('GET', None)]
+    assert capture.counters == {'recorded': 2, 'written': 2, 'dropped': 0}
+
+
+def test_capture_is_bounded(tmp_path):
+    capture = TrafficCapture(str(tmp_path / 'capture.jsonl'), max_records=2, max_bytes=1)
+    for n in range(3):
+        capture.record(PUSH, '10.0.0.2', 'GET', f'/Wibeee/receiver?n={n}', None)
+    assert [r.path for r in capture.take()] == ['/Wibeee/receiver?n=1', '/Wibeee/receiver?n=2']
+    assert capture.counters['dropped'] == 1
+
+    # the second write rotates the first segment, which is read first.
+    capture.write([CaptureRecord(1.0, PUSH, 'a', 'GET', '/1', None)])
+    capture.write([CaptureRecord(2.0, PUSH, 'a', 'GET', '/2', None)])
+    assert os.path.exists(f'{capture.path}.1')
+    assert [r.path for r in read_capture(capture.path)] == ['/1', '/2']
+
+
+@pytest.mark.asyncio
+async def test_api_captures_scrubbed_responses(tmp_path):
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get("http://1.2.3.4/services/user/values.xml?id=X", status=200,
+                  body='<values><variable><id>ssid</id><value>MY_SSID</value></variable></values>')
+
+            wibeee = WibeeeAPI(session, '1.2.3.4', timeout=timedelta(seconds=5))
+            wibeee.capture = TrafficCapture(str(tmp_path / 'capture.jsonl'))
+            await wibeee.async_fetch_values('X')
+
+            [record] = wibeee.capture.take()
+            assert (record.kind, record.source, record.path) == (POLL, '1.2.3.4', '/services/user/values.xml?id=X')
+            assert record.body == b'<values><variable><id>ssid</id><value>**REDACTED**</value></variable></values>'
@@ -0,0 +1,42 @@
+import math
+
+from wibeee import sensor
+from wibeee.derived import DerivedEngine, DerivedMetric, import_power, export_power, imbalance, share
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+
+def test_metric_functions():
+    assert (import_power([-150.0]), export_power([-150.0])) == (0.0, 150.0)
+    assert (import_power([200.0]), export_power([200.0])) == (200.0, 0.0)
+    assert imbalance([10.0, 10.0, 10.0]) == 0.0
+    assert imbalance([12.0, 9.0, 9.0]) == 20.0
+    assert imbalance([0.0, 0.0, 0.0]) == 0.0
+    assert share([50.0, 200.0]) == 25.0
+    assert share([0.0, 0.0]) == 0.0
+
+
+def test_engine_only_recomputes_affected_metrics():
+    layout = ReadingLayout(['irms1', 'irms2', 'pact'], ['i1', 'i2', 'at'])
+    engine = DerivedEngine(layout, [DerivedMetric(('irms1', 'irms2'), sum), DerivedMetric(('pact',), export_power)])
+    readings = DeviceReadings(layout)
+
+    readings.ingest_poll({'irms1': '1.5', 'irms2': '2', 'pact': '-300'})
+    assert engine.update(readings.values, range(layout.size)) == [0, 1]
+    assert list(engine.values) == [3.5, 300.0]
+    assert engine.offset == 3
+
+    assert engine.update(readings.values, readings.ingest_push({'at': '100'})) == [1]
+    assert list(engine.values) == [3.5, 0.0]
+
+    assert engine.update(readings.values, readings.ingest_push({'i2': '-'})) == [0]
+    assert math.isnan(engine.values[0])
+
+
+def test_derived_elements_by_model():
+    layout = ReadingLayout([e.xml_name for e in sensor.get_status_elements('WBM')], [])
+    single_phase = [e for e in sensor.get_derived_elements('WBM') if DerivedEngine.supported(layout, e.metric)]
+    assert [e.sensor_type.unique_name for e in single_phase] == ['Active_Power_Import', 'Active_Power_Export']
+
+    three_phase = sensor.get_derived_elements('WBT')
+    assert [e.phase for e in three_phase if e.sensor_type.unique_name == 'Active_Power_Share'] == ['1', '2', '3']
+    assert [e.metric.inputs for e in three_phase if e.sensor_type.unique_name == 'Total_Current'] == [('irms1', 'irms2', 'irms3')]
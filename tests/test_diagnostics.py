@@ -0,0 +1,45 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from homeassistant.config_entries import ConfigEntry
+
+from wibeee.api import WibeeeAPI, DeviceInfo
+from wibeee.const import DOMAIN
+from wibeee.diagnostics import async_get_config_entry_diagnostics
+from wibeee.nest import DATA_NEST_PROXY, NestProxy
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+DEVICE_INFO = DeviceInfo(id='X', macAddr='111111111111', softVersion='4.4.124', model='WB3', ipAddr='10.10.10.100')
+
+
+@pytest.mark.asyncio
+async def test_diagnostics_redacts_addresses():
+    entry = ConfigEntry(2, DOMAIN, 'Wibeee', {'host': '10.10.10.100'}, 'user', options={'scan_interval': 15})
+    api = WibeeeAPI(None, '10.10.10.100', timedelta(seconds=5))
+    api.metrics.counters['pushes'] = 3
+    readings = DeviceReadings(ReadingLayout(['vrms1'], ['v1']))
+    hass = SimpleNamespace(data={DOMAIN: {entry.entry_id: {'device': DEVICE_INFO, 'api': api, 'readings': readings}}})
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, entry)
+
+    assert diagnostics['entry'] == {'data': {'host': '**REDACTED**'}, 'options': {'scan_interval': 15}}
+    assert diagnostics['device']['ipAddr'] == '**REDACTED**'
+    assert diagnostics['api']['circuit_breaker'] == 'closed'
+    assert diagnostics['api']['pushes'] == 3
+    assert diagnostics['readings']['sensors'] == 1
+    assert diagnostics['poll_scheduler'] is None
+    assert diagnostics['nest_proxy'] is None
+
+
+@pytest.mark.asyncio
+async def test_diagnostics_reads_metrics_of_running_nest_proxy():
+    entry = ConfigEntry(2, DOMAIN, 'Wibeee', {'host': '10.10.10.100'}, 'user')
+    proxy = NestProxy()
+    proxy.metrics.record_push('/Wibeee/receiverAvg', '001122334455', True)
+    hass = SimpleNamespace(data={DOMAIN: {}, DATA_NEST_PROXY: proxy})
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, entry)
+
+    assert diagnostics['nest_proxy'] == {**proxy.metrics.as_dict(), 'forwarders': {}}
+    assert NestProxy().metrics.as_dict() != proxy.metrics.as_dict()
@@ -0,0 +1,39 @@
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+
+from wibeee.discovery import get_scan_hosts, async_discover_devices, DiscoveredDevice
+from wibeee.api import DeviceInfo
+
+
+def adapter(address: str, prefix: int, enabled: bool = True) -> dict:
+    return {'name': 'eth0', 'index': 1, 'enabled': enabled, 'auto': True, 'default': True, 'ipv6': [],
+            'ipv4': [{'address': address, 'network_prefix': prefix}]}
+
+
+def test_get_scan_hosts():
+    hosts = get_scan_hosts([adapter('192.168.1.10', 24), adapter('127.0.0.1', 8), adapter('10.0.0.5', 24, enabled=False)])
+    assert len(hosts) == 253
+    assert hosts[0] == '192.168.1.1' and '192.168.1.10' not in hosts
+
+    # large networks are only scanned around the adapter's address
+    hosts = get_scan_hosts([adapter('10.1.2.3', 8)])
+    assert (hosts[0], hosts[-1], len(hosts)) == ('10.1.2.1', '10.1.2.254', 253)
+
+
+@pytest.mark.asyncio
+async def test_discover_devices_only_fetches_info_from_responding_hosts():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get('http://10.0.0.2/services/user/devices.xml', status=404)
+            m.get('http://10.0.0.3/services/user/devices.xml', status=200, body='<devices><id>WIBEEE</id></devices>')
+            m.get('http://10.0.0.3/services/user/values.xml?var=WIBEEE.macAddr&WIBEEE.softVersion&WIBEEE.model&WIBEEE.ipAddr', status=200,
+                  body='<values><variable><id>macAddr</id><value>00:11:22:33:44:55</value></variable>'
+                       '<variable><id>softVersion</id><value>4.4.124</value></variable>'
+                       '<variable><id>model</id><value>WBM</value></variable>'
+                       '<variable><id>ipAddr</id><value>10.0.0.3</value></variable></values>')
+
+            found = await async_discover_devices(session, ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+            assert found == [DiscoveredDevice('10.0.0.3', DeviceInfo('WIBEEE', '001122334455', '4.4.124', 'WBM', '10.0.0.3'))]
+            assert len(m.requests) == 4
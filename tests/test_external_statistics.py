@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+
+from wibeee.external_statistics import StatisticsCollector, StatisticSeries, get_statistic_id
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+LAYOUT = ReadingLayout(['vrms1', 'eac1'], ['v1', 'e1'])
+HOUR = datetime(2023, 7, 1, 10, tzinfo=timezone.utc).timestamp()
+
+
+def metadata(statistic_id: str, has_sum: bool) -> dict:
+    return {'has_mean': not has_sum, 'has_sum': has_sum, 'name': None, 'source': 'wibeee', 'statistic_id': statistic_id, 'unit_of_measurement': None}
+
+
+def make_collector(sums=None) -> StatisticsCollector:
+    return StatisticsCollector(2, [StatisticSeries(0, metadata('wibeee:v', False)), StatisticSeries(1, metadata('wibeee:e', True))], sums)
+
+
+def test_get_statistic_id():
+    assert get_statistic_id('_001122AABBCC_active_power_4') == 'wibeee:001122aabbcc_active_power_4'
+
+
+def test_collector_computes_hourly_statistics():
+    readings = DeviceReadings(LAYOUT)
+    collector = make_collector({'wibeee:e': [100.0, 1000.0]})
+    for offset, v, e in [(0, '230', '1010'), (1800, '234', '1030'), (3599, '-', '5'), (3600, '231', '15')]:
+        collector.add(readings.values, readings.ingest_push({'v1': v, 'e1': e}), HOUR + offset)
+
+    start = datetime.fromtimestamp(HOUR, timezone.utc)
+    assert collector.take() == [
+        (metadata('wibeee:v', False), [{'start': start, 'mean': 232.0, 'min': 230.0, 'max': 234.0}]),
+        (metadata('wibeee:e', True), [{'start': start, 'state': 5.0, 'sum': 135.0}]),
+    ]
+    assert collector.take() == []
+    assert collector.sums() == {'wibeee:e': [145.0, 15.0]}
+
+    collector.roll(HOUR + 7200)
+    assert [statistics[0]['start'].hour for _, statistics in collector.take()] == [11, 11]
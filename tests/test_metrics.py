@@ -0,0 +1,27 @@
+from wibeee.metrics import Histogram, ProxyMetrics, MAX_UNKNOWN_MACS
+
+
+def test_histogram_buckets():
+    histogram = Histogram((0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+
+    assert histogram.as_dict() == {
+        'count': 4,
+        'mean': 0.6625,
+        'max': 2.0,
+        'buckets': {'<=0.1': 2, '<=1': 1, '>1': 1},
+    }
+
+
+def test_proxy_metrics_bounds_unknown_macs():
+    metrics = ProxyMetrics()
+    for n in range(MAX_UNKNOWN_MACS + 5):
+        metrics.record_push('/Wibeee/receiver', f'{n:012x}', known=False)
+    metrics.record_push('/Wibeee/receiver', f'{0:012x}', known=False)
+    metrics.record_push('/Wibeee/receiverJSON', '001122334455', known=True)
+
+    assert metrics.pushes == {'/Wibeee/receiver': MAX_UNKNOWN_MACS + 6, '/Wibeee/receiverJSON': 1}
+    assert metrics.unknown_pushes == MAX_UNKNOWN_MACS + 6
+    assert len(metrics.unknown_macs) == MAX_UNKNOWN_MACS
+    assert metrics.unknown_macs[f'{0:012x}'] == 2
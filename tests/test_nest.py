@@ -0,0 +1,219 @@
+from datetime import timedelta
+
+import asyncio
+import time
+from unittest.mock import patch
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aioresponses import aioresponses
+
+from wibeee.capture import TrafficCapture
+from wibeee.const import NEST_NULL_UPSTREAM
+from wibeee.nest import UpstreamForwarder, ForwardRequest, request_upstream, repair_json, NestProxy, create_nest_app
+
+UPSTREAM = 'http://nest.example.com'
+
+
+@pytest.mark.asyncio
+async def test_forwarder_retries_failed_requests():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get(f'{UPSTREAM}/Wibeee/receiverLeap?mac=001122334455', status=503)
+            m.get(f'{UPSTREAM}/Wibeee/receiverLeap?mac=001122334455', status=200)
+
+            forwarder = UpstreamForwarder(session, UPSTREAM, min_wait=timedelta(0))
+            forwarder.enqueue(ForwardRequest('GET', '/Wibeee/receiverLeap?mac=001122334455', None))
+            await forwarder.join()
+            forwarder.close()
+
+            assert forwarder.counters == {'queued': 1, 'forwarded': 1, 'retried': 1, 'failed': 0, 'dropped': 0, 'errors': 0}
+
+
+@pytest.mark.asyncio
+async def test_forwarder_drops_oldest_when_full():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get(f'{UPSTREAM}/Wibeee/receiver?mac=2', status=200)
+            m.get(f'{UPSTREAM}/Wibeee/receiver?mac=3', status=200)
+
+            forwarder = UpstreamForwarder(session, UPSTREAM, max_queued=2, workers=1)
+            for mac in ['1', '2', '3']:
+                forwarder.enqueue(ForwardRequest('GET', f'/Wibeee/receiver?mac={mac}', None))
+            await forwarder.join()
+            forwarder.close()
+
+            assert forwarder.counters == {'queued': 3, 'forwarded': 2, 'retried': 0, 'failed': 0, 'dropped': 1, 'errors': 0}
+
+
+@pytest.mark.asyncio
+async def test_forwarder_keeps_working_after_unexpected_error(caplog):
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.get(f'{UPSTREAM}/Wibeee/receiver?mac=2', status=200)
+
+            async def buggy_request_upstream(session, method, url, *args):
+                if url.endswith('mac=1'):
+                    raise ValueError('bug')
+                return await request_upstream(session, method, url, *args)
+
+            forwarder = UpstreamForwarder(session, UPSTREAM, workers=1)
+            with patch('wibeee.nest.request_upstream', buggy_request_upstream):
+                for mac in ['1', '2']:
+                    forwarder.enqueue(ForwardRequest('GET', f'/Wibeee/receiver?mac={mac}', None))
+                await asyncio.wait_for(forwarder.join(), 5)
+            forwarder.close()
+
+            assert forwarder.counters == {'queued': 2, 'forwarded': 1, 'retried': 0, 'failed': 0, 'dropped': 0, 'errors': 1}
+            assert 'Unexpected error forwarding GET /Wibeee/receiver?mac=1' in caplog.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('error', [aiohttp.ServerDisconnectedError(), aiohttp.ClientOSError(104, 'Connection reset by peer')])
+async def test_request_upstream_retries_once_when_disconnected(error):
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.post(f'{UPSTREAM}/Wibeee/receiverJSON', exception=error)
+            m.post(f'{UPSTREAM}/Wibeee/receiverJSON', status=200, body='OK')
+
+            res = await request_upstream(session, 'POST', f'{UPSTREAM}/Wibeee/receiverJSON', '{}')
+
+            assert (res.status, res.body) == (200, b'OK')
+
+
+@pytest.mark.asyncio
+async def test_request_upstream_does_not_retry_failed_connect():
+    async with aiohttp.ClientSession() as session:
+        with aioresponses() as m:
+            m.post(f'{UPSTREAM}/Wibeee/receiverJSON', exception=aiohttp.ClientConnectorError(None, OSError(111, 'Connection refused')))
+            m.post(f'{UPSTREAM}/Wibeee/receiverJSON', status=200, body='OK')
+
+            with pytest.raises(aiohttp.ClientConnectorError):
+                await request_upstream(session, 'POST', f'{UPSTREAM}/Wibeee/receiverJSON', '{}')
+
+
+@pytest.mark.asyncio
+async def test_nest_app_dispatches_push_to_registered_device():
+    received = []
+    proxy = NestProxy()
+    proxy.register_device('001122334455', received.append, NEST_NULL_UPSTREAM)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with TestClient(TestServer(create_nest_app(proxy, session))) as client:
+                res = await client.get('/Wibeee/receiverLeap', params={'mac': '001122334455', 'v1': '230.1'})
+                assert res.status == 202
+
+                res = await client.post('/Wibeee/receiverJSON', data=b'{"mac":"001122334455""v1":"230.2"}')
+                assert res.status == 202
+
+                res = await client.get('/Wibeee/receiver', params={'mac': '665544332211'})
+                assert res.status == 404
+
+        assert [data['v1'] for data in received] == ['230.1', '230.2']
+    finally:
+        proxy.unregister_device('001122334455')
+
+
+@pytest.mark.asyncio
+async def test_nest_app_rejects_unknown_query_push_without_parsing_it():
+    proxy = NestProxy()
+    proxy.register_device('001122334455', print, NEST_NULL_UPSTREAM)
+    async with aiohttp.ClientSession() as session:
+        async with TestClient(TestServer(create_nest_app(proxy, session))) as client:
+            with patch('wibeee.nest.parse_qsl', side_effect=AssertionError('parsed')):
+                for query in ['mac=665544332211&v1=230.1', 'v1=230.1&mac=665544332211', 'v1=230.1']:
+                    res = await client.get(f'/Wibeee/receiverLeap?{query}')
+                    assert res.status == 404
+
+    assert proxy._unknown['665544332211'].pushes == 2
+    assert proxy.metrics.unknown_pushes == 3
+
+
+@pytest.mark.asyncio
+async def test_nest_app_starts_discovery_for_unknown_device():
+    discovered = []
+    proxy = NestProxy()
+    proxy.register_device('001122334455', print, NEST_NULL_UPSTREAM, discovery_pushes=5)
+    proxy.register_device('001122334466', print, NEST_NULL_UPSTREAM, discovery_pushes=2)
+    assert proxy.discovery_pushes == 2
+    proxy.on_unknown_device = lambda mac, host: discovered.append((mac, host))
+    async with aiohttp.ClientSession() as session:
+        async with TestClient(TestServer(create_nest_app(proxy, session))) as client:
+            for _ in range(3):
+                res = await client.get('/Wibeee/receiver', params={'mac': '0011223344ff'})
+                assert res.status == 404
+
+    assert discovered == [('0011223344ff', '127.0.0.1')]
+    assert proxy._unknown['0011223344ff'].pushes == 3
+
+    proxy.register_device('0011223344ff', print, NEST_NULL_UPSTREAM)
+    proxy.unregister_device('0011223344ff')
+    assert '0011223344ff' not in proxy._unknown
+
+    proxy.unregister_device('001122334466')
+    assert proxy.discovery_pushes == 5
+
+
+def test_capture_stays_on_until_every_entry_removes_it(tmp_path):
+    capture = TrafficCapture(str(tmp_path / 'capture.jsonl'))
+    proxy = NestProxy()
+    remove_first = proxy.add_capture(capture)
+    remove_second = proxy.add_capture(capture)
+
+    remove_first()
+    assert proxy.capture is capture
+    remove_second()
+    assert proxy.capture is None
+
+
+@pytest.mark.asyncio
+async def test_nest_app_fans_out_to_secondary_upstreams():
+    received = []
+    secondary_done = asyncio.Event()
+
+    async def primary(req: web.Request) -> web.Response:
+        received.append(('primary', req.query['mac']))
+        return web.Response(status=200, text='primary')
+
+    async def slow_secondary(req: web.Request) -> web.Response:
+        await asyncio.sleep(0.5)
+        received.append(('secondary', req.query['mac']))
+        secondary_done.set()
+        return web.Response(status=500, text='ignored')
+
+    upstream_app = web.Application()
+    upstream_app.add_routes([web.get('/primary/Wibeee/receiver', primary), web.get('/secondary/Wibeee/receiver', slow_secondary)])
+
+    proxy = NestProxy()
+    async with TestServer(upstream_app) as upstream:
+        upstream_url = str(upstream.make_url('')).rstrip('/')
+        proxy.register_device('001122334466', lambda data: None, f'{upstream_url}/primary',
+                              secondary_upstreams=[f'{upstream_url}/secondary', f'{upstream_url}/primary', NEST_NULL_UPSTREAM])
+        assert proxy.get_device_info('001122334466').secondary_upstreams == (f'{upstream_url}/secondary',)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with TestClient(TestServer(create_nest_app(proxy, session))) as client:
+                    started = time.monotonic()
+                    res = await client.get('/Wibeee/receiver', params={'mac': '001122334466'})
+                    assert (res.status, await res.text()) == (200, 'primary')
+                    assert time.monotonic() - started < 0.5
+                    assert received == [('primary', '001122334466')]
+
+                    await asyncio.wait_for(secondary_done.wait(), 5)
+                    assert received[-1] == ('secondary', '001122334466')
+        finally:
+            proxy.unregister_device('001122334466')
+            for forwarder in proxy.forwarders.values():
+                forwarder.close()
+
+
+@pytest.mark.parametrize('broken, repaired', [
+    (b'{"mac":"001122334455""v1":"230.1"}', b'{"mac":"001122334455","v1":"230.1"}'),
+    (b'{"mac":"001122334455",,"v1":"230.1",}', b'{"mac":"001122334455","v1":"230.1"}'),
+    (b'{"a":"","b":"x\\"y""c":[1,,2]}', b'{"a":"","b":"x\\"y","c":[1,2]}'),
+    (b'{"a":[{"b":1}{"c":2}]}', b'{"a":[{"b":1},{"c":2}]}'),
+])
+def test_repair_json(broken, repaired):
+    assert repair_json(broken) == repaired
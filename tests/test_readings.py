@@ -0,0 +1,51 @@
+import math
+
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+LAYOUT = ReadingLayout(['vrms1', 'preac1', 'eaccons1'], ['v1', 'r1', None])
+
+
+def test_ingest_poll():
+    readings = DeviceReadings(LAYOUT)
+    slots = readings.ingest_poll({'vrms1': '235.06', 'preac1': '-', 'other': '1'})
+
+    assert list(slots) == [0, 1, 2]
+    assert readings.values[0] == 235.06
+    assert math.isnan(readings.values[1])
+    assert math.isnan(readings.values[2])
+    assert readings.source == 'values.xml'
+    assert readings.timestamp > 0
+
+
+def test_ingest_push_keeps_missing_slots():
+    readings = DeviceReadings(LAYOUT)
+    readings.ingest_poll({'vrms1': '235.06', 'preac1': '10', 'eaccons1': '1000'})
+    slots = readings.ingest_push({'mac': '111111111111', 'r1': '12.5'})
+
+    assert slots == [1]
+    assert list(readings.values) == [235.06, 12.5, 1000.0]
+    assert readings.source == 'Nest push'
+
+
+def test_push_freshness_and_non_pushed_slots():
+    readings = DeviceReadings(LAYOUT)
+    assert not readings.is_push_fresh(60)
+    assert readings.non_pushed_slots() == [0, 1, 2]
+
+    readings.ingest_push({'v1': '230'})
+    assert readings.is_push_fresh(60)
+    assert not readings.is_push_fresh(0)
+    assert readings.non_pushed_slots() == [1, 2]
+
+    slots = readings.ingest_poll({'preac1': '5', 'eaccons1': '1000'}, slots=[1, 2])
+    assert slots == [1, 2]
+    assert list(readings.values) == [230.0, 5.0, 1000.0]
+
+
+def test_ingest_push_updates_all_slots_sharing_a_parameter():
+    readings = DeviceReadings(ReadingLayout(['preac1', None, 'vrms1'], ['r1', 'r1', 'v1']))
+    slots = readings.ingest_push({'r1': '-3.5', 'unknown': '1'})
+
+    assert sorted(slots) == [0, 1]
+    assert list(readings.values[:2]) == [-3.5, -3.5]
+    assert math.isnan(readings.values[2])
@@ -0,0 +1,110 @@
+import asyncio
+import heapq
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from wibeee.scheduler import PollScheduler
+
+
+class FakeTimers(object):
+    """Stands in for the event loop's clock and timers, which only move forward when the test says so."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._timers = []
+        self._seq = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback, *args):
+        handle = SimpleNamespace(when=when, cancelled=False)
+        handle.cancel = lambda: setattr(handle, 'cancelled', True)
+        self._seq += 1
+        heapq.heappush(self._timers, (when, self._seq, handle, callback, args))
+        return handle
+
+    def fire_next(self) -> float:
+        """Runs the next timer that hasn't been cancelled, returning the time it was due."""
+        while True:
+            when, _, handle, callback, args = heapq.heappop(self._timers)
+            if not handle.cancelled:
+                self.now = when
+                callback(*args)
+                return when
+
+
+async def settle() -> None:
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_spreads_polls_and_caps_concurrency():
+    loop = asyncio.get_running_loop()
+    timers = FakeTimers()
+    hass = SimpleNamespace(loop=timers, async_create_task=loop.create_task)
+    jitters = []
+
+    def jitter(low, high):
+        jitters.append((low, high))
+        return high / 2
+
+    scheduler = PollScheduler(hass, max_concurrent=1, jitter=jitter)
+
+    polled = []
+    release = asyncio.Event()
+
+    def make_poll(key):
+        async def poll(now):
+            polled.append(key)
+            await release.wait()
+
+        return poll
+
+    for key in ['a', 'b', 'c']:
+        scheduler.add(key, make_poll(key), timedelta(seconds=30))
+
+    assert [job.phase for job in scheduler._jobs.values()] == [0.0, 10.0, 20.0]
+    assert jitters[-1] == (0, 0.25 * 10)
+
+    # every job fires at its phase plus half of the maximum jitter, 'a' only comes round again at 30s.
+    fired = []
+    for _ in range(3):
+        fired.append(timers.fire_next())
+        await settle()
+    assert fired == [11.25, 21.25, 31.25]
+
+    # 'b' holds the only slot so the others wait for it.
+    assert polled == ['b']
+    assert (scheduler.in_flight, scheduler.waiting) == (1, 2)
+
+    release.set()
+    await settle()
+    assert polled == ['b', 'c', 'a']
+    assert (scheduler.in_flight, scheduler.waiting) == (0, 0)
+    assert scheduler.counters == {'polls': 3, 'skipped': 0, 'failed': 0}
+    scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_skips_poll_while_previous_one_is_running():
+    loop = asyncio.get_running_loop()
+    timers = FakeTimers()
+    scheduler = PollScheduler(SimpleNamespace(loop=timers, async_create_task=loop.create_task), jitter=lambda low, high: 0.0)
+    release = asyncio.Event()
+
+    async def poll(now):
+        await release.wait()
+
+    scheduler.add('a', poll, timedelta(seconds=15))
+    assert [timers.fire_next(), timers.fire_next()] == [15.0, 30.0]
+    await settle()
+    assert scheduler.counters['skipped'] == 1
+
+    release.set()
+    await settle()
+    assert scheduler.counters == {'polls': 1, 'skipped': 1, 'failed': 0}
+    scheduler.stop()
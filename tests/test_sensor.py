@@ -0,0 +1,179 @@
+import asyncio
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import aiohttp
+import pytest
+
+from homeassistant.const import CONF_SCAN_INTERVAL, EVENT_STATE_CHANGED
+from homeassistant.core import HomeAssistant
+
+from wibeee import sensor
+from wibeee.aggregation import WindowAggregator
+from wibeee.api import DeviceInfo
+from wibeee.const import CONF_DEADBAND_VOLTAGE, CONF_DEADBAND_RELATIVE
+from wibeee.readings import ReadingLayout, DeviceReadings
+
+DEVICE_INFO = DeviceInfo(id='X', macAddr='111111111111', softVersion='4.4.124', model='WB3', ipAddr='10.10.10.100')
+VOLTAGE = next(s for s in sensor.KNOWN_SENSORS if s.poll_var_prefix == 'vrms')
+ENERGY = next(s for s in sensor.KNOWN_SENSORS if s.poll_var_prefix == 'eac')
+POWER = next(s for s in sensor.KNOWN_SENSORS if s.poll_var_prefix == 'pac')
+
+
+def make_sensor(sensor_type, initial_value, deadband, force_update_interval=timedelta(minutes=5)):
+    return sensor.WibeeeSensor(DEVICE_INFO, '1', sensor_type, f'{sensor_type.poll_var_prefix}1', 0, initial_value, deadband, force_update_interval)
+
+
+def test_get_deadband():
+    options = {CONF_SCAN_INTERVAL: 15, CONF_DEADBAND_VOLTAGE: 0.5, CONF_DEADBAND_RELATIVE: 1}
+    assert sensor.get_deadband(VOLTAGE, options) == sensor.Deadband(absolute=0.5, relative=0.01)
+    assert sensor.get_deadband(ENERGY, options) == sensor.Deadband()
+
+
+def test_update_value_skips_changes_within_deadband():
+    s = make_sensor(VOLTAGE, 230.0, sensor.Deadband(absolute=0.5))
+    now = time.monotonic()
+    assert not s.update_value(230.0, now)
+    assert not s.update_value(230.4, now)
+    assert s.native_value == 230.0
+
+    assert s.update_value(230.6, now)
+    assert s.native_value == 230.6
+
+    assert s.update_value(float('nan'), now)
+    assert not s.available
+
+
+def test_update_value_forces_update_after_interval():
+    s = make_sensor(VOLTAGE, 230.0, sensor.Deadband(absolute=0.5), force_update_interval=timedelta(minutes=1))
+    assert not s.update_value(230.1, time.monotonic())
+    assert s.update_value(230.1, time.monotonic() + 60)
+    assert s.native_value == 230.1
+
+
+def test_update_value_writes_window_peaks_within_deadband():
+    readings = DeviceReadings(ReadingLayout(['pac1'], ['a1']))
+    aggregator = WindowAggregator(readings, timedelta(seconds=10))
+    s = sensor.WibeeeSensor(DEVICE_INFO, '1', POWER, 'pac1', 0, 1000.0, sensor.Deadband(absolute=50), aggregator=aggregator)
+
+    def window(*pushes: str) -> bool:
+        for value in pushes:
+            aggregator.add(readings.values, readings.ingest_push({'a1': value}))
+        aggregator.reduce()
+        return s.update_value(aggregator.output.values[0], time.monotonic())
+
+    assert window('1000', '1000')
+    assert not window('1000', '1010')
+    # the mean only moves by 30 W but the max spikes by 90 W.
+    assert window('940', '1100')
+    assert s.native_value == 1020.0
+    assert s.extra_state_attributes == {'min': 940.0, 'max': 1100.0, 'samples': 2}
+
+
+@pytest.mark.asyncio
+async def test_forced_update_records_unchanged_state(tmp_path):
+    hass = HomeAssistant()
+    hass.config.config_dir = str(tmp_path)
+    changes = []
+    hass.bus.async_listen(EVENT_STATE_CHANGED, changes.append)
+    try:
+        s = make_sensor(VOLTAGE, 230.0, sensor.Deadband(absolute=0.5), force_update_interval=timedelta(minutes=1))
+        s.hass = hass
+        s.async_write_ha_state()
+        await hass.async_block_till_done()
+        written = hass.states.get(s.entity_id)
+
+        assert s.update_value(230.0, time.monotonic() + 60)
+        s.async_write_ha_state()
+        await hass.async_block_till_done()
+
+        recorded = hass.states.get(s.entity_id)
+        assert (recorded.state, len(changes)) == ('230.0', 2)
+        assert recorded.last_updated > written.last_updated
+    finally:
+        await hass.async_stop(force=True)
+
+
+def test_batch_writes_changed_sensors_once():
+    loop = asyncio.new_event_loop()
+    try:
+        batch = sensor.SensorBatch(SimpleNamespace(loop=loop), 'X', 2)
+        sensors = [make_sensor(VOLTAGE, 230.0, sensor.Deadband()) for _ in range(2)]
+        for slot, s in enumerate(sensors):
+            s.slot = slot
+            s.hass = object()
+        batch.add_sensor(sensors[0])
+
+        readings = DeviceReadings(ReadingLayout(['vrms1', 'vrms2'], [None, None]))
+        with patch.object(sensor.WibeeeSensor, 'async_write_ha_state') as write:
+            for value in ['231', '232']:
+                readings.ingest_poll({'vrms1': value, 'vrms2': value})
+                batch.update(readings, range(2), {})
+
+            loop.call_soon(loop.stop)
+            loop.run_forever()
+
+            assert write.call_count == 1
+            assert sensors[0].native_value == 232.0
+            assert sensors[1].native_value == 230.0
+            assert batch.stats['ingests'] == 2
+            assert batch.stats['writes'] == 1
+    finally:
+        loop.close()
+
+
+def test_get_status_elements_by_model():
+    single_phase = {e.xml_name for e in sensor.get_status_elements('WBM')}
+    assert {'vrms1', 'vrmst', 'pac1', 'pact'} <= single_phase
+    assert not {'vrms2', 'vrms3', 'pac2', 'pac3'} & single_phase
+
+    unknown = {e.xml_name for e in sensor.get_status_elements('XYZ')}
+    assert unknown == {e.xml_name for e in sensor.get_status_elements()}
+    assert {'vrms1', 'vrms2', 'vrms3', 'vrmst'} <= unknown
+
+
+class FakeAPI(object):
+    """Answers values.xml requests with the results queued for var queries and full dumps, recording the requests."""
+
+    def __init__(self, var_results: list, full_values: dict):
+        self.var_results = var_results
+        self.full_values = full_values
+        self.requests = []
+
+    async def async_fetch_values(self, device_id, var_names=None, retries=0):
+        self.requests.append('var' if var_names else 'full')
+        if not var_names:
+            return self.full_values
+        result = self.var_results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+async def poll_three_times(fake_api: FakeAPI) -> None:
+    readings = DeviceReadings(ReadingLayout(['vrms1'], [None]))
+    batch = sensor.SensorBatch(SimpleNamespace(loop=asyncio.get_running_loop()), 'X', 1)
+    scheduler = SimpleNamespace(add=lambda key, poll, interval: poll)
+    with patch.object(sensor, 'get_poll_scheduler', return_value=scheduler):
+        poll = sensor.setup_local_polling(None, fake_api, DEVICE_INFO, batch, readings, timedelta(seconds=15))
+    for _ in range(3):
+        await poll(time.time())
+    assert readings.values[0] == 230.0
+
+
+@pytest.mark.asyncio
+async def test_polling_keeps_var_queries_after_transient_error():
+    fake_api = FakeAPI([asyncio.TimeoutError(), {'vrms1': '230'}, {'vrms1': '230'}], {'vrms1': '230'})
+    await poll_three_times(fake_api)
+    # the timeout fails that poll without a second, bigger request to a device that is already struggling.
+    assert fake_api.requests == ['var', 'var', 'var']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('rejection', [{}, aiohttp.ClientResponseError(None, (), status=400)])
+async def test_polling_stops_var_queries_when_unsupported(rejection):
+    fake_api = FakeAPI([rejection], {'vrms1': '230'})
+    await poll_three_times(fake_api)
+    assert fake_api.requests == ['var', 'full', 'full', 'full']
@@ -0,0 +1,127 @@
+import asyncio
+import math
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from wibeee import sensor
+from wibeee.const import DOMAIN, CONF_SITE
+from wibeee.readings import ReadingLayout, DeviceReadings
+from wibeee.scheduler import PollScheduler, DATA_POLL_SCHEDULER
+from wibeee import async_remove_entry
+from wibeee.site import SiteMeter, SITE_STALE_AFTER, get_site_meter, get_site_store
+
+LAYOUT = ReadingLayout(['pact', 'eact', 'vrms1'], ['at', 'et', 'v1'])
+POWER, ENERGY = 0, 1
+
+
+def push(meter: SiteMeter, name: str, data: dict) -> None:
+    readings = DeviceReadings(LAYOUT)
+    meter.members[name].update(readings.values, readings.ingest_push(data))
+
+
+def test_power_counts_reporting_members_only():
+    meter = SiteMeter(asyncio.new_event_loop())
+    meter.add_member('a', LAYOUT)
+    meter.add_member('b', LAYOUT)
+    assert meter.value(POWER) is None
+
+    push(meter, 'a', {'at': '100'})
+    push(meter, 'b', {'at': '-40'})
+    push(meter, 'a', {'at': '150'})
+    assert (meter.value(POWER), meter.reporting[POWER]) == (110.0, 2)
+
+    push(meter, 'b', {'at': '-'})
+    assert (meter.value(POWER), meter.reporting[POWER]) == (150.0, 1)
+
+    meter.members['a'].updated_at = time.monotonic() - SITE_STALE_AFTER.total_seconds() - 1
+    meter.check_stale()
+    assert meter.value(POWER) is None
+    assert meter.members['a'].stale
+
+    push(meter, 'a', {'at': '90'})
+    meter.remove_member('b')
+    assert meter.value(POWER) == 90.0
+
+
+def test_energy_adds_increases_and_survives_resets_and_restarts():
+    meter = SiteMeter(asyncio.new_event_loop())
+    meter.add_member('a', LAYOUT)
+    meter.add_member('b', LAYOUT)
+    for name, energy in [('a', '1000'), ('b', '500'), ('a', '1010'), ('b', '-'), ('b', '520'), ('a', '3')]:
+        push(meter, name, {'et': energy})
+    assert meter.value(ENERGY) == 10.0 + 20.0 + 3.0
+
+    meter.remove_member('b')
+    assert meter.value(ENERGY) == 33.0
+
+    restarted = SiteMeter(asyncio.new_event_loop(), saved=meter._data())
+    assert restarted.value(ENERGY) == 33.0
+    restarted.add_member('b', LAYOUT)
+    push(restarted, 'b', {'et': '530'})
+    assert restarted.value(ENERGY) == 43.0
+    assert math.isnan(restarted.members['b'].values[POWER])
+
+
+@pytest.mark.asyncio
+async def test_devices_only_report_while_site_entry_is_loaded(tmp_path):
+    hass = HomeAssistant()
+    hass.config.config_dir = str(tmp_path)
+    readings = DeviceReadings(LAYOUT)
+    batch = sensor.SensorBatch(hass, 'a', LAYOUT.size)
+    hass.data[DOMAIN] = {'device': {'disposers': {}, 'batch': batch, 'readings': readings}, DATA_POLL_SCHEDULER: PollScheduler(hass)}
+
+    def push_energy(energy: str) -> None:
+        batch.update(readings, readings.ingest_push({'et': energy}), {})
+
+    try:
+        with patch.object(Store, 'async_delay_save') as delay_save:
+            sensor.async_join_site_meter(hass, batch, readings)
+            push_energy('1000')
+            assert get_site_meter(hass) is None
+            assert batch.site is None
+            delay_save.assert_not_called()
+
+            # the site entry picks up the devices that are already loaded, starting from their current readings.
+            meter, stop_site = await sensor.async_start_site_meter(hass)
+            push_energy('1010')
+            assert meter.value(ENERGY) == 10.0
+            assert delay_save.called
+
+            stop_site()
+            assert get_site_meter(hass) is None
+            assert batch.site is None and not meter.members
+    finally:
+        await hass.async_stop(force=True)
+
+
+@pytest.mark.asyncio
+async def test_removing_site_entry_removes_its_totals(tmp_path):
+    hass = HomeAssistant()
+    hass.config.config_dir = str(tmp_path)
+    readings = DeviceReadings(LAYOUT)
+    batch = sensor.SensorBatch(hass, 'a', LAYOUT.size)
+    hass.data[DOMAIN] = {'device': {'disposers': {}, 'batch': batch, 'readings': readings}}
+    try:
+        meter, stop_site = await sensor.async_start_site_meter(hass)
+        for energy in ['1000', '1010']:
+            batch.update(readings, readings.ingest_push({'et': energy}), {})
+        await get_site_store(hass).async_save(meter._data())
+        assert os.path.exists(get_site_store(hass).path)
+
+        # a save is pending when the entry is unloaded and removed.
+        batch.update(readings, readings.ingest_push({'et': '1020'}), {})
+        stop_site()
+        await async_remove_entry(hass, SimpleNamespace(entry_id='site', data={CONF_SITE: True}))
+        assert await get_site_store(hass).async_load() is None
+
+        # and the cancelled save is not written at shutdown either.
+        await hass.async_stop(force=True)
+        assert not os.path.exists(get_site_store(hass).path)
+    finally:
+        await hass.async_stop(force=True)